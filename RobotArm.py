@@ -1,6 +1,17 @@
-import ev3dev.ev3 as ev3
+import threading
 import time
 
+import robotClock
+from deviceBackend import loadBackend
+from instrumentation import timed
+from sensorService import SensorService
+from waiting import WaitTimeout, waitUntil
+
+
+class MotionAborted(Exception):
+    """Raised inside a movement of the arm when emergencyStop was called while it was running"""
+    pass
+
 
 class RobotArm(object):
     """The class to create a robot arm manager object."""
@@ -23,10 +34,36 @@ class RobotArm(object):
 
     # ---------------------------------------------------------------------------
 
-    def __init__(self, name="Duc", configDict=DEFAULT_CONFIG):
-        """Take the configuration and set up the robot arm."""
+    # ---------------------------------------------------------------------------
+    # Positioning modes of forwardExact, backwardExact and turnExact
+    # SENSOR_MODE runs the motor until the ultrasonic sensor or the gyro reads the target
+    SENSOR_MODE = "sensor"
+    # ENCODER_MODE runs the motor by the tacho counts of the distance, the sensors only check the end position
+    ENCODER_MODE = "encoder"
+    # The models of the encoders for the current gears, until calibrateEncoders measures them at startup
+    CM_PER_COUNT = 0.012
+    DEGREES_PER_COUNT = 0.33
+    # The speeds of the sensor mode (slow so the polling does not overshoot) and of the encoder mode
+    SENSOR_SPEED = 0.05
+    ENCODER_SPEED = 0.3
+    # The error left after an encoder move above which one correction move is done
+    DISTANCE_TOLERANCE = 0.5
+    ANGLE_TOLERANCE = 1
+    # The time a movement can take on top of twice its expected time, in seconds, and the longest wait of a movement
+    # with no expected time. A motor still running after it is considered stuck
+    MOTION_TIMEOUT = 30
+    # The largest turn of the arm, from one end of its range to the other, in degrees
+    MAX_TURN = 360
+    # ---------------------------------------------------------------------------
+
+    def __init__(self, name="Duc", configDict=DEFAULT_CONFIG, backend=None):
+        """
+        Take the configuration and set up the robot arm.
+        backend is the module of the devices, ev3dev.ev3 or the simulation ev3sim, chosen by loadBackend by default.
+        """
         super(RobotArm, self).__init__()
         self.name = name
+        self.ev3 = backend if backend is not None else loadBackend()
         self.turning_motor = None
         self.vertical_move_motor = None
         self.surface_move_motor = None
@@ -38,6 +75,14 @@ class RobotArm(object):
         # ====== Variable to control the state of the arm
         self.handIsHolding = False
         self.pickingUpMode = False
+        # Set by emergencyStop from any thread, every movement checks it and raises MotionAborted
+        self.abortEvent = threading.Event()
+        # The background sampling of the sensors, see startSensorService
+        self.sensorService = None
+        # How forwardExact, backwardExact and turnExact reach their target, and the models of the encoders
+        self.positioningMode = self.SENSOR_MODE
+        self.cmPerCount = self.CM_PER_COUNT
+        self.degreesPerCount = self.DEGREES_PER_COUNT
 
         if configDict is not None:
             # Call the set up method with configDict
@@ -70,15 +115,15 @@ class RobotArm(object):
     def setUpMotor(self, motorName, port):
         """Set upt the motor with given port."""
         if motorName == self.TURNING_MOTOR:
-            self.turning_motor = ev3.LargeMotor(port)
+            self.turning_motor = self.ev3.LargeMotor(port)
         elif motorName == self.VERTICAL_MOVE_MOTOR:
-            self.vertical_move_motor = ev3.LargeMotor(port)
+            self.vertical_move_motor = self.ev3.LargeMotor(port)
         elif motorName == self.SURFACE_MOVE_MOTOR:
-            self.surface_move_motor = ev3.LargeMotor(port)
+            self.surface_move_motor = self.ev3.LargeMotor(port)
             # The movement should hold position all the time for accurate calculation
             self.surface_move_motor.stop_action = "hold"
         elif motorName == self.HAND:
-            self.hand = ev3.MediumMotor(port)
+            self.hand = self.ev3.MediumMotor(port)
             self.hand.speed_sp = self.hand.max_speed // 10
         else:
             print("Cannot find the motor name: ", motorName)
@@ -86,34 +131,78 @@ class RobotArm(object):
     def setUpTouchSensor(self, touchSensorName, port):
         """Set up the touch sensor with given port."""
         if touchSensorName == self.BOTTOM_TOUCH_SENSOR:
-            self.bottom_touch_sensor = ev3.TouchSensor(port)
+            self.bottom_touch_sensor = self.ev3.TouchSensor(port)
         else:
             print("No device found named: ", touchSensorName)
 
     def setUpUltrasonicSensor(self, port):
         """Set up the ultrasonic sensor with given port."""
-        self.ultrasonic_sensor = ev3.UltrasonicSensor(port)
+        self.ultrasonic_sensor = self.ev3.UltrasonicSensor(port)
         self.ultrasonic_sensor.mode = "US-DIST-CM"
 
     def setUpGyroSensor(self, port):
         """Set up the gyro sensor with given port."""
-        self.gyro_sensor = ev3.GyroSensor(port)
+        self.gyro_sensor = self.ev3.GyroSensor(port)
         self.setHeading()
 
     def setHeading(self):
         """Set the heading of the robot to the current direction"""
-        if self.gyro_sensor is not None:
-            self.gyro_sensor.mode = "GYRO-CAL"
-            time.sleep(0.2)
-            self.gyro_sensor.mode = "GYRO-ANG"
-            self.gyro_sensor.mode = "GYRO-CAL"
-            time.sleep(0.2)
-            self.gyro_sensor.mode = "GYRO-ANG"
+        if self.gyro_sensor is not None and self.sensorService is not None:
+            # The service must not read the gyro while it is reset, nor keep the angles from before the reset
+            with self.sensorService.deviceLock:
+                self.resetGyro()
+                self.sensorService.clear("angle")
+            self.sensorService.waitForNewSample(timeout=1)
+        elif self.gyro_sensor is not None:
+            self.resetGyro()
         else:
             print("Cannot find gyro sensor")
 
+    def resetGyro(self):
+        """Method to reset the angle of the gyro sensor to 0 by switching its mode"""
+        self.gyro_sensor.mode = "GYRO-CAL"
+        robotClock.sleep(0.2)
+        self.gyro_sensor.mode = "GYRO-ANG"
+        self.gyro_sensor.mode = "GYRO-CAL"
+        robotClock.sleep(0.2)
+        self.gyro_sensor.mode = "GYRO-ANG"
+
+    def startSensorService(self, sampleRate=SensorService.SAMPLE_RATE):
+        """
+        Method to start sampling the sensors on a background thread, so reading a sensor never waits on the device.
+        The distance is then the median of the last samples instead of the mode of 11 readings in a row.
+        """
+        sensors = {}
+        if self.ultrasonic_sensor is not None:
+            sensors["distance"] = lambda: self.ultrasonic_sensor.distance_centimeters
+        if self.gyro_sensor is not None:
+            sensors["angle"] = lambda: self.gyro_sensor.angle
+        if self.bottom_touch_sensor is not None:
+            sensors["touch"] = lambda: self.bottom_touch_sensor.value()
+        self.sensorService = SensorService(sensors, sampleRate)
+        self.sensorService.start()
+
+    def stopSensorService(self):
+        """Method to stop the background sampling, the sensors are then read directly again"""
+        if self.sensorService is not None:
+            self.sensorService.stop()
+            self.sensorService = None
+
+    def waitForSensors(self):
+        """
+        Method to wait for the next samples of the sensor service, so a control loop reads a fresh value
+        instead of spinning on the same one. Without the service, the reads wait on the device anyway.
+        """
+        if self.sensorService is not None:
+            self.sensorService.waitForNewSample(timeout=4 * self.sensorService.samplePeriod)
+
     def readDistance(self):
         """Method to read the current distance to the nearest wall in front"""
+        if self.sensorService is not None and "distance" in self.sensorService.sensors:
+            distance = self.sensorService.read("distance")[0]
+            # Only read the sensor directly while the service has no sample yet
+            if distance is not None:
+                return distance
         if self.ultrasonic_sensor is not None:
             distances = {}
             for i in range(11):
@@ -136,6 +225,10 @@ class RobotArm(object):
 
     def readTouch(self):
         """Method to read the current value of the touch sensor"""
+        if self.sensorService is not None and "touch" in self.sensorService.sensors:
+            touch = self.sensorService.read("touch", "latest")[0]
+            if touch is not None:
+                return touch
         if self.bottom_touch_sensor is not None:
             return self.bottom_touch_sensor.value()
         else:
@@ -147,7 +240,12 @@ class RobotArm(object):
         The heading is to the right side of the origin
         """
         if self.gyro_sensor is not None:
-            angle = self.gyro_sensor.angle
+            angle = None
+            if self.sensorService is not None:
+                # The gyro angle is already integrated, a filter would only make it lag
+                angle = self.sensorService.read("angle", "latest")[0]
+            if angle is None:
+                angle = self.gyro_sensor.angle
             if angle < 0:
                 # With the current design, the left direction will be negative result
                 return 360 - abs(angle) % 360
@@ -163,6 +261,7 @@ class RobotArm(object):
         time (in seconds), the arm will move up forever.
         The arm will hold its position with stop_action="hold"
         """
+        self.checkAbort()
         # Calculate the speed to move up
         # Speed is negative to go up
         speed = -(self.vertical_move_motor.max_speed * speed)
@@ -177,7 +276,8 @@ class RobotArm(object):
         else:
             # Time is in seconds, so convert it to miliseconds
             self.vertical_move_motor.run_timed(time_sp=time * 1000)
-        self.vertical_move_motor.wait_until_not_moving()
+        # An emergency stop also ends the wait, with MotionAborted
+        self.waitForMotor(self.vertical_move_motor, "verticalMove", self.timedMotionTimeout(time))
 
     def moveDown(self, speed, time=None):
         """Method to move the arm down with speed from 0 to 1. If there is no given
@@ -189,6 +289,7 @@ class RobotArm(object):
     def forward(self, speed, time=None, wait_until_not_moving=True):
         """Method to move the arm forward. If there is no given time, the arm will move
         forward forever."""
+        self.checkAbort()
         # Calculate speed to move
         # With the design of the robot, negative speed will make it forward
         self.surface_move_motor.speed_sp = \
@@ -200,19 +301,25 @@ class RobotArm(object):
             # Time is in seconds, so convert it to miliseconds
             self.surface_move_motor.run_timed(time_sp=time * 1000)
         if wait_until_not_moving:
-            self.surface_move_motor.wait_until_not_moving()
+            self.waitForMotor(self.surface_move_motor, "surfaceMove", self.timedMotionTimeout(time))
 
     def backward(self, speed, time=None, wait_until_not_moving=True):
         """Method to move the arm backward. If there is no given time, the arm will move
         backward forever"""
         self.forward(-speed, time, wait_until_not_moving)
 
-    def forwardExact(self, distance, speed=0.05):
+    @timed()
+    def forwardExact(self, distance, speed=None):
         """Method to move the arm forward with the exact distance in cm. The speed
         of movement is optional, and should NOT be provided unless there is an absolute need."""
         if distance <= 0:
             print("Incorrect input for distance, distance should be larger than 0.")
             return
+        if self.positioningMode == self.ENCODER_MODE:
+            self.moveSurfaceByEncoder(distance, speed if speed is not None else self.ENCODER_SPEED)
+            return
+        if speed is None:
+            speed = self.SENSOR_SPEED
 
         current_distance_to_wall = self.readDistance()
         target_distance = current_distance_to_wall - distance
@@ -224,19 +331,23 @@ class RobotArm(object):
         # Begin movement
         self.forward(speed, wait_until_not_moving=False)
         # Check for distance
-        while True:
-            current_distance = self.readDistance()
-            if current_distance <= target_distance:
-                self.stopMoving()
-                return
+        self.waitUntil(lambda: self.readDistance() <= target_distance, "forwardExact",
+                       self.motionTimeout(self.surface_move_motor, distance / self.cmPerCount, speed), pollSensors=True)
+        self.stopMoving()
 
-    def backwardExact(self, distance, speed=0.05):
+    @timed()
+    def backwardExact(self, distance, speed=None):
         """Method to move the arm backward with the exact distance in cm. The speed
         of movement is optional and should NOT be provided unless there is there is
         an absolute need."""
         if distance <= 0:
             print("Incorrect input for distance, distance should be larger than 0.")
             return
+        if self.positioningMode == self.ENCODER_MODE:
+            self.moveSurfaceByEncoder(-distance, speed if speed is not None else self.ENCODER_SPEED)
+            return
+        if speed is None:
+            speed = self.SENSOR_SPEED
 
         current_distance_to_wall = self.readDistance()
         target_distance = current_distance_to_wall + distance
@@ -248,12 +359,107 @@ class RobotArm(object):
         # Begin movement
         self.backward(speed, wait_until_not_moving=False)
         # Check for distance
-        while True:
-            current_distance = self.readDistance()
+        self.waitUntil(lambda: self.readDistance() >= target_distance, "backwardExact",
+                       self.motionTimeout(self.surface_move_motor, distance / self.cmPerCount, speed), pollSensors=True)
+        self.stopMoving()
+
+    def readAngle(self):
+        """Method to read the raw angle of the gyro sensor, not wrapped to 0-359 like readHeading"""
+        if self.sensorService is not None and "angle" in self.sensorService.sensors:
+            angle = self.sensorService.read("angle", "latest")[0]
+            if angle is not None:
+                return angle
+        return self.gyro_sensor.angle
+
+    def settleSensors(self):
+        """Method to wait until the filtered sensor values only come from samples taken after the arm stopped"""
+        if self.sensorService is not None:
+            for _ in range(self.sensorService.MEDIAN_WINDOW):
+                self.waitForSensors()
+
+    def runToRelativePosition(self, motor, counts, speed):
+        """
+        Method to turn a motor by a number of tacho counts with speed from 0 to 1, and wait until it is there.
+        The motor holds its position at the end. Return the number of counts it actually turned.
+        """
+        startPosition = motor.position
+        motor.stop_action = "hold"
+        motor.speed_sp = motor.max_speed * abs(speed)
+        motor.position_sp = int(round(counts))
+        motor.run_to_rel_pos()
+        self.waitForMotor(motor, "runToRelativePosition", self.motionTimeout(motor, counts, speed))
+        return motor.position - startPosition
+
+    def moveSurfaceByEncoder(self, distance, speed=ENCODER_SPEED):
+        """
+        Method to move the arm forward (backward if distance is negative) by distance cm with the tacho counts.
+        The ultrasonic sensor checks the distance traveled at the end, and one slow correction move
+        fixes an error larger than DISTANCE_TOLERANCE. Return the distance traveled read by the sensor.
+        """
+        startDistance = self.readDistance()
+        # With the design of the robot, negative counts move the arm forward
+        self.runToRelativePosition(self.surface_move_motor, -distance / self.cmPerCount, speed)
+        self.settleSensors()
+        traveled = startDistance - self.readDistance()
+
+        error = distance - traveled
+        if abs(error) > self.DISTANCE_TOLERANCE:
+            # DEBUG: Comment out when done
+            print("=====> ENCODER MOVE OFF BY ", error, " cm, CORRECTING")
+            self.runToRelativePosition(self.surface_move_motor, -error / self.cmPerCount, self.SENSOR_SPEED)
+            self.settleSensors()
+            traveled = startDistance - self.readDistance()
+        return traveled
+
+    def turnByEncoder(self, angle, speed=ENCODER_SPEED):
+        """
+        Method to turn the arm by angle degrees (to the right if positive) with the tacho counts.
+        The gyro checks the angle turned at the end, and one slow correction turn fixes an error
+        larger than ANGLE_TOLERANCE. Return the angle turned read by the gyro.
+        """
+        startAngle = self.readAngle()
+        # In the current setting, positive counts turn the arm to the right
+        self.runToRelativePosition(self.turning_motor, angle / self.degreesPerCount, speed)
+        self.settleSensors()
+        turned = self.readAngle() - startAngle
+
+        error = angle - turned
+        if abs(error) > self.ANGLE_TOLERANCE:
+            # DEBUG: Comment out when done
+            print("=====> ENCODER TURN OFF BY ", error, " degrees, CORRECTING")
+            self.runToRelativePosition(self.turning_motor, error / self.degreesPerCount, self.SENSOR_SPEED)
+            self.settleSensors()
+            turned = self.readAngle() - startAngle
+        return turned
+
+    def calibrateEncoders(self, distance=10, angle=-30):
+        """
+        Method to measure the cm per count of the surface motor and the degree per count of the turning motor.
+        The arm moves forward by about distance cm and turns by about angle degrees (to the left by default,
+        the start position is against the touch sensor on the right), measuring both with the sensors,
+        then goes back to where it was. Call this with free space in front and on the side of the turn.
+        """
+        startDistance = self.readDistance()
+        counts = self.runToRelativePosition(self.surface_move_motor, -distance / self.cmPerCount, self.SENSOR_SPEED)
+        self.settleSensors()
+        traveled = startDistance - self.readDistance()
+        if counts != 0 and traveled > 0:
+            self.cmPerCount = traveled / abs(counts)
+        else:
+            print("Cannot calibrate the surface motor, keep ", self.cmPerCount, " cm per count")
+        self.runToRelativePosition(self.surface_move_motor, -counts, self.SENSOR_SPEED)
+
+        startAngle = self.readAngle()
+        counts = self.runToRelativePosition(self.turning_motor, angle / self.degreesPerCount, self.SENSOR_SPEED)
+        self.settleSensors()
+        turned = self.readAngle() - startAngle
+        if counts != 0 and turned != 0:
+            self.degreesPerCount = abs(turned / counts)
+        else:
+            print("Cannot calibrate the turning motor, keep ", self.degreesPerCount, " degrees per count")
+        self.runToRelativePosition(self.turning_motor, -counts, self.SENSOR_SPEED)
 
-            if current_distance >= target_distance:
-                self.stopMoving()
-                return
+        print("=====> CM PER COUNT: ", self.cmPerCount, " DEGREES PER COUNT: ", self.degreesPerCount)
 
     def stopMoving(self):
         """Method to stop the surface movement"""
@@ -283,6 +489,7 @@ class RobotArm(object):
         wait_until_not_moving will make sure the robot stop before doing the next command, set this
         to False if needed to do some checking while turning
         """
+        self.checkAbort()
         # In the current setting, a positive speed will make the robot turn right
         speed = self.turning_motor.max_speed * speed
         self.turning_motor.speed_sp = speed
@@ -295,7 +502,7 @@ class RobotArm(object):
         else:
             self.turning_motor.run_timed(time_sp=time * 1000)
         if wait_until_not_moving:
-            self.turning_motor.wait_until_not_moving()
+            self.waitForMotor(self.turning_motor, "turn", self.timedMotionTimeout(time))
 
     def turnLeft(self, speed, time=None, wait_until_not_moving=True):
         """Method to turn the arm to the left with speed from 0 to 1.
@@ -312,6 +519,7 @@ class RobotArm(object):
 
     def handHold(self):
         """Method to wrap an object"""
+        self.checkAbort()
         if not self.handIsHolding:
             self.hand.speed_sp = -self.hand.speed_sp
             self.hand.stop_action = "hold"
@@ -319,7 +527,7 @@ class RobotArm(object):
             self.handIsHolding = True
 
             # Make sure to wait_until_not_moving
-            self.hand.wait_until_not_moving()
+            self.waitForMotor(self.hand, "hand")
 
     def handRelease(self):
         """Method to release an object from hand"""
@@ -341,14 +549,15 @@ class RobotArm(object):
             self.handIsHolding = False
 
             # Make sure to wait until not moving
-            self.hand.wait_until_not_moving()
+            self.waitForMotor(self.hand, "hand")
 
     def stopTurning(self):
         """Method to stop the turning_motor"""
         self.turning_motor.stop()
         return True
 
-    def turnExact(self, angle, speed=0.05):
+    @timed()
+    def turnExact(self, angle, speed=None):
         """Method to turn the arm to left or right with the exact angle
         If the angle value is positive, turn to the right.
         If the angle value is negative, tur to the left.
@@ -356,6 +565,11 @@ class RobotArm(object):
         # Make sure there will be no turn if angle = 0
         if angle == 0:
             return
+        if self.positioningMode == self.ENCODER_MODE:
+            self.turnByEncoder(angle, speed if speed is not None else self.ENCODER_SPEED)
+            return
+        if speed is None:
+            speed = self.SENSOR_SPEED
         # Set the current heading to be origin 0
         self.setHeading()
 
@@ -370,22 +584,26 @@ class RobotArm(object):
         else:
             # Initiate the right turn
             self.turnRight(speed, wait_until_not_moving=False)
-        while True:
+
+        def headingReached():
             # Accept error of 1 degree
             currentHeading = self.readHeading()
             print("===> CURRENT HEADING: ", currentHeading)
-            if currentHeading in acceptedRange:
-                self.stopTurning()
-                break
+            return currentHeading in acceptedRange
+        self.waitUntil(headingReached, "turnExact",
+                       self.motionTimeout(self.turning_motor, angle / self.degreesPerCount, speed), pollSensors=True)
+        self.stopTurning()
 
     def turnToStartPosition(self):
         """Method to turn the arm to the starting position (until touch the Touch sensor)"""
         self.turnRight(0.05, time=None, wait_until_not_moving=False)
-        while not self.readTouch():
-            pass
+        self.waitUntil(self.readTouch, "turnToStartPosition",
+                       self.motionTimeout(self.turning_motor, self.MAX_TURN / self.degreesPerCount, 0.05),
+                       pollSensors=True)
         self.turning_motor.stop()
 
 
+    @timed()
     def pickUp(self):
         """Method to pick up an object"""
         if not self.pickingUpMode:
@@ -396,33 +614,28 @@ class RobotArm(object):
         # Ready to do the pick up work
         self.moveDown(0.05, 1.8)
 
-        while self.isGoingUpDown():
-            pass
+        self.waitForMotor(self.vertical_move_motor, "verticalMove")
         self.handHold()
 
-        while self.isUsingHand():
-            pass
+        self.waitForMotor(self.hand, "hand")
 
         self.moveUp(0.05, 2)
-        while self.isGoingUpDown():
-            pass
+        self.waitForMotor(self.vertical_move_motor, "verticalMove")
 
+    @timed()
     def dropDown(self):
         """Method to drop an object"""
         if self.pickingUpMode:
             # Only work when the robot is in picking mode
             self.moveDown(0.05, 1.8)
 
-            while self.isGoingUpDown():
-                pass
+            self.waitForMotor(self.vertical_move_motor, "verticalMove")
             self.handRelease()
 
-            while self.isUsingHand():
-                pass
+            self.waitForMotor(self.hand, "hand")
 
             self.moveUp(0.05, 2)
-            while self.isGoingUpDown():
-                pass
+            self.waitForMotor(self.vertical_move_motor, "verticalMove")
 
     def isTurning(self):
         """Method to check whether the arm is turning"""
@@ -439,3 +652,87 @@ class RobotArm(object):
     def isUsingHand(self):
         """Method to check whether the hand is being used"""
         return self.hand.is_running
+
+    # ---------------------------------------------------------------------------
+    # Emergency stop, these methods can be called from another thread while the arm is moving
+
+    def emergencyStop(self):
+        """
+        Method to stop all the motors right away and abort the movement in progress, which raises MotionAborted.
+        The arm holds its position, so a held piece does not fall. Call resetAbort before the next movement.
+        Return the time taken to stop the motors, in seconds.
+        """
+        start = time.perf_counter()
+        self.abortEvent.set()
+        self.stopAllMotors()
+        return time.perf_counter() - start
+
+    def stopAllMotors(self):
+        """Method to stop the 4 motors and make them hold their position"""
+        for motor in (self.surface_move_motor, self.turning_motor, self.vertical_move_motor, self.hand):
+            if motor is not None:
+                motor.stop_action = "hold"
+                motor.stop()
+
+    def resetAbort(self):
+        """Method to allow the arm to move again after an emergency stop"""
+        self.abortEvent.clear()
+
+    def checkAbort(self):
+        """Method to raise MotionAborted if an emergency stop was requested"""
+        if self.abortEvent.is_set():
+            # A motor may have been started just after the emergency stop, stop everything again
+            self.stopAllMotors()
+            raise MotionAborted("The movement of " + self.name + " was aborted by an emergency stop")
+
+    def waitUntil(self, condition, name="wait", timeout=MOTION_TIMEOUT, pollSensors=False):
+        """
+        Method to wait until condition() is true without spinning the CPU (see waiting.waitUntil).
+        An emergency stop ends the wait with MotionAborted. After timeout seconds all the motors are stopped
+        and WaitTimeout is raised, so a stuck motor does not hang the robot.
+        If pollSensors is True, the condition reads a sensor and is polled once per round of the sensor service,
+        or right away without the service since reading the sensor already takes time.
+        """
+        def checkedCondition():
+            self.checkAbort()
+            return condition()
+
+        if pollSensors:
+            interval = self.sensorService.samplePeriod if self.sensorService is not None else 0
+            intervals = {"interval": interval, "maxInterval": interval}
+        else:
+            intervals = {}
+        try:
+            return waitUntil(checkedCondition, timeout, name, wakeEvent=self.abortEvent, **intervals)
+        except WaitTimeout:
+            self.stopAllMotors()
+            raise
+
+    def waitForMotor(self, motor, name="motor", timeout=MOTION_TIMEOUT):
+        """
+        Method to wait until a motor stops running, or stalls like with wait_until_not_moving of ev3dev,
+        see waitUntil
+        """
+        def stopped():
+            state = motor.state
+            return "running" not in state or "stalled" in state
+        return self.waitUntil(stopped, name, timeout)
+
+    def motionTimeout(self, motor, counts, speed):
+        """
+        Method to get the timeout of turning motor by a number of tacho counts with speed from 0 to 1:
+        twice the time it should take, plus MOTION_TIMEOUT
+        """
+        countsPerSecond = motor.max_speed * abs(speed)
+        if countsPerSecond == 0:
+            return self.MOTION_TIMEOUT
+        return 2 * abs(counts) / countsPerSecond + self.MOTION_TIMEOUT
+
+    def timedMotionTimeout(self, seconds):
+        """Method to get the timeout of a movement run for some seconds, or forever if seconds is None"""
+        return self.MOTION_TIMEOUT if seconds is None else seconds + self.MOTION_TIMEOUT
+
+    def sleep(self, seconds):
+        """Method to wait for some seconds, an emergency stop ends the wait with MotionAborted"""
+        if robotClock.waitEvent(self.abortEvent, seconds):
+            self.checkAbort()
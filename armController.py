@@ -0,0 +1,310 @@
+import threading
+import time
+
+import robotClock
+from RobotArm import MotionAborted, RobotArm
+from armPose import HOME_POSE, ArmKinematics, ArmPoseTracker
+from instrumentation import timed
+from motionScheduler import MotionScheduler
+from waiting import WaitTimeout
+
+
+def startArmController(robot, squareLength):
+    """
+    Bring the arm from its start position (against the touch sensor, the hand resting on the surface) to the
+    home position and create its ArmController. squareLength is the side of a square of the chessboard in cm.
+    """
+    # Sample the sensors in the background, the control loops then never wait on 11 ultrasonic readings
+    robot.startSensorService()
+
+    robot.armToStraightPosition()
+    # Measure the encoders once, then move by the tacho counts: faster and without the overshoot of the polling
+    robot.calibrateEncoders()
+    robot.positioningMode = RobotArm.ENCODER_MODE
+    robot.turnExact(-5)
+    # The arm is at the home position, the moves start from there
+    poseTracker = ArmPoseTracker(ArmKinematics(squareLength), robot.readDistance())
+    return ArmController(robot, poseTracker)
+
+
+class ArmController:
+    """
+    The motions of the robot arm for the chess game: carrying pieces between squares, the graveyard and the reserve,
+    and homing. The arm starts every motion from wherever the last one left it (see ArmPoseTracker).
+    The steps run on the motion scheduler: in ENCODER_MODE a turn and a move on the surface that do not
+    depend on each other run at the same time, only picking up and dropping wait for both axes.
+    The methods moving the arm block until the motion is done, run one at a time. status and emergencyStop
+    can be called from any thread while the arm moves.
+    """
+
+    # The name of the step turning the arm off the board after the last piece is dropped
+    RETRACT_STEP = "retract"
+
+    def __init__(self, robot, poseTracker):
+        self.robot = robot
+        self.poseTracker = poseTracker
+        # The timing report of the last operations, see MotionScheduler.run
+        self.lastMoveReport = None
+        # The number of pieces taken to the graveyard, the next one goes to the next slot
+        self.graveyardCount = 0
+        # The names of the steps moving the arm right now
+        self.runningSteps = set()
+        self.__stepsLock = threading.Lock()
+
+    # ---------------------------------------------------------------------------
+    # Operations
+
+    def execute(self, operations, listener=None):
+        """
+        Method to run a list of operations (see planOperations), listener gets the progress of every step.
+        Return the final message: its "status" is "done" with the timing report, "aborted", "timeout",
+        or "error" for an invalid list of operations.
+        """
+        try:
+            # Check the whole batch before moving anything
+            self.planOperations(operations)
+        except (ValueError, KeyError, TypeError) as error:
+            return {"status": "error", "error": repr(error)}
+
+        try:
+            # A new motion is allowed to run even if the last one was stopped
+            self.robot.resetAbort()
+            report = self.runOperations(operations, listener)
+        except MotionAborted:
+            print("=====> Operations aborted, the arm is stopped where it was")
+            return {"status": "aborted"}
+        except WaitTimeout as error:
+            print("=====> Operations stopped, a motor or sensor is stuck: ", error)
+            return {"status": "timeout", "error": str(error)}
+
+        report["status"] = "done"
+        return report
+
+    @timed()
+    def movePiece(self, pos1, pos2):
+        """Method to move a piece from pos1 to pos2, see runOperations"""
+        report = self.runOperations([{"op": "move", "from": pos1, "to": pos2}])
+        report["move"] = pos1 + "-" + pos2
+        return report
+
+    def planOperations(self, operations):
+        """
+        Method to turn a list of operations into the list of (name, pose to pick up at, pose to drop at).
+        An operation is a dict: {"op": "move", "from": "E2", "to": "E4"} moves a piece on the board,
+        {"op": "remove", "from": "D5"} takes a piece to the next slot of the graveyard, and
+        {"op": "place", "piece": "Q", "to": "E8"} brings a piece of the reserve on the board (for a promotion).
+        Raise KeyError or ValueError for an invalid operation.
+        """
+        kinematics = self.poseTracker.kinematics
+        graveyardSlot = self.graveyardCount
+        plan = []
+        for number, operation in enumerate(operations, 1):
+            kind = operation["op"]
+            if kind == "move":
+                poses = kinematics.getPose(operation["from"]), kinematics.getPose(operation["to"])
+            elif kind == "remove":
+                poses = kinematics.getPose(operation["from"]), kinematics.getGraveyardPose(graveyardSlot)
+                graveyardSlot += 1
+            elif kind == "place":
+                poses = kinematics.getReservePose(operation["piece"]), kinematics.getPose(operation["to"])
+            else:
+                raise ValueError("Unknown operation " + str(kind))
+            plan.append((str(number) + ":" + kind,) + poses)
+        return plan
+
+    @timed()
+    def runOperations(self, operations, listener=None):
+        """
+        Method to run a list of operations (see planOperations) back to back.
+        The arm goes home first if its pose was lost after a fault. After the last piece is dropped the arm turns
+        off the board (the RETRACT_STEP), so the camera sees every square, and goes home every HOMING_INTERVAL moves.
+        The wall-clock time of the operations and of every step is kept in lastMoveReport.
+        """
+        homingSeconds = 0.0
+        if not self.poseTracker.known:
+            homingSeconds += self.homeArm(listener)["seconds"]
+
+        plan = self.planOperations(operations)
+        scheduler = self.createScheduler("operations", listener)
+        pose = self.poseTracker.pose
+        lastStep = None
+        for name, pickPose, dropPose in plan:
+            lastStep, pose = self.addCarrySteps(scheduler, name, pose, pickPose, dropPose, lastStep)
+        if lastStep is not None:
+            # Turn back to the heading of the home position, beside the board. The carriage stays where it is,
+            # that is left to the homing
+            retractTurn = round(HOME_POSE.angle - pose.angle)
+            scheduler.addStep(self.RETRACT_STEP, lambda: self.turnArm(retractTurn), (lastStep,), axis="turn")
+
+        report = self.runMotion(scheduler)
+        self.graveyardCount += sum(1 for operation in operations if operation["op"] == "remove")
+        self.poseTracker.movesDone(len(operations))
+        if self.poseTracker.needsHoming():
+            homingSeconds += self.homeArm(listener)["seconds"]
+
+        report["operations"] = operations
+        report["homingSeconds"] = homingSeconds
+        self.lastMoveReport = report
+        print("=====> {} OPERATIONS TOOK {:.2f} s, {:.2f} s WITHOUT OVERLAP, {:.2f} s HOMING".format(
+            len(operations), report["seconds"], report["serialSeconds"], homingSeconds))
+        return report
+
+    def addCarrySteps(self, scheduler, name, startPose, pickPose, dropPose, afterStep=None):
+        """
+        Method to add the steps carrying a piece from pickPose to dropPose, starting at startPose
+        once the step afterStep is done. Return the name of the last step and the pose the arm ends at.
+        """
+        # The turns of the arm are whole degrees, the turnExact of SENSOR_MODE works on whole headings.
+        # The rounded turns are planned from each other so their errors do not add up
+        turn1 = round(pickPose.angle - startPose.angle)
+        distance1 = pickPose.distance - startPose.distance
+        turn2 = round(dropPose.angle - (startPose.angle + turn1))
+        distance2 = dropPose.distance - pickPose.distance
+        print("===> {}: TURN {} AND MOVE {:.1f}, THEN TURN {} AND MOVE {:.1f}".format(
+            name, turn1, distance1, turn2, distance2))
+
+        concurrent = self.isConcurrent()
+        after = () if afterStep is None else (afterStep,)
+
+        def serialAfter(step):
+            return () if concurrent else (step,)
+
+        # Turn to the piece and move the arm to it at the same time
+        turnToPick = scheduler.addStep(name + ".turnToPick", lambda: self.turnArm(turn1), after, axis="turn")
+        moveToPick = scheduler.addStep(name + ".moveToPick", lambda: self.moveArm(distance1),
+                                       after + serialAfter(turnToPick), axis="surface")
+        # Pick up the object
+        pickUp = scheduler.addStep(name + ".pickUp", lambda: self.pickOrDropPiece(), (turnToPick, moveToPick),
+                                   axis="vertical")
+        # Carry it to the drop place
+        turnToDrop = scheduler.addStep(name + ".turnToDrop", lambda: self.turnArm(turn2), (pickUp,), axis="turn")
+        moveToDrop = scheduler.addStep(name + ".moveToDrop", lambda: self.moveArm(distance2),
+                                       (pickUp,) + serialAfter(turnToDrop), axis="surface")
+        # Drop the object
+        dropDown = scheduler.addStep(name + ".dropDown", lambda: self.pickOrDropPiece(pickUp=False),
+                                     (turnToDrop, moveToDrop), axis="vertical")
+        return dropDown, dropPose._replace(angle=startPose.angle + turn1 + turn2)
+
+    def homeArm(self, listener=None):
+        """
+        Method to bring the arm back to the home position: against the touch sensor, back to the start distance,
+        straight, and turned 5 degrees to the left. Return the report of the motion.
+        """
+        robot = self.robot
+        scheduler = self.createScheduler("homeArm", listener)
+        # Reset the arm, and move back to the original position
+        scheduler.addStep("turnToStart", robot.turnToStartPosition, axis="turn")
+        if self.poseTracker.known:
+            distance = self.poseTracker.pose.distance
+            scheduler.addStep("moveToStart", lambda: self.moveArm(-distance),
+                              () if self.isConcurrent() else ("turnToStart",), axis="surface")
+        else:
+            # After a fault the distance of the interrupted move is unknown, measure it once the arm faces
+            # the same way as at the start
+            scheduler.addStep("moveToStart",
+                              lambda: self.moveArm(robot.readDistance() - self.poseTracker.homeDistance),
+                              ("turnToStart",), axis="surface")
+
+        def straightenArm():
+            robot.armRelease()
+            robot.sleep(2)
+            robot.armToStraightPosition()
+        scheduler.addStep("straightenArm", straightenArm, ("turnToStart", "moveToStart"), axis="vertical")
+        # Turn back a bit to adjust the position
+        scheduler.addStep("adjustTurn", lambda: robot.turnExact(-5),
+                          () if self.isConcurrent() else ("straightenArm",), axis="turn")
+
+        report = self.runMotion(scheduler)
+        self.poseTracker.homed()
+        print("=====> HOMING TOOK {:.2f} s".format(report["seconds"]))
+        return report
+
+    # ---------------------------------------------------------------------------
+    # Steps
+
+    def createScheduler(self, name, listener=None):
+        """Method to create the scheduler of a motion, it keeps runningSteps up to date"""
+        def trackStep(event):
+            with self.__stepsLock:
+                if event["event"] == "started":
+                    self.runningSteps.add(event["step"])
+                else:
+                    self.runningSteps.discard(event["step"])
+            if listener is not None:
+                listener(event)
+        return MotionScheduler(name, onFailure=self.robot.emergencyStop, listener=trackStep)
+
+    def runMotion(self, scheduler):
+        """Method to run the steps of a motion, the pose of the arm is lost if it fails"""
+        try:
+            return scheduler.run()
+        except BaseException:
+            # Whatever failed (an abort, a stuck motor, an OSError reading a device), the motors were stopped
+            # in the middle of a step: the arm is homed before the next motion
+            self.poseTracker.lost()
+            raise
+
+    def isConcurrent(self):
+        """
+        Method to check whether the 2 axes can move at the same time. In SENSOR_MODE a move on the surface
+        is measured with the ultrasonic sensor while the arm turns, so the steps stay one after the other there
+        """
+        return self.robot.positioningMode == RobotArm.ENCODER_MODE
+
+    def turnArm(self, angle):
+        """Method to turn the arm by angle degrees and keep track of its pose"""
+        self.robot.turnExact(angle)
+        self.poseTracker.turned(angle)
+
+    def moveArm(self, distance):
+        """Method to move the arm forward by distance cm, backward if it is negative, and keep track of its pose"""
+        if distance < 0:
+            self.robot.backwardExact(abs(distance))
+        elif distance > 0:
+            self.robot.forwardExact(distance)
+        self.poseTracker.traveled(distance)
+
+    def pickOrDropPiece(self, pickUp=True):
+        """Method to pick up or drop down a piece"""
+        # Wait until the robot reach to position
+        self.robot.waitForMotor(self.robot.surface_move_motor, "surfaceMove")
+        # Pick up the object
+        if pickUp:
+            self.robot.pickUp()
+        else:
+            self.robot.dropDown()
+
+    # ---------------------------------------------------------------------------
+    # These methods can be called from another thread while the arm is moving
+
+    def emergencyStop(self):
+        """Method to stop the arm right away, return the time taken in milliseconds"""
+        received = time.perf_counter()
+        self.robot.emergencyStop()
+        latency = (time.perf_counter() - received) * 1000
+        print("=====> EMERGENCY STOP in {:.2f} ms".format(latency))
+        return latency
+
+    def status(self):
+        """
+        Method to get the state of the arm without waiting on it: the steps running, the pose,
+        the state of the hand and the latest value of every sensor with its age in seconds
+        """
+        with self.__stepsLock:
+            runningSteps = sorted(self.runningSteps)
+        pose = self.poseTracker.pose
+        sensors = {}
+        sensorService = self.robot.sensorService
+        if sensorService is not None:
+            now = robotClock.monotonic()
+            for name in sorted(sensorService.sensors):
+                value, timestamp = sensorService.read(name, "latest")
+                sensors[name] = {"value": value, "age": None if timestamp is None else now - timestamp}
+        return {"runningSteps": runningSteps,
+                "pose": {"angle": pose.angle, "distance": pose.distance, "known": self.poseTracker.known,
+                         "movesSinceHoming": self.poseTracker.movesSinceHoming},
+                "handIsHolding": self.robot.handIsHolding,
+                "pickingUpMode": self.robot.pickingUpMode,
+                "positioningMode": self.robot.positioningMode,
+                "aborted": self.robot.abortEvent.is_set(),
+                "sensors": sensors}
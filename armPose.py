@@ -0,0 +1,119 @@
+import threading
+from collections import namedtuple
+
+# The pose of the arm from the home position: the angle turned in degrees (negative to the left, like turnExact)
+# and the distance moved forward on the surface in cm
+ArmPose = namedtuple("ArmPose", ["angle", "distance"])
+
+# The pose of the arm after homing
+HOME_POSE = ArmPose(0.0, 0.0)
+
+COLUMNS = "ABCDEFGH"
+
+
+class ArmKinematics:
+    """
+    Kinematics of the arm: the pose (angle, distance) that puts the hand over each square.
+    The arm turns on a turntable riding a linear carriage: turning to a column does not move the carriage,
+    and the carriage moves the hand along that column. Every column has its own turning angle, whatever the row,
+    and its own row reached with the carriage at the home distance (its initial row, with a correction in cm).
+    The tables are the angles and initial rows measured by hand on the robot.
+    x is the column (0 for A) and y the row (1 to 8), in squares.
+    """
+
+    # The angle to turn to every column from the home position, in degrees (negative to the left)
+    TURNING_ANGLES = {"A": -43, "B": -60, "C": -70, "D": -85, "E": -97, "F": -110, "G": -125, "H": -140}
+    # The row every column reaches with the carriage at the home distance, and the correction of the distance in cm
+    INITIAL_ROWS = {"A": (7, 0), "B": (6, 0), "C": (6, 0), "D": (6, 0), "E": (6, 0), "F": (6, 2), "G": (7, -1),
+                    "H": (8, 0)}
+    # The places off the board: the captured pieces go to the graveyard beside the H column, one slot per row and
+    # then one more column, the pieces for a promotion wait in the reserve beside the A column.
+    # Their angles continue the spacing of the last columns, they take the initial row of the column beside them
+    GRAVEYARD_ANGLE = -155
+    GRAVEYARD_COLUMN_ANGLE = -15
+    RESERVE_ANGLE = -26
+    # The pieces in the reserve, from the 1st row
+    RESERVE_PIECES = "QRBN"
+
+    def __init__(self, squareLength, turningAngles=None, initialRows=None):
+        """squareLength is the side of a square of the chessboard in cm"""
+        self.squareLength = squareLength
+        self.turningAngles = dict(turningAngles if turningAngles is not None else self.TURNING_ANGLES)
+        self.initialRows = dict(initialRows if initialRows is not None else self.INITIAL_ROWS)
+        # The pose of every square, from "A1" to "H8"
+        self.table = {column + str(row): self.computePose(self.turningAngles[column], self.initialRows[column], row)
+                      for column in COLUMNS for row in range(1, 9)}
+
+    def computePose(self, angle, initialRow, row):
+        """
+        Method to compute the pose over row in the direction angle, where the carriage at the home distance
+        reaches initialRow, a pair (row, correction in cm). Rows before the initial row are forward.
+        """
+        startRow, correction = initialRow
+        return ArmPose(float(angle), float((startRow - row) * self.squareLength + correction))
+
+    def getPose(self, square):
+        """Method to get the pose over a square like "E2", raise KeyError for an unknown square"""
+        return self.table[square.upper()]
+
+    def getGraveyardPose(self, slot):
+        """Method to get the pose over a slot of the graveyard, 0 for the first captured piece"""
+        angle = self.GRAVEYARD_ANGLE + (slot // 8) * self.GRAVEYARD_COLUMN_ANGLE
+        return self.computePose(angle, self.initialRows[COLUMNS[-1]], slot % 8 + 1)
+
+    def getReservePose(self, piece):
+        """Method to get the pose over the reserve piece ("Q", "R", "B" or "N"), raise ValueError for another piece"""
+        return self.computePose(self.RESERVE_ANGLE, self.initialRows[COLUMNS[0]],
+                                self.RESERVE_PIECES.index(piece.upper()) + 1)
+
+
+class ArmPoseTracker:
+    """
+    The current pose of the arm, so a move starts from wherever the last one ended instead of from home.
+    Every turn and move on the surface adds to the pose. The turns and moves are relative, their errors add up,
+    so the arm is homed again every homingInterval moves, and right away after a fault (the pose is then lost).
+    The axes are moved from different threads by the motion scheduler, updates are done under a lock.
+    """
+
+    # The number of moves between 2 homings
+    HOMING_INTERVAL = 8
+
+    def __init__(self, kinematics, homeDistance, homingInterval=HOMING_INTERVAL):
+        """homeDistance is the distance read by the ultrasonic sensor at the home position"""
+        self.kinematics = kinematics
+        self.homeDistance = homeDistance
+        self.homingInterval = homingInterval
+        self.pose = HOME_POSE
+        # Whether the pose is known, it is not after an emergency stop or a stuck motor
+        self.known = True
+        self.movesSinceHoming = 0
+        self.__lock = threading.Lock()
+
+    def turned(self, angle):
+        """Method to record a turn of the arm by angle degrees"""
+        with self.__lock:
+            self.pose = self.pose._replace(angle=self.pose.angle + angle)
+
+    def traveled(self, distance):
+        """Method to record a move of the arm forward by distance cm"""
+        with self.__lock:
+            self.pose = self.pose._replace(distance=self.pose.distance + distance)
+
+    def movesDone(self, count=1):
+        """Method to count finished moves"""
+        self.movesSinceHoming += count
+
+    def lost(self):
+        """Method to forget the pose after a fault, the arm is homed before the next move"""
+        self.known = False
+
+    def homed(self):
+        """Method to record that the arm is back at the home position"""
+        with self.__lock:
+            self.pose = HOME_POSE
+        self.known = True
+        self.movesSinceHoming = 0
+
+    def needsHoming(self):
+        """Method to check whether the arm should go home before the next move"""
+        return not self.known or self.movesSinceHoming >= self.homingInterval
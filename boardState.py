@@ -0,0 +1,280 @@
+from collections import namedtuple
+
+import numpy as np
+
+# A move between 2 square indices. promotion is the type of the piece a pawn becomes, 0 if it is not a promotion.
+# Castling is the king moving 2 squares, en passant is a pawn moving diagonally to the en passant square.
+Move = namedtuple("Move", ["fromSquare", "toSquare", "promotion"])
+Move.__new__.__defaults__ = (0,)
+
+
+class BoardState:
+    """
+    Compact representation of a chess position.
+    The pieces are kept in a 64-entry int8 array indexed like SQUARE_CODES (A1 is 0, H8 is 63),
+    white pieces are positive and black pieces negative, and in a bitboard (a Python int, bit i
+    for the square i) for every side and every piece type. Moves are applied and undone with
+    integer operations only, the dict of ChessBoardProcessor and the FEN string are built on demand.
+    """
+
+    # =========== CONSTANTS =================
+    WHITE = 0
+    BLACK = 1
+    EMPTY = 0
+    PAWN = 1
+    KNIGHT = 2
+    BISHOP = 3
+    ROOK = 4
+    QUEEN = 5
+    KING = 6
+    # The letter of each piece type, the same letters as ChessBoardProcessor.PIECES_NAME
+    PIECE_LETTERS = " PNBRQK"
+
+    # The castling rights are bits of one int
+    WHITE_KINGSIDE = 1
+    WHITE_QUEENSIDE = 2
+    BLACK_KINGSIDE = 4
+    BLACK_QUEENSIDE = 8
+    # The castling rights lost when a piece leaves or arrives on these squares (index: rights lost)
+    CASTLING_RIGHTS_LOST = {4: WHITE_KINGSIDE | WHITE_QUEENSIDE, 0: WHITE_QUEENSIDE, 7: WHITE_KINGSIDE,
+                            60: BLACK_KINGSIDE | BLACK_QUEENSIDE, 56: BLACK_QUEENSIDE, 63: BLACK_KINGSIDE}
+
+    SQUARE_CODES = [col + str(row) for row in range(1, 9) for col in "ABCDEFGH"]
+    SQUARE_INDEX = {code: index for index, code in enumerate(SQUARE_CODES)}
+    STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+    def __init__(self):
+        """Create an empty board, use startingPosition, fromFen or fromPieceDict to get a position"""
+        self.squares = np.zeros(64, dtype=np.int8)
+        # pieceBitboards[side][pieceType], the index 0 of each side is not used
+        self.pieceBitboards = [[0] * 7, [0] * 7]
+        self.sideBitboards = [0, 0]
+        self.sideToMove = self.WHITE
+        self.castlingRights = 0
+        # The index of the square a pawn can capture en passant on, None if there is none
+        self.enPassantSquare = None
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        # The information needed to undo every move applied, the last move is at the end
+        self.__history = []
+
+    @classmethod
+    def startingPosition(cls):
+        """Create the board at the starting position of a game"""
+        return cls.fromFen(cls.STARTING_FEN)
+
+    @classmethod
+    def fromFen(cls, fen):
+        """Create the board from a FEN string"""
+        fields = fen.split()
+        board = cls()
+        for rankIndex, rankText in enumerate(fields[0].split("/")):
+            col = 0
+            for char in rankText:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    side = cls.WHITE if char.isupper() else cls.BLACK
+                    board.putPiece((7 - rankIndex) * 8 + col, side, cls.PIECE_LETTERS.index(char.upper()))
+                    col += 1
+        if len(fields) > 1:
+            board.sideToMove = cls.WHITE if fields[1] == "w" else cls.BLACK
+        if len(fields) > 2:
+            for char, right in zip("KQkq", (cls.WHITE_KINGSIDE, cls.WHITE_QUEENSIDE,
+                                            cls.BLACK_KINGSIDE, cls.BLACK_QUEENSIDE)):
+                if char in fields[2]:
+                    board.castlingRights |= right
+        if len(fields) > 3 and fields[3] != "-":
+            board.enPassantSquare = cls.SQUARE_INDEX[fields[3].upper()]
+        if len(fields) > 5:
+            board.halfmoveClock = int(fields[4])
+            board.fullmoveNumber = int(fields[5])
+        return board
+
+    @classmethod
+    def fromPieceDict(cls, pieceAtPosition, sideToMove=WHITE):
+        """
+        Create the board from a dict like ChessBoardProcessor.pieceAtPosition ("A1": "R0", empty squares are None).
+        A castling right is kept when the king and the rook are still on their starting squares.
+        """
+        board = cls()
+        for squareCode, piece in pieceAtPosition.items():
+            if piece is not None:
+                piece = piece.strip()
+                board.putPiece(cls.SQUARE_INDEX[squareCode], int(piece[1]), cls.PIECE_LETTERS.index(piece[0]))
+        board.sideToMove = sideToMove
+        for king, rook, right in ((4, 7, cls.WHITE_KINGSIDE), (4, 0, cls.WHITE_QUEENSIDE),
+                                  (60, 63, cls.BLACK_KINGSIDE), (60, 56, cls.BLACK_QUEENSIDE)):
+            side = cls.WHITE if king == 4 else cls.BLACK
+            if board.pieceAt(king) == (side, cls.KING) and board.pieceAt(rook) == (side, cls.ROOK):
+                board.castlingRights |= right
+        return board
+
+    def copy(self):
+        """Method to copy the board, without its history"""
+        board = BoardState()
+        board.squares = self.squares.copy()
+        board.pieceBitboards = [list(self.pieceBitboards[0]), list(self.pieceBitboards[1])]
+        board.sideBitboards = list(self.sideBitboards)
+        board.sideToMove = self.sideToMove
+        board.castlingRights = self.castlingRights
+        board.enPassantSquare = self.enPassantSquare
+        board.halfmoveClock = self.halfmoveClock
+        board.fullmoveNumber = self.fullmoveNumber
+        return board
+
+    # ============ Squares and pieces
+    @classmethod
+    def squareIndex(cls, squareCode):
+        """Method to get the index of a square code like "E2" """
+        return cls.SQUARE_INDEX[squareCode]
+
+    @classmethod
+    def squareCode(cls, index):
+        """Method to get the code of a square index"""
+        return cls.SQUARE_CODES[index]
+
+    def putPiece(self, index, side, pieceType):
+        """Method to put a piece on an empty square"""
+        bit = 1 << index
+        self.squares[index] = pieceType if side == self.WHITE else -pieceType
+        self.pieceBitboards[side][pieceType] |= bit
+        self.sideBitboards[side] |= bit
+
+    def removePiece(self, index):
+        """Method to remove the piece of a square and return its signed code (0 if the square was empty)"""
+        code = int(self.squares[index])
+        if code != 0:
+            side = self.WHITE if code > 0 else self.BLACK
+            mask = ~(1 << index)
+            self.squares[index] = 0
+            self.pieceBitboards[side][abs(code)] &= mask
+            self.sideBitboards[side] &= mask
+        return code
+
+    def pieceAt(self, index):
+        """Method to get the piece of a square as (side, pieceType), None if the square is empty"""
+        code = int(self.squares[index])
+        if code == 0:
+            return None
+        return (self.WHITE, code) if code > 0 else (self.BLACK, -code)
+
+    def pieceCodeAt(self, index):
+        """Method to get the piece of a square as the code of ChessBoardProcessor ("R0"), None if it is empty"""
+        piece = self.pieceAt(index)
+        if piece is None:
+            return None
+        return self.PIECE_LETTERS[piece[1]] + str(piece[0])
+
+    def occupancy(self):
+        """Method to get the bitboard of all the occupied squares"""
+        return self.sideBitboards[self.WHITE] | self.sideBitboards[self.BLACK]
+
+    def occupancyMask(self, side=None):
+        """Method to get a boolean array of the 64 squares, True where there is a piece (of side if given)"""
+        if side is None:
+            return self.squares != 0
+        if side == self.WHITE:
+            return self.squares > 0
+        return self.squares < 0
+
+    def kingSquare(self, side):
+        """Method to get the index of the king of side, None if there is no king"""
+        kingBitboard = self.pieceBitboards[side][self.KING]
+        if kingBitboard == 0:
+            return None
+        return kingBitboard.bit_length() - 1
+
+    # ============ Moves
+    def applyMove(self, move):
+        """
+        Method to apply a move and remember how to undo it.
+        Return the signed code of the captured piece, 0 if nothing was captured.
+        """
+        fromSquare, toSquare, promotion = move
+        code = int(self.squares[fromSquare])
+        side = self.WHITE if code > 0 else self.BLACK
+        pieceType = abs(code)
+
+        capturedSquare = toSquare
+        if pieceType == self.PAWN and toSquare == self.enPassantSquare and self.squares[toSquare] == 0:
+            # En passant, the captured pawn is next to the target square
+            capturedSquare = toSquare - 8 if side == self.WHITE else toSquare + 8
+        self.__history.append((move, self.castlingRights, self.enPassantSquare, self.halfmoveClock,
+                               self.fullmoveNumber, self.sideToMove, capturedSquare))
+        captured = self.removePiece(capturedSquare)
+        self.__history[-1] += (captured,)
+
+        self.removePiece(fromSquare)
+        self.putPiece(toSquare, side, promotion if promotion else pieceType)
+
+        if pieceType == self.KING and abs(toSquare - fromSquare) == 2:
+            # Castling, the rook jumps over the king
+            rookFrom, rookTo = (fromSquare + 3, fromSquare + 1) if toSquare > fromSquare else (fromSquare - 4,
+                                                                                               fromSquare - 1)
+            self.removePiece(rookFrom)
+            self.putPiece(rookTo, side, self.ROOK)
+
+        self.castlingRights &= ~(self.CASTLING_RIGHTS_LOST.get(fromSquare, 0) |
+                                 self.CASTLING_RIGHTS_LOST.get(toSquare, 0))
+        self.enPassantSquare = None
+        if pieceType == self.PAWN and abs(toSquare - fromSquare) == 16:
+            self.enPassantSquare = (fromSquare + toSquare) // 2
+        self.halfmoveClock = 0 if pieceType == self.PAWN or captured else self.halfmoveClock + 1
+        if side == self.BLACK:
+            self.fullmoveNumber += 1
+        self.sideToMove = 1 - side
+        return captured
+
+    def undoMove(self):
+        """Method to undo the last applied move. Return the move undone, None if there is no move to undo."""
+        if not self.__history:
+            return None
+        (move, self.castlingRights, self.enPassantSquare, self.halfmoveClock, self.fullmoveNumber,
+         self.sideToMove, capturedSquare, captured) = self.__history.pop()
+        fromSquare, toSquare, promotion = move
+
+        code = self.removePiece(toSquare)
+        side = self.WHITE if code > 0 else self.BLACK
+        self.putPiece(fromSquare, side, self.PAWN if promotion else abs(code))
+        if captured:
+            self.putPiece(capturedSquare, self.WHITE if captured > 0 else self.BLACK, abs(captured))
+
+        if abs(code) == self.KING and abs(toSquare - fromSquare) == 2:
+            # Put the rook back from castling
+            rookFrom, rookTo = (fromSquare + 3, fromSquare + 1) if toSquare > fromSquare else (fromSquare - 4,
+                                                                                               fromSquare - 1)
+            self.removePiece(rookTo)
+            self.putPiece(rookFrom, side, self.ROOK)
+        return move
+
+    # ============ Conversions
+    def toPieceDict(self):
+        """Method to get the board as the dict of ChessBoardProcessor.pieceAtPosition ("A1": "R0", empty is None)"""
+        return {code: self.pieceCodeAt(index) for index, code in enumerate(self.SQUARE_CODES)}
+
+    def toFen(self):
+        """Method to get the board as a FEN string"""
+        ranks = []
+        for row in range(7, -1, -1):
+            rankText = ""
+            emptyCount = 0
+            for code in self.squares[row * 8:row * 8 + 8]:
+                if code == 0:
+                    emptyCount += 1
+                    continue
+                if emptyCount:
+                    rankText += str(emptyCount)
+                    emptyCount = 0
+                letter = self.PIECE_LETTERS[abs(code)]
+                rankText += letter if code > 0 else letter.lower()
+            if emptyCount:
+                rankText += str(emptyCount)
+            ranks.append(rankText)
+
+        castling = "".join(char for char, right in zip("KQkq", (self.WHITE_KINGSIDE, self.WHITE_QUEENSIDE,
+                                                               self.BLACK_KINGSIDE, self.BLACK_QUEENSIDE))
+                           if self.castlingRights & right) or "-"
+        enPassant = "-" if self.enPassantSquare is None else self.SQUARE_CODES[self.enPassantSquare].lower()
+        return "{} {} {} {} {} {}".format("/".join(ranks), "w" if self.sideToMove == self.WHITE else "b",
+                                          castling, enPassant, self.halfmoveClock, self.fullmoveNumber)
@@ -0,0 +1,73 @@
+import os
+import re
+import time
+
+import numpy as np
+
+from cornerTracker import CornerTracker
+
+
+class CalibrationStore:
+    """
+    Store of the calibration of the board on disk, one file per camera and resolution, so the board
+    does not need the interactive detection at every start when nothing has moved.
+    A calibration holds the board corners and the gray frame they were found on, plus any other array
+    (the noise of the squares, the occupancy classifier...). Before it is used, a saved calibration is checked
+    against a new frame by tracking the corners from the saved frame, which also follows a small bump.
+    """
+
+    DEFAULT_DIRECTORY = "calibration"
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+
+    def getPath(self, cameraId, resolution):
+        """Method to get the file of the calibration of a camera (an index or a file name) at a resolution (width, height)"""
+        # Keep the camera id readable in the file name, but without any path separator
+        cameraName = re.sub(r"[^A-Za-z0-9_.-]", "_", str(cameraId))
+        return os.path.join(self.directory, "camera-{}-{}x{}.npz".format(cameraName, resolution[0], resolution[1]))
+
+    def save(self, cameraId, resolution, boardCorners, referenceGray, **arrays):
+        """
+        Method to save the calibration of a camera at a resolution: the board corners, the gray frame they
+        were found on and any other named array. Arrays set to None are not saved.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.getPath(cameraId, resolution)
+        arrays = {name: np.asarray(value) for name, value in arrays.items() if value is not None}
+        # Write to a temporary file first, so a crash never leaves half a calibration behind
+        temporaryPath = path + ".tmp"
+        with open(temporaryPath, "wb") as calibrationFile:
+            np.savez_compressed(calibrationFile, boardCorners=np.asarray(boardCorners, dtype=np.float32),
+                                referenceGray=referenceGray, savedAt=np.float64(time.time()), **arrays)
+        os.replace(temporaryPath, path)
+
+    def load(self, cameraId, resolution):
+        """Method to load the calibration of a camera at a resolution as a dict of arrays, None if there is none"""
+        path = self.getPath(cameraId, resolution)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return {name: data[name] for name in data.files}
+        except (OSError, ValueError) as error:
+            print("Cannot read the calibration ", path, ": ", error)
+            return None
+
+    def remove(self, cameraId, resolution):
+        """Method to delete the calibration of a camera at a resolution"""
+        path = self.getPath(cameraId, resolution)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def validate(self, calibration, grayImage):
+        """
+        Method to check a loaded calibration against a new gray frame of the same camera.
+        Return the board corners in the new frame (moved if the board or the camera was bumped a bit),
+        or None if the board cannot be followed from the saved frame, then a full detection is needed.
+        """
+        referenceGray = calibration["referenceGray"]
+        if referenceGray.shape != grayImage.shape:
+            return None
+        tracker = CornerTracker(calibration["boardCorners"], referenceGray)
+        return tracker.track(grayImage)
@@ -1,6 +1,19 @@
+import time
+
 import cv2
 import numpy as np
 
+from boardState import BoardState
+from calibrationStore import CalibrationStore
+from cornerTracker import CornerTracker
+from frameGrabber import FrameGrabber
+from frameSources import openFrameSource
+from instrumentation import timed, timer
+from motionGate import MotionGate
+from moveGenerator import changedSquaresOfMove
+from moveInference import findMovesToOccupancy, inferMove
+from occupancyClassifier import OccupancyClassifier
+
 class ChessBoardProcessor:
     """
     Class to create a processor to process the input image from the chessboard.
@@ -14,25 +27,100 @@ class ChessBoardProcessor:
     BOARD_SIDE_LENGTH = 10
     BOARD_SIDE_INTERNAL = BOARD_SIDE_LENGTH - 1
     SIZE_OF_INTERNAL_CORNERS = (BOARD_SIDE_INTERNAL, BOARD_SIDE_INTERNAL)
+    # The options of the corner detection, findChessboardCorners flags and the cornerSubPix refinement
+    CORNER_DETECTION_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+    SUBPIX_WINDOW_SIZE = (5, 5)
+    SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1)
     PIECES_NAME = {"K":"King", "Q":"Queen", "R": "Rook", "B" :"Bishop", "N": "Knight", "P": "Pawn"}
+    # The code of every square, index 0 is A1, index 1 is B1, ..., index 63 is H8.
+    # Every per-square score array produced by the processor follows this order
+    SQUARE_CODES = [col + str(row) for row in range(1, 9) for col in "ABCDEFGH"]
 
-    # TODO: CHANGE THE THRESHOLD EVERYTIME SETTING UP THE GAME
+    # TODO: CHANGE THE THRESHOLD EVERYTIME SETTING UP THE GAME, or call calibrateNoise to replace it
+    # with a threshold learned for every square
     DIFFERENCE_THRESHOLD = 200000
+    # The number of frames of a still board used to learn the noise of every square
+    CALIBRATION_FRAMES = 20
+    # Once calibrated, a square changed when its difference is this many standard deviations above its noise
+    Z_SCORE_THRESHOLD = 8.0
+    # The smallest noise deviation of a square, as a part of its mean noise, so a perfectly still
+    # square does not turn every tiny difference into a change
+    MIN_NOISE_DEVIATION = 0.1
+    # The side length in pixels of a square in the rectified top-down board
+    RECTIFIED_SQUARE_SIZE = 32
+    # Every rectified square has the same size, so this threshold does not depend on the camera position.
+    # It is DIFFERENCE_THRESHOLD scaled to a 32x32 square, used until calibrateNoise learns the noise of every square
+    RECTIFIED_DIFFERENCE_THRESHOLD = 130000
+    # The largest number of missed moves resyncBoardState looks for
+    OCCUPANCY_RESYNC_PLIES = 2
     # The amount is in centimeters
     CHESSBOARD_SQUARE_LENGTH = 5
 
-    def __init__(self, inputSource=0):
-        self.videoCap = cv2.VideoCapture(inputSource)
+    def __init__(self, inputSource=0, rectify=False, useGrabber=False, boardCorners=None, headless=False,
+                 calibrationStore=None):
+        """
+        Set up the processor and detect the chessboard from inputSource, which can be a camera index,
+        a video file, a directory of images or a stream of frames (see frameSources.openFrameSource).
+        If rectify is True, every captured board is warped into a top-down view before detecting a move,
+        so all the squares are compared as same-sized, aligned tiles.
+        If useGrabber is True, a background thread reads the camera all the time and captureNewBoard
+        takes the newest frame it has, instead of a possibly stale frame from OpenCV's buffer.
+        If boardCorners is given or headless is True, there is no prompt and no window: the first frame
+        is the starting board, and the corners are found automatically on it if boardCorners is None.
+        If calibrationStore is given (see calibrationStore.CalibrationStore), the calibration saved for this camera
+        is used when it still matches the board, and the interactive detection only runs when it does not.
+        """
+        self.videoCap = openFrameSource(inputSource)
+        # The id of the camera the calibration is saved under, None for a stream of frames
+        self.cameraId = inputSource if isinstance(inputSource, (int, str)) else None
+        self.calibrationStore = calibrationStore
+        # True if the calibration was loaded from calibrationStore instead of detected
+        self.calibrationLoaded = False
+        self.frameGrabber = None
+        if useGrabber:
+            self.frameGrabber = FrameGrabber(self.videoCap)
+            self.frameGrabber.start()
+        # The time (from time.monotonic()) the last captured board was read from the camera
+        self.lastCaptureTimestamp = None
+        # The number of frames captured so far
+        self.framesCaptured = 0
+        self.rectify = rectify
+        self.differenceThreshold = self.RECTIFIED_DIFFERENCE_THRESHOLD if rectify else self.DIFFERENCE_THRESHOLD
         # The list of corners detected from the chessboard
         self.boardCorners = []
         # This is the raw gray image to use for any internal processing (no dot at each iternal corners)
         self.__rawCurrentBoard = []
+        # The pixel bounds of every square, precomputed from boardCorners (see __buildSquareIndexMap)
+        self.__squareBounds = None
+        # The tracker following boardCorners from frame to frame (see trackBoardCorners)
+        self.cornerTracker = None
+        # The homography from the camera image to the top-down board and its cached remap tables
+        self.boardHomography = None
+        self.__rectifyMaps = None
+        # The per-square difference scores found by the last call of detectMove
+        self.lastSquareDifferences = None
+        # The per-square change scores of the last call of detectMove, these are the z-scores once calibrated
+        self.lastSquareScores = None
+        # The mean and standard deviation of the difference of every square on a still board (see calibrateNoise)
+        self.noiseMean = None
+        self.noiseStd = None
+        # The classifier reading which squares are empty, white or black from a single frame (see calibrateOccupancy)
+        self.occupancyClassifier = OccupancyClassifier()
+
+        if boardCorners is not None or headless:
+            self.currentBoard = None
+            self.__detectHeadless(boardCorners)
+        elif self.__loadCalibration():
+            self.currentBoard = None
+        else:
+            # This currentBoard has a dot at each internal corners for user to check detection accuracy
+            self.currentBoard = self.detectChessboard()
+            # Save the corners right away, saveCalibration adds the noise and occupancy once they are calibrated
+            if self.calibrationStore is not None and self.cameraId is not None:
+                self.saveCalibration()
 
-        # This currentBoard has a dot at each internal corners for user to check detection accuracy
-        self.currentBoard = self.detectChessboard()
-
-        # The list of individual square images. This should be private (not accessed by user)
-        self.__currentSquareImages = self.__detectIndividualSquareImages()
+        # The board every new capture is compared to when detecting a move. This should be private (not accessed by user)
+        self.__referenceBoard = self.prepareBoard(self.__rawCurrentBoard)
 
         # The variable indicate which side is currently playing, white-0 or black-1
         self.currentPlayingSide = 0
@@ -41,14 +129,17 @@ class ChessBoardProcessor:
         # Representation: King K, Queen Q, Rook R, Bishop B, Knight N, Pawn P
         # 0: white side, 1, black side
         # K0: King of White...
-        self.pieceAtPosition = {"A1": "R0", "B1": "N0", "C1": "B0", "D1": "Q0", "E1": "K0", "F1": "B0", "G1": "N0", "H1": "R0",
-                                "A2": "P0", "B2": "P0", "C2": "P0", "D2": "P0", "E2": "P0", "F2": "P0", "G2": "P0", "H2": "P0",
-                                "A8": "R1", "B8": "N1", "C8": "B1", "D8": "Q1", "E8": "K1", "F8": "B1", "G8": "N1", "H8": "R1",
-                                "A7": "P1", "B7": "P1", "C7": "P1", "D7": "P1", "E7": "P1", "F7": "P1", "G7": "P1", "H7": "P1",
-                                "A3": None, "B3": None, "C3": None, "D3": None, "E3": None, "F3": None, "G3": None, "H3": None,
-                                "A4": None, "B4": None, "C4": None, "D4": None, "E4": None, "F4": None, "G4": None, "H4": None,
-                                "A5": None, "B5": None, "C5": None, "D5": None, "E5": None, "F5": None, "G5": None, "H5": None,
-                                "A6": None, "B6": None, "C6": None, "D6": None, "E6": None, "F6": None, "G6": None, "H6": None}
+        # The position is kept in a BoardState, pieceAtPosition gives it as a dict of those codes ("A1": "R0")
+        self.boardState = BoardState.startingPosition()
+
+    @property
+    def pieceAtPosition(self):
+        """The dict from every square code to the piece on it ("A1": "R0"), None for an empty square"""
+        return self.boardState.toPieceDict()
+
+    @pieceAtPosition.setter
+    def pieceAtPosition(self, pieceAtPosition):
+        self.boardState = BoardState.fromPieceDict(pieceAtPosition, self.currentPlayingSide)
 
     def detectChessboard(self):
         """
@@ -63,6 +154,7 @@ class ChessBoardProcessor:
             readyFlag = input("Wrong input, please try again: ")
         self.currentBoard = self.__detect()
 
+    @timed("detectBoard")
     def __detect(self):
         """
         Method to detect the chess board
@@ -70,7 +162,7 @@ class ChessBoardProcessor:
         """
 
         print("INSTRUCTION: Adjust your chessboard to make sure it fit into the frame and hit d to begin detect.")
-        ret, frame = self.videoCap.read()
+        frame, timestamp = self.grabLatestFrame()
 
         while True:
             cv2.imshow("Board", frame)
@@ -79,31 +171,21 @@ class ChessBoardProcessor:
             if keyStroke in "dD":
                 break
             else:
-                ret, frame = self.videoCap.read()
+                frame, timestamp = self.grabLatestFrame()
 
         self.__rawCurrentBoard = frame.copy()
 
         # Detecting the chessboard can only work on a gray scale image
         gray_image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        # Detect the chessboard corner
-        # This method find all the internal corners of a chessboard
-        # For example, a standard 8x8 chessboard has 7x7 internal corners
-        retVal, boardCorners = cv2.findChessboardCorners(gray_image, self.SIZE_OF_INTERNAL_CORNERS, cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
-                                                         + cv2.CALIB_CB_FAST_CHECK)
-        print("======> Finished findChessboardCorners")
-        if retVal:
-            print("====> Chess board detected")
-            boardCorners = cv2.cornerSubPix(gray_image, boardCorners, (5, 5), (-1, -1),
-                                            (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.1))
-
-        # Notice: Sometimes the corners will be detected from bottom up, not top down as expected
-        # This part of the program chess for this problem and correct the order of corners
-        boardCorners = self.__constructTopDownBoardCorners(boardCorners)
+        boardCorners = self.findBoardCorners(gray_image)
+        if boardCorners is None:
+            print("Cannot detect the chess board, please adjust the board and try again.")
+            return self.__detect()
         print("=====> Shape: ", boardCorners.shape)
 
         # Drawout the corners detected for user to chess
         displayed_image = cv2.drawChessboardCorners(
-            gray_image, self.SIZE_OF_INTERNAL_CORNERS, boardCorners, retVal)
+            gray_image, self.SIZE_OF_INTERNAL_CORNERS, boardCorners, True)
 
         # Draw a line between first 2 corners to know where the corners begin
         displayed_image = cv2.line(displayed_image, (boardCorners[0][0][0], boardCorners[0][0][1]), (
@@ -114,9 +196,202 @@ class ChessBoardProcessor:
 
         # We only interested in the list of corners, the displayed_image is just for
         # the visualization to check
-        self.boardCorners = boardCorners
+        self.setBoardCorners(boardCorners)
         return displayed_image
 
+    def __detectHeadless(self, boardCorners=None):
+        """
+        Method to set up the board from the first frame of the input without any prompt or window.
+        The corners are found automatically when boardCorners is None.
+        """
+        if not self.captureNewBoard():
+            raise RuntimeError("Cannot read the first frame of the input")
+        if boardCorners is None:
+            boardCorners = self.findBoardCorners(self.__rawCurrentBoard)
+            if boardCorners is None:
+                raise RuntimeError("Cannot find the chess board in the first frame of the input")
+        self.setBoardCorners(np.asarray(boardCorners, dtype=np.float32).reshape((-1, 1, 2)))
+
+    def __loadCalibration(self):
+        """
+        Method to set up the board from the calibration saved for the camera, after checking it on a new frame.
+        Return False if there is no saved calibration or it does not match the board anymore.
+        """
+        if self.calibrationStore is None or self.cameraId is None:
+            return False
+        if not self.captureNewBoard():
+            return False
+        height, width = self.__rawCurrentBoard.shape[:2]
+        calibration = self.calibrationStore.load(self.cameraId, (width, height))
+        if calibration is None:
+            print("No saved calibration for camera ", self.cameraId, " at ", width, "x", height)
+            return False
+
+        boardCorners = self.calibrationStore.validate(calibration,
+                                                      cv2.cvtColor(self.__rawCurrentBoard, cv2.COLOR_BGR2GRAY))
+        if boardCorners is None:
+            print("The saved calibration does not match the board anymore, detect the board again")
+            return False
+        self.setBoardCorners(boardCorners)
+
+        # The noise of the squares depends on how they are compared, only keep it for the same mode
+        if "noiseMean" in calibration and bool(calibration["rectify"]) == self.rectify:
+            self.noiseMean = calibration["noiseMean"]
+            self.noiseStd = calibration["noiseStd"]
+        if "occupancyCentroids" in calibration:
+            self.occupancyClassifier.centroids = calibration["occupancyCentroids"]
+            self.occupancyClassifier.featureScale = calibration["occupancyFeatureScale"]
+        print("=====> Loaded the saved calibration of camera ", self.cameraId)
+        self.calibrationLoaded = True
+        return True
+
+    def saveCalibration(self):
+        """
+        Method to save the board corners, the noise of the squares and the occupancy classifier to calibrationStore,
+        so the next start with the same camera and resolution can skip the detection and calibration.
+        The last captured board must show the board at the current corners.
+        """
+        if self.calibrationStore is None or self.cameraId is None:
+            print("No calibration store or camera id to save the calibration to")
+            return
+        height, width = self.__rawCurrentBoard.shape[:2]
+        self.calibrationStore.save(self.cameraId, (width, height), self.boardCorners,
+                                   cv2.cvtColor(self.__rawCurrentBoard, cv2.COLOR_BGR2GRAY),
+                                   rectify=self.rectify, noiseMean=self.noiseMean, noiseStd=self.noiseStd,
+                                   occupancyCentroids=self.occupancyClassifier.centroids,
+                                   occupancyFeatureScale=self.occupancyClassifier.featureScale)
+
+    def findBoardCorners(self, image):
+        """
+        Method to find the internal corners of the chess board in an image, without any user interaction.
+        Return the corners ordered top down, or None if the board cannot be found.
+        """
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Detect the chessboard corner
+        # This method find all the internal corners of a chessboard
+        # For example, a standard 8x8 chessboard has 7x7 internal corners
+        with timer("findChessboardCorners"):
+            retVal, boardCorners = cv2.findChessboardCorners(image, self.SIZE_OF_INTERNAL_CORNERS,
+                                                             self.CORNER_DETECTION_FLAGS)
+        print("======> Finished findChessboardCorners")
+        if not retVal:
+            return None
+        print("====> Chess board detected")
+        # Some OpenCV versions return the corners as (N, 2) instead of (N, 1, 2)
+        boardCorners = boardCorners.reshape((-1, 1, 2))
+        with timer("cornerSubPix"):
+            boardCorners = cv2.cornerSubPix(image, boardCorners, self.SUBPIX_WINDOW_SIZE, (-1, -1),
+                                            self.SUBPIX_CRITERIA)
+
+        # Notice: Sometimes the corners will be detected from bottom up, not top down as expected
+        # This part of the program chess for this problem and correct the order of corners
+        return self.__constructTopDownBoardCorners(boardCorners)
+
+    def setBoardCorners(self, boardCorners):
+        """Method to set the corners of the board and rebuild everything computed from them"""
+        self.boardCorners = boardCorners
+        self.__buildSquareIndexMap()
+        self.__buildRectifyMaps()
+
+    def trackBoardCorners(self):
+        """
+        Method to follow the board corners on the last captured board with optical flow, so a bumped camera
+        or board keeps working. The full corner detection only runs when the tracking is lost.
+        Return True if the corners moved.
+        """
+        grayImage = self.__rawCurrentBoard
+        if grayImage.ndim == 3:
+            grayImage = cv2.cvtColor(grayImage, cv2.COLOR_BGR2GRAY)
+        if self.cornerTracker is None:
+            self.cornerTracker = CornerTracker(self.boardCorners, grayImage, self.BOARD_SIDE_INTERNAL)
+            return False
+
+        oldCorners = self.boardCorners
+        newCorners = self.cornerTracker.track(grayImage)
+        if newCorners is None:
+            # The tracking is lost, fall back to the full detection
+            newCorners = self.findBoardCorners(grayImage)
+            if newCorners is None:
+                # The board may be hidden for now, keep the old corners and try again on the next frame
+                return False
+            self.cornerTracker.reset(newCorners, grayImage)
+        # After a reset the tracker keeps its own copy of the corners, compare the values
+        if np.allclose(np.reshape(newCorners, (-1, 2)), np.reshape(oldCorners, (-1, 2))):
+            return False
+
+        self.setBoardCorners(newCorners)
+        if not self.rectify:
+            # The reference board was taken with the old corners, move it to the new ones so the squares still match.
+            # The rectified reference board is already top-down, so it does not depend on the corners
+            shift, _ = cv2.findHomography(np.asarray(oldCorners, dtype=np.float32), newCorners)
+            height, width = self.__referenceBoard.shape[:2]
+            self.__referenceBoard = cv2.warpPerspective(self.__referenceBoard, shift, (width, height))
+        return True
+
+    def __buildSquareIndexMap(self):
+        """
+        Precompute the pixel bounds of all 64 squares from boardCorners, so the difference of every
+        square can be found in a single NumPy pass instead of slicing the squares one by one.
+        The bounds use the same rounded corners as __detectIndividualSquareImages, in SQUARE_CODES order.
+        """
+        corners = np.rint(np.asarray(self.boardCorners, dtype=np.float64))
+        corners = corners.astype(np.int64).reshape((self.BOARD_SIDE_INTERNAL, self.BOARD_SIDE_INTERNAL, 2))
+        # The top left corner of a square is the corner at (row, col), its bottom right is at (row+1, col+1).
+        # The corners are projected top down, so flip the rows to make the first row the row 1 of the board
+        topLeft = corners[:-1, :-1][::-1].reshape((-1, 2))
+        botRight = corners[1:, 1:][::-1].reshape((-1, 2))
+        self.__squareBounds = (topLeft[:, 0], topLeft[:, 1], botRight[:, 0], botRight[:, 1])
+
+    def __buildRectifyMaps(self):
+        """
+        Compute the homography from boardCorners to a top-down board where every square is
+        RECTIFIED_SQUARE_SIZE pixels wide, and cache the remap tables of that warp.
+        The tables are computed once, so rectifying a frame is a single cv2.remap call.
+        """
+        side = self.BOARD_SIDE_INTERNAL
+        squareSize = self.RECTIFIED_SQUARE_SIZE
+        corners = np.asarray(self.boardCorners, dtype=np.float32).reshape((-1, 2))
+        # The corner at (row, col) goes to (col, row) * squareSize in the top-down board
+        rows, cols = np.indices((side, side), dtype=np.float32)
+        grid = np.stack([cols.ravel(), rows.ravel()], axis=1) * squareSize
+        self.boardHomography, _ = cv2.findHomography(corners, grid)
+
+        # For every pixel of the top-down board, find where it comes from in the camera image
+        boardSize = (side - 1) * squareSize
+        ys, xs = np.indices((boardSize, boardSize), dtype=np.float32)
+        pixels = np.stack([xs.ravel(), ys.ravel()], axis=1).reshape((-1, 1, 2))
+        sources = cv2.perspectiveTransform(pixels, np.linalg.inv(self.boardHomography))
+        mapX = sources[:, 0, 0].reshape((boardSize, boardSize))
+        mapY = sources[:, 0, 1].reshape((boardSize, boardSize))
+        # The fixed point version of the maps is much faster to remap with
+        self.__rectifyMaps = cv2.convertMaps(mapX, mapY, cv2.CV_16SC2)
+
+    def rectifyBoard(self, frame):
+        """Method to warp a frame from the camera into the top-down view of the 8x8 board"""
+        return cv2.remap(frame, self.__rectifyMaps[0], self.__rectifyMaps[1], cv2.INTER_LINEAR)
+
+    def getRectifiedSquares(self, rectifiedBoard):
+        """
+        Method to cut a rectified board into its squares. This is only a reshape, no copy is made.
+        Return an array of shape (8, 8, s, s) (plus the color channel if any), indexed by [row - 1, col],
+        so the square A1 is at [0, 0] and H8 is at [7, 7].
+        """
+        squareSize = self.RECTIFIED_SQUARE_SIZE
+        numSquares = self.BOARD_SIDE_INTERNAL - 1
+        squares = rectifiedBoard.reshape((numSquares, squareSize, numSquares, squareSize) + rectifiedBoard.shape[2:])
+        # The top-down board has the row 8 on top, flip it so the first row is the row 1
+        return squares.swapaxes(1, 2)[::-1]
+
+    def prepareBoard(self, frame):
+        """
+        Method to turn a captured frame into the board used to detect moves,
+        which is the rectified board in rectify mode and the frame itself otherwise
+        """
+        if self.rectify:
+            return self.rectifyBoard(frame)
+        return frame
+
     def __constructTopDownBoardCorners(self, boardCorners):
         """
         Sometimes the corners will be detected from bottom up, not top down as expected
@@ -147,11 +422,13 @@ class ChessBoardProcessor:
         else:
             return boardCorners
 
-    def __detectIndividualSquareImages(self):
+    def __detectIndividualSquareImages(self, board=None):
         """
         Method to detect and get the current image of individual squareself.
-        This will be used to detect a move later on.
+        If no board is given, the squares are cut from the last captured board.
         """
+        if board is None:
+            board = self.__rawCurrentBoard
         squareImages = {}
 
         # THIS IS THE NUMBER OF ROWS AND COLS OF CORNERS, NOT NUMBER OF ROWS AND COLS OF THE BOARD.
@@ -168,7 +445,7 @@ class ChessBoardProcessor:
                 yBotRight = int(round(self.boardCorners[(row+1) * numCols + colToNum[col] + 1][0][1]))
 
                 # Using numpy array slicing. Because using numpy, y is in front
-                square = self.__rawCurrentBoard[yTopLeft:yBotRight, xTopLeft:xBotRight]
+                square = board[yTopLeft:yBotRight, xTopLeft:xBotRight]
                 # Map the square to its actual position on the chessboard
 
                 # Attention: The actual row value is numRows - row - 1, because the image is projected from
@@ -178,14 +455,69 @@ class ChessBoardProcessor:
 
     def getIndividualSquareImages(self):
         """Method to get the array containing individual square images"""
-        return self.__currentSquareImages
+        if self.rectify:
+            squares = self.getRectifiedSquares(self.__referenceBoard)
+            return {self.SQUARE_CODES[index]: squares[index // 8, index % 8] for index in range(64)}
+        return self.__detectIndividualSquareImages(self.__referenceBoard)
+
+    def computeSquareDifferences(self, oldBoard, newBoard):
+        """
+        Method to compute the difference score of all 64 squares between 2 boards in one pass.
+        The boards are the ones returned by prepareBoard. The score of a square is the sum of the absolute
+        pixel differences inside it, the same value as cv2.absdiff(oldSquare, newSquare).sum().
+        Return an array of 64 scores in SQUARE_CODES order.
+        """
+        if self.rectify:
+            # All the squares have the same size, so the sum of each square is a sum over the tile axes
+            squares = self.getRectifiedSquares(cv2.absdiff(oldBoard, newBoard))
+            return squares.reshape((64, -1)).sum(axis=1, dtype=np.float64)
+
+        height, width = newBoard.shape[:2]
+        xTopLeft, yTopLeft, xBotRight, yBotRight = self.__squareBounds
+        # Clip the bounds the same way numpy slicing does, an inverted square is empty
+        xTopLeft = np.clip(xTopLeft, 0, width)
+        yTopLeft = np.clip(yTopLeft, 0, height)
+        xBotRight = np.clip(xBotRight, xTopLeft, width)
+        yBotRight = np.clip(yBotRight, yTopLeft, height)
+
+        # Only the part of the image covered by the squares is needed
+        xMin, yMin = xTopLeft.min(), yTopLeft.min()
+        xMax, yMax = xBotRight.max(), yBotRight.max()
+        diff = cv2.absdiff(oldBoard[yMin:yMax, xMin:xMax], newBoard[yMin:yMax, xMin:xMax])
+        # The integral image lets us sum any rectangle with 4 lookups, so all squares are summed at once
+        integral = cv2.integral(diff, sdepth=cv2.CV_64F)
+
+        xTopLeft, xBotRight = xTopLeft - xMin, xBotRight - xMin
+        yTopLeft, yBotRight = yTopLeft - yMin, yBotRight - yMin
+        scores = integral[yBotRight, xBotRight] - integral[yTopLeft, xBotRight] \
+            - integral[yBotRight, xTopLeft] + integral[yTopLeft, xTopLeft]
+        if scores.ndim > 1:
+            # Add up the channels of a colored board
+            scores = scores.sum(axis=1)
+        return scores
+
+    def grabLatestFrame(self):
+        """
+        Method to get the newest frame from the camera and the time it was read.
+        With the frame grabber, this does not block once the first frame has arrived.
+        Return (None, None) if no frame can be read.
+        """
+        if self.frameGrabber is not None:
+            return self.frameGrabber.getLatestFrame()
+
+        ret, frame = self.videoCap.read()
+        if not ret:
+            return None, None
+        return frame.copy(), time.monotonic()
 
     def captureNewBoard(self):
         """Method to capture new board from the video capture"""
-        ret, frame = self.videoCap.read()
+        frame, timestamp = self.grabLatestFrame()
 
-        if ret:
-            self.__rawCurrentBoard = frame.copy()
+        if frame is not None:
+            self.__rawCurrentBoard = frame
+            self.lastCaptureTimestamp = timestamp
+            self.framesCaptured += 1
             # DEBUG: Comment out this part for debug purpose
             # cv2.imshow("Current board", self.__rawCurrentBoard)
             # cv2.waitKey(0)
@@ -193,93 +525,241 @@ class ChessBoardProcessor:
         else:
             return False
 
-    def detectMove(self):
-        """Method to detect a move on the board"""
+    @timed()
+    def detectMove(self, capture=True):
+        """
+        Method to detect a move on the board.
+        If capture is False, the last captured board is used instead of capturing a new one.
+        Return None if no legal move explains the changes, the reference board is then kept.
+        """
 
         # Get the current chessboard
-        self.captureNewBoard()
-        # Get the current individual squares image.
-        newlyDetectedIndividualSquares = self.__detectIndividualSquareImages()
-
-        # There can only be 2 squares that are differences from a single move
-        squaresChanged = []
-
-        for squareCode in newlyDetectedIndividualSquares:
-            oldSquare = self.__currentSquareImages[squareCode]
-            newSquare = newlyDetectedIndividualSquares[squareCode]
-            # Call the method to find the difference
-            diff = cv2.absdiff(oldSquare, newSquare)
-            diff = diff.sum()
-            # DEBUG: Comment out to see the difference of all pixels
-            # print(diff)
-
-            # If the sum is different by DIFFERENCE_THRESHOLD, we consider it as difference
-            if diff > self.DIFFERENCE_THRESHOLD:
-                # print("New Value: ", newValue)
-                # print("Old value: ", oldValue)
-                squaresChanged.append(squareCode)
-                # DEBUG: Use to see the image of detected changed squares
-                # cv2.imshow("Old square " + squareCode, oldSquare)
-                # cv2.imshow("New square " + squareCode, newSquare)
-                # cv2.waitKey(0)
+        if capture:
+            self.captureNewBoard()
+        # Find the difference of every square between the reference board and the current board
+        newBoard = self.prepareBoard(self.__rawCurrentBoard)
+        squareDifferences = self.computeSquareDifferences(self.__referenceBoard, newBoard)
+        self.lastSquareDifferences = squareDifferences
+        # DEBUG: Comment out to see the difference of all squares
+        # print(squareDifferences)
+
+        # If the score is larger than the threshold, we consider it as difference
+        squareScores, threshold = self.scoreSquareDifferences(squareDifferences)
+        self.lastSquareScores = squareScores
+        squaresChanged = [code for code, score in self.getTopChangedSquares(64, squareScores) if score > threshold]
 
         # DEBUG: Print out the list of squares changed
         print(squaresChanged)
 
-        # After finished finding the differences, assign the newly detected squares to be current squares
-        self.__currentSquareImages = newlyDetectedIndividualSquares
+        move = self.__classifyAndIdentifyMove(squareScores, threshold)
+        if move is None:
+            # Nothing was moved, or something passed over the board without moving a piece
+            return None
+
+        # After finished finding the differences, the current board become the reference board
+        self.__referenceBoard = newBoard
 
         # Return the detected move
-        return self.__classifyAndIdentifyMove(squaresChanged)
+        return move
 
+    def calibrateNoise(self, numFrames=CALIBRATION_FRAMES):
+        """
+        Method to learn the noise of every square from numFrames frames of a still board.
+        Call this after setCurrentSquareImages, while nothing moves over the board.
+        Once calibrated, a square is changed when its z-score passes Z_SCORE_THRESHOLD
+        instead of comparing its raw difference to one threshold for the whole board.
+        Return False if the input ran out of frames.
+        """
+        samples = np.empty((numFrames, 64))
+        for i in range(numFrames):
+            if not self.__captureNextBoard():
+                print("Cannot read enough frames to calibrate the noise")
+                return False
+            samples[i] = self.computeSquareDifferences(self.__referenceBoard, self.prepareBoard(self.__rawCurrentBoard))
+
+        self.noiseMean = samples.mean(axis=0)
+        self.noiseStd = np.maximum(samples.std(axis=0), self.MIN_NOISE_DEVIATION * self.noiseMean + 1.0)
+        return True
+
+    def scoreSquareDifferences(self, squareDifferences):
+        """
+        Method to turn the differences of the squares into change scores.
+        Return the scores and the threshold above which a square is changed. The scores are
+        the z-scores against the calibrated noise, or the raw differences if not calibrated.
+        """
+        if self.noiseMean is None:
+            return squareDifferences, self.differenceThreshold
+        return (squareDifferences - self.noiseMean) / self.noiseStd, self.Z_SCORE_THRESHOLD
 
-    def __classifyAndIdentifyMove(self, squaresChanged):
-        """Method to classify which kind of move happened on the board."""
-        # DEBUG:
-        currentPiece1 = self.pieceAtPosition[squaresChanged[0]]
-        currentPiece2 = self.pieceAtPosition[squaresChanged[1]]
+    def getTopChangedSquares(self, k=2, squareScores=None):
+        """
+        Method to get the k squares with the highest change scores, from the last detectMove if no
+        scores are given. Return a list of (squareCode, score), the highest score first.
+        """
+        if squareScores is None:
+            squareScores = self.lastSquareScores
+        topIndices = np.argsort(squareScores)[::-1][:k]
+        return [(self.SQUARE_CODES[index], squareScores[index]) for index in topIndices]
 
-        if currentPiece1 is None or currentPiece2 is None:
-            # This is an empty move, just swap the value
-            self.pieceAtPosition[squaresChanged[0]] = currentPiece2
-            self.pieceAtPosition[squaresChanged[1]] = currentPiece1
-            if currentPiece1 is None:
-                return currentPiece2 + " from "+ squaresChanged[1] + " move to " + squaresChanged[0]
-            else:
-                return currentPiece1 + " from "+ squaresChanged[0] + " move to " + squaresChanged[1]
+    def getOccupancySquares(self):
+        """
+        Method to get the squares of the last captured board for the occupancy classifier.
+        They are always cut from the rectified board, so all 64 squares are same-sized tiles.
+        """
+        return self.getRectifiedSquares(self.rectifyBoard(self.__rawCurrentBoard))
+
+    def calibrateOccupancy(self):
+        """
+        Method to calibrate the occupancy classifier on the last captured board,
+        which must show the position of boardState. Call this at the set up, on the starting position.
+        """
+        self.occupancyClassifier.calibrate(self.getOccupancySquares(), np.sign(self.boardState.squares))
+
+    def readOccupancy(self, capture=True):
+        """
+        Method to read from a single frame whether every square is empty (0), white (1) or black (-1).
+        If capture is False, the last captured board is used instead of capturing a new one.
+        Return an int8 array of 64 occupancies in SQUARE_CODES order.
+        """
+        if capture:
+            self.captureNewBoard()
+        return self.occupancyClassifier.classify(self.getOccupancySquares())
+
+    def resyncBoardState(self, capture=True, maxPlies=OCCUPANCY_RESYNC_PLIES):
+        """
+        Method to put the board state back in line with the board seen by the camera after a missed or misread move,
+        without restarting the game. The occupancy is read from one frame and the shortest list of legal moves
+        (at most maxPlies) reaching it is applied. The current board then becomes the reference board.
+        Return the descriptions of the moves applied ([] if the state was right), or None if no list of moves matches.
+        """
+        occupancy = self.readOccupancy(capture)
+        self.boardState.sideToMove = self.currentPlayingSide
+        moves = findMovesToOccupancy(self.boardState, occupancy, maxPlies)
+        if moves is None:
+            # DEBUG: Print out the squares the board state does not agree with
+            print("Cannot resync, squares differ:",
+                  [self.SQUARE_CODES[index] for index in np.flatnonzero(np.sign(self.boardState.squares) != occupancy)])
+            return None
+
+        descriptions = []
+        for move in moves:
+            descriptions.append(self.__describeMove(move))
+            self.boardState.applyMove(move)
+            self.changeCurrentPlayingSide()
+        self.setCurrentSquareImages()
+        return descriptions
+
+    def streamMoves(self, stableFrames=MotionGate.STABLE_FRAMES, motionThreshold=MotionGate.MOTION_THRESHOLD,
+                    callback=None, trackCorners=True, frameCallback=None, isPaused=None):
+        """
+        Generator to watch the camera continuously and yield every move made on the board.
+        Each frame only goes through a cheap motion check on a thumbnail of the board. The full
+        detectMove runs once the board has been still for stableFrames frames after a motion.
+        If trackCorners is True, the board corners are also followed on every still frame.
+        If callback is given, it is also called with each move. If frameCallback is given, it is called
+        with every captured frame and the generator ends as soon as it returns False.
+        Otherwise the generator ends when the input runs out of frames.
+        If isPaused is given, no move is detected while it returns True (the robot arm is changing the board),
+        the detection waits for stableFrames still frames after the pause.
+        """
+        gate = MotionGate(self.boardCorners, motionThreshold, stableFrames)
+        while self.__captureNextBoard():
+            if frameCallback is not None and frameCallback(self.__rawCurrentBoard) is False:
+                return
+            boardIsStable = gate.update(self.__rawCurrentBoard)
+            if isPaused is not None and isPaused():
+                # A half done move of the arm must not be detected, wait until the board is still after the pause
+                gate.markMotion()
+                continue
+            # Only track on still frames, a hand over the board would make the tracking fail for nothing
+            if trackCorners and gate.isStill() and self.trackBoardCorners():
+                gate.setRegion(self.boardCorners)
+            if not boardIsStable:
+                continue
+            move = self.detectMove(capture=False)
+            if move is None:
+                continue
+            if callback is not None:
+                callback(move)
+            yield move
+
+    def __captureNextBoard(self):
+        """
+        Method to capture the frame following the last captured board. Unlike captureNewBoard,
+        this waits for a new frame from the frame grabber instead of returning the same one twice.
+        Return False when there is no frame left to read.
+        """
+        if self.frameGrabber is None:
+            return self.captureNewBoard()
+
+        lastTimestamp = self.lastCaptureTimestamp if self.lastCaptureTimestamp is not None else float("-inf")
+        while True:
+            frame, timestamp = self.frameGrabber.waitForNewFrame(lastTimestamp, timeout=1.0)
+            if frame is not None:
+                self.__rawCurrentBoard = frame
+                self.lastCaptureTimestamp = timestamp
+                self.framesCaptured += 1
+                return True
+            if not self.frameGrabber.isRunning():
+                return False
+
+
+    def __classifyAndIdentifyMove(self, squareScores, threshold):
+        """
+        Method to find which legal move happened on the board from the change scores of the squares,
+        apply it to the board state and describe it. This also finds castling (4 changed squares),
+        en passant (3 changed squares) and promotions, and ignores noisy squares that no legal move explains.
+        Return None if no legal move matches the changes.
+        """
+        self.boardState.sideToMove = self.currentPlayingSide
+        move = inferMove(self.boardState, squareScores, threshold)
+        if move is None:
+            return None
+
+        description = self.__describeMove(move)
+        self.boardState.applyMove(move)
+        return description
+
+    def __describeMove(self, move):
+        """Method to describe a legal move of the current board state, before it is applied"""
+        fromSquare, toSquare, promotion = move
+        side = str(self.currentPlayingSide)
+        movedPiece = self.boardState.pieceCodeAt(fromSquare)
+        changedSquares = changedSquaresOfMove(self.boardState, move)
+
+        if len(changedSquares) == 4:
+            description = "Castling of" + side + " " + movedPiece + " from " + BoardState.SQUARE_CODES[fromSquare] + \
+                " move to " + BoardState.SQUARE_CODES[toSquare]
+        elif len(changedSquares) == 3:
+            # The captured pawn of an en passant is not on the target square
+            description = "En passant of" + side + " " + movedPiece + " capture " + \
+                self.boardState.pieceCodeAt(changedSquares[2])
+        elif self.boardState.squares[toSquare] != 0:
+            description = "Capture of" + side + " " + movedPiece + " capture " + self.boardState.pieceCodeAt(toSquare)
         else:
-            # This is a capture move
-            # TODO: Debug the capture move
-            # The piece is in the form TypeSide (e.g: K0). Get the side of the piece
-            # print(currentPiece1)
-            # for char in currentPiece1:
-            #     print(char)
-            currentPiece1 = currentPiece1.strip()
-            currentPiece2 = currentPiece2.strip()
-
-            currentPiece1Side = currentPiece1[1]
-            if int(currentPiece1Side) == self.currentPlayingSide:
-                # This is the turn of currentPiece1, so it is a capture from piece1 to piece2
-                # The last piece1 square become empty, and the position of piece2 is capture by piece1
-                self.pieceAtPosition[squaresChanged[0]] = None
-                self.pieceAtPosition[squaresChanged[1]] = currentPiece1
-                return "Capture of" + currentPiece1Side + " " + currentPiece1 + " capture " + currentPiece2
-            else:
-                # This is the turn of currentPiece2, so it is a capture from piece2 to piece1
-                self.pieceAtPosition[squaresChanged[1]] = None
-                self.pieceAtPosition[squaresChanged[0]] = currentPiece2
-                return "Capture of" + str(self.currentPlayingSide) + " " + currentPiece2 + " capture " + currentPiece1
+            description = movedPiece + " from " + BoardState.SQUARE_CODES[fromSquare] + " move to " + \
+                BoardState.SQUARE_CODES[toSquare]
+
+        if promotion:
+            description += " promote to " + BoardState.PIECE_LETTERS[promotion] + side
+        return description
 
     def setCurrentSquareImages(self):
         """Method to set the current square images to the current board setting"""
-        self.__currentSquareImages = self.__detectIndividualSquareImages()
+        self.__referenceBoard = self.prepareBoard(self.__rawCurrentBoard)
 
     def changeCurrentPlayingSide(self):
         """Method to toggle the current playing side"""
         self.currentPlayingSide = 1 - self.currentPlayingSide
 
+    def release(self):
+        """Method to stop the frame grabber and release the camera"""
+        if self.frameGrabber is not None:
+            self.frameGrabber.stop()
+        self.videoCap.release()
+
 if __name__ == '__main__':
-    boardPorcessor = ChessBoardProcessor(inputSource=0)
+    boardPorcessor = ChessBoardProcessor(inputSource=0, useGrabber=True, calibrationStore=CalibrationStore())
     # print(boardPorcessor.boardCorners)
     # squares = boardPorcessor.getIndividualSquareImages()
     # print(squares)
@@ -290,8 +770,12 @@ if __name__ == '__main__':
     input("Enter to begin: ")
     boardPorcessor.captureNewBoard()
     boardPorcessor.setCurrentSquareImages()
-    while True:
-        # DEBUG: Work on multiple moves
-        input("Enter to move on: ")
-        print(boardPorcessor.detectMove())
+    if boardPorcessor.noiseMean is None:
+        boardPorcessor.calibrateNoise()
+    if not boardPorcessor.occupancyClassifier.isCalibrated():
+        boardPorcessor.calibrateOccupancy()
+    boardPorcessor.saveCalibration()
+    # Moves are detected as soon as the board is still again, no need to hit enter after each move
+    for move in boardPorcessor.streamMoves():
+        print(move)
         boardPorcessor.changeCurrentPlayingSide()
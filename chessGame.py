@@ -1,31 +1,53 @@
+from calibrationStore import CalibrationStore
 from chessBoardProcessing import *
 from client import *
+from gameOrchestrator import GameOrchestrator
+from instrumentation import metrics
 
-# Creat the chessboard processor
-boardPorcessor = ChessBoardProcessor(inputSource=1)
+# Creat the chessboard processor, the board is only detected again if the saved calibration does not match anymore
+boardPorcessor = ChessBoardProcessor(inputSource=1, useGrabber=True, calibrationStore=CalibrationStore())
 
 # Before hit enter, set up the board
 input("Hit enter to begin the game: ")
 
 boardPorcessor.captureNewBoard()
 boardPorcessor.setCurrentSquareImages()
+# Learn the noise of every square while the board is still, unless it was saved with the calibration
+if boardPorcessor.noiseMean is None:
+    boardPorcessor.calibrateNoise()
+# Learn how the empty, white and black squares look on the starting position, so a missed move can be resynced
+if not boardPorcessor.occupancyClassifier.isCalibrated():
+    boardPorcessor.calibrateOccupancy()
+boardPorcessor.saveCalibration()
 
-while True:
-    # This is the turn of the player
-    input("Enter to move on: ")
-    print(boardPorcessor.detectMove())
-    boardPorcessor.changeCurrentPlayingSide()
-
-    # This is the turn of the robot
-    # At this step, use the AI agent to calculate the next move, here we are just hardcode
-    # Move the piece from A7 to D4
-    move = input("Enter your move: ")
-    move = move.strip()
-
-    # Create connection to robot
-    socket = ClientSideRobotArm()
-    socket.sendData(move)
-    while socket.receivedData != "done":
-        pass
-    print("Complete move")
-    print(boardPorcessor.detectMove())
+# One connection to the robot for the whole game
+robotArm = BlockingRobotArmClient()
+
+
+def askMove(board, legalMoves):
+    """
+    Ask the move of the robot until a legal one is typed, like "E7-E5".
+    At this step, use the AI agent to calculate the next move, here the move is typed
+    """
+    while True:
+        move = input("Enter your move: ").strip()
+        try:
+            fromSquare, toSquare = (board.squareIndex(square) for square in move.upper().split("-"))
+        except (KeyError, ValueError):
+            fromSquare = toSquare = None
+        matchingMoves = [legalMove for legalMove in legalMoves
+                         if legalMove.fromSquare == fromSquare and legalMove.toSquare == toSquare]
+        if matchingMoves:
+            # The first promotion of a pawn is to a queen
+            return matchingMoves[0]
+        print("Not a legal move: ", move)
+
+
+# The camera, the move detection, the decision and the robot run at the same time, connected by queues.
+# Moves are detected as soon as the board is still again after a move, no need to hit enter
+game = GameOrchestrator(boardPorcessor, robotArm, askMove)
+for turn in game.run():
+    print(turn)
+print(metrics.toPrometheus())
+robotArm.close()
+boardPorcessor.release()
@@ -1,11 +1,19 @@
+import asyncio
+import json
 import socket
 import sys
+import threading
 import time
 
+from framing import FramingError, readMessage, writeMessage
+
 
 class ClientSideRobotArm:
-    def __init__(self):
-        self.HOST, self.PORT  = "169.254.213.45", 9999
+    DEFAULT_HOST = "169.254.213.45"
+    DEFAULT_PORT = 9999
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.HOST, self.PORT  = host, port
         self.receivedData = ""
 
         # Established the sokcet object
@@ -19,6 +27,258 @@ class ClientSideRobotArm:
         # Recieve the host data
         self.receivedData = str(self.sockt.recv(4096), "utf-8")
 
+    def sendBatch(self, operations, onProgress=None):
+        """
+        Method to run a list of operations of the arm in one request, like
+        [{"op": "remove", "from": "D5"}, {"op": "move", "from": "E4", "to": "D5"}].
+        onProgress is called with every message the server streams back before the end: the position of the batch
+        in the queue of the server ({"event": "queued"}), then the start and end of every step (see MotionScheduler).
+        Return the last message, its "status" is "done", "aborted", "timeout" or "error".
+        """
+        self.sockt.sendall(bytes("batch " + json.dumps(operations) + "\n", "utf-8"))
+        buffer = b""
+        while True:
+            while b"\n" not in buffer:
+                chunk = self.sockt.recv(4096)
+                if not chunk:
+                    raise ConnectionError("The robot closed the connection before the end of the batch")
+                buffer += chunk
+            line, buffer = buffer.split(b"\n", 1)
+            message = json.loads(line.decode("utf-8"))
+            if "status" in message:
+                self.receivedData = message["status"]
+                return message
+            if onProgress is not None:
+                onProgress(message)
+
+    def emergencyStop(self):
+        """
+        Method to stop the robot arm right away, even in the middle of a move.
+        Return the time the server took to stop the motors in milliseconds.
+        """
+        self.sendData("stop")
+        # The answer is "stopped <milliseconds>"
+        return float(self.receivedData.split()[1])
+
+    def requestMetrics(self, jsonFormat=False):
+        """
+        Method to get the timing of the robot stages, as Prometheus text or as JSON if jsonFormat is True.
+        The server closes the connection after answering, so read until the end.
+        """
+        self.sockt.sendall(bytes("metrics json" if jsonFormat else "metrics", "utf-8"))
+        chunks = []
+        while True:
+            chunk = self.sockt.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        self.receivedData = str(b"".join(chunks), "utf-8")
+        return self.receivedData
+
+
+class PersistentRobotArmClient:
+    """
+    Client keeping one connection to the robot open, with framed messages (see framing), for asyncio code.
+    Every request is a coroutine awaited with a timeout, several can be in flight (a stop during a move).
+    A ping is sent every heartbeatInterval seconds, a connection that does not answer it or that the robot closed
+    is opened again. A request in flight when the connection is lost fails with ConnectionError,
+    it is not sent again since the arm may already have moved.
+    """
+
+    # The time between 2 pings, and how long the answer to a ping may take
+    HEARTBEAT_INTERVAL = 2.0
+    HEARTBEAT_TIMEOUT = 2.0
+    # How long a request may take by default, a batch of operations takes up to a few minutes
+    REQUEST_TIMEOUT = 300.0
+    CONNECT_TIMEOUT = 5.0
+    # The wait before opening the connection again, doubled after every failure
+    RECONNECT_DELAY = 0.5
+    MAX_RECONNECT_DELAY = 8.0
+
+    def __init__(self, host=ClientSideRobotArm.DEFAULT_HOST, port=ClientSideRobotArm.DEFAULT_PORT,
+                 heartbeatInterval=HEARTBEAT_INTERVAL, requestTimeout=REQUEST_TIMEOUT):
+        self.host, self.port = host, port
+        self.heartbeatInterval = heartbeatInterval
+        self.requestTimeout = requestTimeout
+        # The number of times the connection was opened again, and the time of the last ping in seconds
+        self.reconnects = 0
+        self.lastRoundTrip = None
+        self.__writer = None
+        self.__connected = asyncio.Event()
+        # The requests waiting for their answer, by id: (future, onProgress)
+        self.__pending = {}
+        self.__nextId = 0
+        self.__closing = False
+        self.__connectionTask = None
+
+    async def connect(self, timeout=CONNECT_TIMEOUT):
+        """Method to open the connection, it is then kept open until close"""
+        if self.__connectionTask is None:
+            self.__closing = False
+            self.__connectionTask = asyncio.ensure_future(self.__keepConnected())
+        await asyncio.wait_for(self.__connected.wait(), timeout)
+
+    def isConnected(self):
+        """Method to check whether the connection is open"""
+        return self.__connected.is_set()
+
+    async def __keepConnected(self):
+        """Open the connection and read the answers, open it again each time it is lost"""
+        delay = self.RECONNECT_DELAY
+        while not self.__closing:
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port),
+                                                        self.CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as error:
+                print("Cannot connect to the robot, trying again in {} s: {}".format(delay, error))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+                continue
+            delay = self.RECONNECT_DELAY
+            self.__writer = writer
+            self.__connected.set()
+            heartbeat = asyncio.ensure_future(self.__heartbeat(writer))
+            try:
+                await self.__readAnswers(reader)
+            except (FramingError, ValueError, OSError) as error:
+                print("Connection to the robot lost: ", error)
+            finally:
+                self.__connected.clear()
+                heartbeat.cancel()
+                writer.close()
+                self.__failPending(ConnectionError("The connection to the robot was lost"))
+            if not self.__closing:
+                self.reconnects += 1
+
+    async def __readAnswers(self, reader):
+        """Give every answer to its request until the connection is closed"""
+        while True:
+            message = await readMessage(reader)
+            if message is None:
+                return
+            pending = self.__pending.get(message.get("id"))
+            if pending is None:
+                # The answer of a request that timed out
+                continue
+            future, onProgress = pending
+            if "status" in message:
+                if not future.done():
+                    future.set_result(message)
+            elif onProgress is not None:
+                onProgress(message)
+
+    async def __heartbeat(self, writer):
+        """Ping the robot, close a connection that does not answer so it is opened again"""
+        while True:
+            await asyncio.sleep(self.heartbeatInterval)
+            try:
+                await self.ping(self.HEARTBEAT_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError):
+                print("The robot does not answer the heartbeat, connecting again")
+                writer.close()
+                return
+
+    def __failPending(self, error):
+        for future, _ in self.__pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def request(self, command, timeout=None, onProgress=None, **arguments):
+        """
+        Method to send a request and wait for its last answer (the one with a "status"), up to timeout seconds
+        (requestTimeout by default), then raise asyncio.TimeoutError. onProgress is called with the other answers.
+        """
+        if not self.__connected.is_set():
+            await self.connect()
+        self.__nextId += 1
+        requestId = self.__nextId
+        future = asyncio.get_event_loop().create_future()
+        self.__pending[requestId] = (future, onProgress)
+        try:
+            writeMessage(self.__writer, dict(arguments, id=requestId, command=command))
+            await self.__writer.drain()
+            return await asyncio.wait_for(future, timeout if timeout is not None else self.requestTimeout)
+        finally:
+            del self.__pending[requestId]
+
+    async def ping(self, timeout=HEARTBEAT_TIMEOUT):
+        """Method to check that the robot answers, return the round trip time in seconds"""
+        start = time.perf_counter()
+        await self.request("ping", timeout)
+        self.lastRoundTrip = time.perf_counter() - start
+        return self.lastRoundTrip
+
+    async def move(self, pos1, pos2, onProgress=None, timeout=None):
+        """Method to move a piece from pos1 to pos2, return the last answer (see sendBatch)"""
+        return await self.request("move", timeout, onProgress, **{"from": pos1, "to": pos2})
+
+    async def sendBatch(self, operations, onProgress=None, timeout=None):
+        """
+        Method to run a list of operations of the arm (see ClientSideRobotArm.sendBatch).
+        Return the last answer, its "status" is "done", "aborted", "timeout" or "error".
+        """
+        return await self.request("batch", timeout, onProgress, operations=operations)
+
+    async def emergencyStop(self, timeout=HEARTBEAT_TIMEOUT):
+        """Method to stop the robot arm right away, return the time the server took in milliseconds"""
+        answer = await self.request("stop", timeout)
+        return answer["milliseconds"]
+
+    async def requestStatus(self, timeout=HEARTBEAT_TIMEOUT):
+        """Method to get the state of the robot without waiting for the motion in progress (see RobotServer.status)"""
+        answer = await self.request("status", timeout)
+        return answer["arm"]
+
+    async def requestMetrics(self, timeout=HEARTBEAT_TIMEOUT):
+        """Method to get the timing of the robot stages as a dict"""
+        answer = await self.request("metrics", timeout)
+        return answer["metrics"]
+
+    async def close(self):
+        """Method to close the connection for good"""
+        self.__closing = True
+        if self.__connectionTask is not None:
+            self.__connectionTask.cancel()
+            try:
+                await self.__connectionTask
+            except asyncio.CancelledError:
+                pass
+            self.__connectionTask = None
+
+
+class BlockingRobotArmClient:
+    """The persistent client for code without asyncio: its event loop runs on a background thread"""
+
+    def __init__(self, host=ClientSideRobotArm.DEFAULT_HOST, port=ClientSideRobotArm.DEFAULT_PORT, **kwargs):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.call(self.__createClient(host, port, kwargs))
+        self.call(self.client.connect())
+
+    @staticmethod
+    async def __createClient(host, port, kwargs):
+        # Create the client in the loop, its event belongs to that loop
+        return PersistentRobotArmClient(host, port, **kwargs)
+
+    def call(self, coroutine):
+        """Method to run a coroutine of the client and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def move(self, pos1, pos2, onProgress=None, timeout=None):
+        return self.call(self.client.move(pos1, pos2, onProgress, timeout))
+
+    def sendBatch(self, operations, onProgress=None, timeout=None):
+        return self.call(self.client.sendBatch(operations, onProgress, timeout))
+
+    def emergencyStop(self):
+        return self.call(self.client.emergencyStop())
+
+    def close(self):
+        self.call(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
 if __name__ == '__main__':
     client = ClientSideRobotArm()
     client.sendData("A7-A6")
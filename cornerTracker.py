@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+
+class CornerTracker:
+    """
+    Tracker that follows the internal corners of the board from frame to frame with pyramidal Lucas-Kanade
+    optical flow, so a bumped camera or board does not need the slow full detection.
+    A homography of the whole grid is fitted to the tracked corners, which drops the corners tracked wrongly and
+    fills in the corners hidden by the pieces. The tracking is lost when the fit is not good enough.
+    """
+
+    WINDOW_SIZE = (11, 11)
+    PYRAMID_LEVELS = 3
+    FLOW_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.03)
+    # The largest mean distance (in pixels) between the tracked corners and the fitted grid
+    MAX_RESIDUAL = 1.0
+    # The smallest part of the corners that must be tracked correctly
+    MIN_TRACKED_RATIO = 0.6
+    # The corners are only updated if one of them moved by more than this (in pixels), below it is noise
+    MIN_MOTION = 0.5
+
+    def __init__(self, boardCorners, grayImage, boardSide=9):
+        # The position of every corner on the board grid, the unit is one square
+        rows, cols = np.indices((boardSide, boardSide), dtype=np.float32)
+        self.gridCorners = np.stack([cols.ravel(), rows.ravel()], axis=1).reshape((-1, 1, 2))
+        # The residual of the last tracking, in pixels
+        self.lastResidual = 0.0
+        self.reset(boardCorners, grayImage)
+
+    def reset(self, boardCorners, grayImage):
+        """Method to restart the tracking from the known corners of a gray image"""
+        self.boardCorners = np.asarray(boardCorners, dtype=np.float32).reshape((-1, 1, 2))
+        self.__previousGray = grayImage
+
+    def track(self, grayImage):
+        """
+        Method to follow the corners from the gray image they were last set on to grayImage.
+        Return the new corners (the same array if they did not move), or None if the tracking is lost.
+        """
+        newCorners, status, _ = cv2.calcOpticalFlowPyrLK(self.__previousGray, grayImage, self.boardCorners, None,
+                                                         winSize=self.WINDOW_SIZE, maxLevel=self.PYRAMID_LEVELS,
+                                                         criteria=self.FLOW_CRITERIA)
+        tracked = status.ravel() == 1
+        if tracked.mean() < self.MIN_TRACKED_RATIO:
+            return None
+
+        # Fit the whole grid to the tracked corners, so one bad corner cannot bend the board
+        homography, inliers = cv2.findHomography(self.gridCorners[tracked], newCorners[tracked], cv2.RANSAC,
+                                                 self.MAX_RESIDUAL * 2)
+        if homography is None:
+            return None
+        fittedCorners = cv2.perspectiveTransform(self.gridCorners, homography)
+        inliers = inliers.ravel() == 1
+        residuals = np.linalg.norm((fittedCorners[tracked] - newCorners[tracked]).reshape((-1, 2)), axis=1)
+        self.lastResidual = float(residuals[inliers].mean())
+        if inliers.sum() < self.MIN_TRACKED_RATIO * len(self.gridCorners) or self.lastResidual > self.MAX_RESIDUAL:
+            return None
+
+        motion = np.linalg.norm((fittedCorners - self.boardCorners).reshape((-1, 2)), axis=1).max()
+        if motion > self.MIN_MOTION:
+            # The previous image is only replaced with the corners, so a slow drift still adds up to a motion
+            self.reset(fittedCorners, grayImage)
+        return self.boardCorners
@@ -0,0 +1,38 @@
+"""
+The backend of the devices of the robot: the motors and sensors of ev3dev on the robot, or the simulated ones
+of ev3sim anywhere else. Both modules have the same classes (LargeMotor, MediumMotor, TouchSensor,
+UltrasonicSensor and GyroSensor), RobotArm only uses them through the module it is given.
+
+    ROBOT_BACKEND=sim ROBOT_SIM_SPEEDUP=50 python socketTrial.py
+
+Only the standard library is used, this runs on the robot.
+"""
+import os
+
+# The environment variable choosing the backend when no name is given: "ev3" (the default) or "sim"
+BACKEND_VARIABLE = "ROBOT_BACKEND"
+# The environment variable of the speedup of the clock of the simulation, 1 runs it in real time
+SPEEDUP_VARIABLE = "ROBOT_SIM_SPEEDUP"
+
+EV3_BACKEND = "ev3"
+SIM_BACKEND = "sim"
+
+
+def loadBackend(name=None):
+    """
+    Return the module of the devices named name, "ev3" or "sim", by default the one of the environment variable
+    ROBOT_BACKEND. The simulation runs on a clock faster than real time if ROBOT_SIM_SPEEDUP is set.
+    Raise ValueError for an unknown backend.
+    """
+    if name is None:
+        name = os.environ.get(BACKEND_VARIABLE, EV3_BACKEND)
+    if name == EV3_BACKEND:
+        import ev3dev.ev3 as ev3
+        return ev3
+    if name == SIM_BACKEND:
+        import ev3sim
+        speedup = os.environ.get(SPEEDUP_VARIABLE)
+        if speedup is not None:
+            ev3sim.useSpeedup(float(speedup))
+        return ev3sim
+    raise ValueError("Unknown device backend " + str(name))
@@ -0,0 +1,407 @@
+"""
+Simulated EV3 devices for the robot arm, with the classes of ev3dev.ev3 that RobotArm uses (see deviceBackend):
+LargeMotor, MediumMotor, TouchSensor, UltrasonicSensor and GyroSensor.
+The motors follow a small physics model: they ramp up and down to their speed, count tacho counts, stop with
+their stop_action and stall against the touch sensor. The sensors read the motors of the arm through the gears:
+the ultrasonic sensor measures the distance of the surface move with noise, the gyro the angle of the turning
+motor with a drift, and the touch sensor is pressed at the right end of the turning range, where the arm starts.
+Everything runs on the clock of robotClock: with useSpeedup the robot code and the simulation run faster than
+real time, so whole games of moves can be profiled and tested without the robot.
+
+    import ev3sim
+    ev3sim.useSpeedup(50)
+    robot = RobotArm(backend=ev3sim)
+
+The state of the simulation is in a SimWorld, resetWorld starts a new one (before creating the RobotArm).
+Only the standard library is used.
+"""
+import random
+import threading
+
+import robotClock
+from robotClock import ScaledClock, setClock
+
+# The ports of the devices of the arm, as in RobotArm.DEFAULT_CONFIG
+SURFACE_PORT = "outA"
+VERTICAL_PORT = "outB"
+TURNING_PORT = "outC"
+HAND_PORT = "outD"
+
+
+class SimWorld:
+    """
+    The state of the simulated arm: the motors by port, the gears linking them to the sensors,
+    and the random noise of the sensors. The devices of ev3sim are created in the current world (see getWorld).
+    """
+
+    # The gears of the arm: the cm moved on the surface and the degrees turned per tacho count.
+    # They differ from RobotArm.CM_PER_COUNT and DEGREES_PER_COUNT on purpose, like the real gears,
+    # calibrateEncoders has to find them
+    CM_PER_COUNT = 0.0105
+    DEGREES_PER_COUNT = 0.3
+    # The distance the ultrasonic sensor reads at the start position, in cm,
+    # the standard deviation of its noise and its resolution
+    START_DISTANCE = 40.0
+    ULTRASONIC_NOISE = 0.2
+    ULTRASONIC_RESOLUTION = 0.1
+    # The drift of the gyro, in degrees per second
+    GYRO_DRIFT = 0.01
+    # The turning range ends on the right against the touch sensor, where the arm starts (count 0 of the
+    # turning motor). The sensor is pressed within TOUCH_TRAVEL degrees of the end
+    TOUCH_TRAVEL = 1.0
+
+    def __init__(self, seed=None, cmPerCount=CM_PER_COUNT, degreesPerCount=DEGREES_PER_COUNT,
+                 startDistance=START_DISTANCE, ultrasonicNoise=ULTRASONIC_NOISE, gyroDrift=GYRO_DRIFT):
+        self.random = random.Random(seed)
+        self.cmPerCount = cmPerCount
+        self.degreesPerCount = degreesPerCount
+        self.startDistance = startDistance
+        self.ultrasonicNoise = ultrasonicNoise
+        self.gyroDrift = gyroDrift
+        self.startTime = self.now()
+        # The motors by port, the motors and the sensors reading them share this lock
+        self.motors = {}
+        self.lock = threading.RLock()
+
+    def now(self):
+        """Method to get the time of the simulation, in seconds"""
+        return robotClock.monotonic()
+
+    def addMotor(self, motor):
+        """Method to plug a motor in its port, the turning motor stops against the touch sensor"""
+        with self.lock:
+            if motor.address == TURNING_PORT:
+                motor.maxPosition = self.TOUCH_TRAVEL / self.degreesPerCount / 2
+            self.motors[motor.address] = motor
+
+    def motorPosition(self, port):
+        """Method to get the exact position of the motor of a port in tacho counts, 0 without a motor"""
+        motor = self.motors.get(port)
+        return 0.0 if motor is None else motor.exactPosition()
+
+    def armDistance(self):
+        """Method to get the true distance moved forward on the surface from the start position, in cm"""
+        # Negative counts move the arm forward, like in RobotArm.forward
+        return -self.motorPosition(SURFACE_PORT) * self.cmPerCount
+
+    def armAngle(self):
+        """Method to get the true angle of the arm from the start position, in degrees (positive to the right)"""
+        return self.motorPosition(TURNING_PORT) * self.degreesPerCount
+
+
+# The world the devices are created in
+_world = None
+
+
+def getWorld():
+    """Get the current world, a default one is created the first time"""
+    global _world
+    if _world is None:
+        _world = SimWorld()
+    return _world
+
+
+def resetWorld(**options):
+    """Start a new world with the options of SimWorld, the devices created after this are in it"""
+    global _world
+    _world = SimWorld(**options)
+    return _world
+
+
+def useSpeedup(speedup):
+    """Run the robot code and the simulation speedup times faster than real time, 1 is real time"""
+    setClock(ScaledClock(speedup))
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+class Motor:
+    """
+    A simulated tacho motor. The position is integrated lazily: every read of the state moves the motor
+    to the current time of the simulation, in exact pieces of constant acceleration.
+    The commands are "run-forever", "run-timed", "run-to-rel-pos", "run-to-abs-pos" and "stop" like ev3dev.
+    """
+
+    # The acceleration to the target speed, and the deceleration after a stop, in counts per second squared.
+    # "coast" lets the motor roll out, "brake" and "hold" stop it hard
+    ACCELERATION = 6000.0
+    BRAKE_DECELERATION = 20000.0
+    COAST_DECELERATION = 2000.0
+    # A run to a position ends within this number of counts of the target
+    POSITION_TOLERANCE = 0.5
+
+    def __init__(self, address, maxSpeed, world=None):
+        self.world = world if world is not None else getWorld()
+        self.address = address
+        self.max_speed = maxSpeed
+        self.count_per_rot = 360
+        self.speed_sp = 0
+        self.time_sp = 0
+        self.position_sp = 0
+        self.stop_action = "coast"
+        # The end of the range of the motor in counts, it stalls there (None for no end)
+        self.maxPosition = None
+        self.__position = 0.0
+        self.__velocity = 0.0
+        self.__command = "stop"
+        self.__endTime = None
+        self.__target = None
+        # Whether the motor is pushing against the end of its range
+        self.__stalled = False
+        self.__time = self.world.now()
+        self.world.addMotor(self)
+
+    # ---------------------------------------------------------------------------
+    # Physics
+
+    def exactPosition(self):
+        """Method to get the position in counts, not rounded like position"""
+        with self.world.lock:
+            self.__advance()
+            return self.__position
+
+    def __advance(self):
+        """Move the motor from the time of its state to the current time"""
+        now = self.world.now()
+        while self.__time < now:
+            self.__time += self.__step(now - self.__time)
+
+    def __step(self, seconds):
+        """Move the motor for at most seconds with a constant acceleration, return the time moved"""
+        if self.__command == "run-timed" and self.__time >= self.__endTime:
+            self.__command = "stop"
+        if self.__command == "stop":
+            if self.__velocity == 0:
+                return seconds
+            deceleration = self.COAST_DECELERATION if self.stop_action == "coast" else self.BRAKE_DECELERATION
+            return self.__rampTo(0.0, deceleration, seconds)
+        if self.__command in ("run-forever", "run-timed"):
+            if self.__command == "run-timed":
+                seconds = min(seconds, self.__endTime - self.__time)
+            return self.__rampTo(self.__clampSpeed(self.speed_sp), self.ACCELERATION, seconds)
+        return self.__stepToTarget(seconds)
+
+    def __stepToTarget(self, seconds):
+        """Move toward the target of a run to a position: ramp up, run at speed_sp, then brake onto the target"""
+        remaining = self.__target - self.__position
+        direction = _sign(remaining)
+        if abs(remaining) <= self.POSITION_TOLERANCE:
+            self.__position = self.__target
+            self.__velocity = 0.0
+            self.__command = "stop"
+            return 0.0
+        velocity = self.__velocity
+        if _sign(velocity) == direction and velocity * velocity / (2 * self.ACCELERATION) >= abs(remaining):
+            # Brake to land exactly on the target
+            stopTime = 2 * abs(remaining) / abs(velocity)
+            if seconds >= stopTime:
+                self.__position = self.__target
+                self.__velocity = 0.0
+                self.__command = "stop"
+                return stopTime
+            self.__accelerate(-velocity * velocity / (2 * remaining), seconds)
+            return seconds
+        cruiseSpeed = direction * self.__clampSpeed(abs(self.speed_sp))
+        if velocity != cruiseSpeed:
+            # Ramping, in short pieces so the braking point is not passed by much
+            return self.__rampTo(cruiseSpeed, self.ACCELERATION, min(seconds, 0.002))
+        # Run at speed until the braking point
+        brakingDistance = velocity * velocity / (2 * self.ACCELERATION)
+        cruiseTime = max((abs(remaining) - brakingDistance) / abs(velocity), 1e-6)
+        return self.__accelerate(0.0, min(seconds, cruiseTime))
+
+    def __rampTo(self, velocity, acceleration, seconds):
+        """Change the velocity toward velocity for at most seconds, return the time moved"""
+        difference = velocity - self.__velocity
+        if difference == 0:
+            return self.__accelerate(0.0, seconds)
+        rampTime = abs(difference) / acceleration
+        if seconds >= rampTime:
+            self.__accelerate(_sign(difference) * acceleration, rampTime)
+            self.__velocity = velocity
+            return rampTime
+        return self.__accelerate(_sign(difference) * acceleration, seconds)
+
+    def __accelerate(self, acceleration, seconds):
+        """Move for seconds with a constant acceleration, return seconds"""
+        self.__position += self.__velocity * seconds + acceleration * seconds * seconds / 2
+        self.__velocity += acceleration * seconds
+        self.__stalled = False
+        if self.maxPosition is not None and self.__position > self.maxPosition:
+            # Stalled at the end of the range, the motor keeps pushing while it runs
+            self.__position = self.maxPosition
+            self.__velocity = 0.0
+            self.__stalled = seconds > 0
+        return seconds
+
+    def __clampSpeed(self, speed):
+        return max(-self.max_speed, min(self.max_speed, speed))
+
+    def __start(self, command, kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+        with self.world.lock:
+            self.__advance()
+            self.__command = command
+            if command == "run-timed":
+                self.__endTime = self.__time + self.time_sp / 1000.0
+            elif command == "run-to-rel-pos":
+                self.__target = self.__position + self.position_sp
+            elif command == "run-to-abs-pos":
+                self.__target = float(self.position_sp)
+
+    # ---------------------------------------------------------------------------
+    # The interface of ev3dev
+
+    def run_forever(self, **kwargs):
+        self.__start("run-forever", kwargs)
+
+    def run_timed(self, **kwargs):
+        self.__start("run-timed", kwargs)
+
+    def run_to_rel_pos(self, **kwargs):
+        self.__start("run-to-rel-pos", kwargs)
+
+    def run_to_abs_pos(self, **kwargs):
+        self.__start("run-to-abs-pos", kwargs)
+
+    def stop(self, **kwargs):
+        self.__start("stop", kwargs)
+
+    def reset(self):
+        with self.world.lock:
+            self.__advance()
+            self.__command = "stop"
+            self.__velocity = 0.0
+            self.__position = 0.0
+        self.speed_sp = self.time_sp = self.position_sp = 0
+        self.stop_action = "coast"
+
+    @property
+    def position(self):
+        return int(round(self.exactPosition()))
+
+    @position.setter
+    def position(self, value):
+        with self.world.lock:
+            self.__advance()
+            self.__position = float(value)
+
+    @property
+    def speed(self):
+        with self.world.lock:
+            self.__advance()
+            return int(round(self.__velocity))
+
+    @property
+    def is_running(self):
+        with self.world.lock:
+            self.__advance()
+            return self.__command != "stop"
+
+    @property
+    def state(self):
+        with self.world.lock:
+            self.__advance()
+            if self.__command != "stop":
+                return ["running", "stalled"] if self.__stalled else ["running"]
+            return ["holding"] if self.stop_action == "hold" else []
+
+    def wait_until_not_moving(self, timeout=None):
+        """Wait until the motor stops running, timeout in milliseconds, return False if it is still running"""
+        deadline = None if timeout is None else robotClock.monotonic() + timeout / 1000.0
+        while self.is_running:
+            if deadline is not None and robotClock.monotonic() >= deadline:
+                return False
+            robotClock.sleep(0.01)
+        return True
+
+
+class LargeMotor(Motor):
+    # The tacho counts per second at full speed
+    MAX_SPEED = 1050
+
+    def __init__(self, address, world=None):
+        super(LargeMotor, self).__init__(address, self.MAX_SPEED, world)
+
+
+class MediumMotor(Motor):
+    MAX_SPEED = 1560
+
+    def __init__(self, address, world=None):
+        super(MediumMotor, self).__init__(address, self.MAX_SPEED, world)
+
+
+class TouchSensor:
+    """The touch sensor at the right end of the turning range"""
+
+    def __init__(self, address, world=None):
+        self.world = world if world is not None else getWorld()
+        self.address = address
+        self.mode = "TOUCH"
+
+    def value(self):
+        with self.world.lock:
+            return int(self.world.armAngle() >= -self.world.TOUCH_TRAVEL)
+
+    @property
+    def is_pressed(self):
+        return bool(self.value())
+
+
+class UltrasonicSensor:
+    """The ultrasonic sensor measuring the distance to the wall in front, it gets closer as the arm moves forward"""
+
+    def __init__(self, address, world=None):
+        self.world = world if world is not None else getWorld()
+        self.address = address
+        self.mode = "US-DIST-CM"
+
+    @property
+    def distance_centimeters(self):
+        world = self.world
+        with world.lock:
+            distance = world.startDistance - world.armDistance() + world.random.gauss(0.0, world.ultrasonicNoise)
+        return round(max(distance, 0.0) / world.ULTRASONIC_RESOLUTION) * world.ULTRASONIC_RESOLUTION
+
+    def value(self):
+        return int(round(self.distance_centimeters * 10))
+
+
+class GyroSensor:
+    """The gyro turning with the arm, its angle drifts slowly. Setting the mode resets the angle to 0"""
+
+    def __init__(self, address, world=None):
+        self.world = world if world is not None else getWorld()
+        self.address = address
+        self.__mode = "GYRO-ANG"
+        self.__offset = self.__rawAngle()
+
+    def __rawAngle(self):
+        world = self.world
+        with world.lock:
+            return world.armAngle() + world.gyroDrift * (world.now() - world.startTime)
+
+    @property
+    def mode(self):
+        return self.__mode
+
+    @mode.setter
+    def mode(self, value):
+        self.__mode = value
+        self.__offset = self.__rawAngle()
+
+    @property
+    def angle(self):
+        return int(round(self.__rawAngle() - self.__offset))
+
+    @property
+    def rate(self):
+        motor = self.world.motors.get(TURNING_PORT)
+        speed = 0 if motor is None else motor.speed
+        return int(round(speed * self.world.degreesPerCount + self.world.gyroDrift))
+
+    def value(self):
+        return self.angle
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import deque
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Thread to read the frames of a video capture continuously into a small ring buffer.
+    Draining the capture all the time keeps OpenCV's internal buffer empty, so the newest
+    frame of the ring buffer is always the latest frame the camera produced.
+    """
+
+    # The number of frames kept in the ring buffer
+    BUFFER_SIZE = 4
+
+    def __init__(self, videoCap, bufferSize=BUFFER_SIZE):
+        super(FrameGrabber, self).__init__(daemon=True)
+        self.videoCap = videoCap
+        # Each item is a pair (frame, timestamp), the newest frame is at the right end.
+        # The timestamp comes from time.monotonic() right after the frame is read
+        self.frames = deque(maxlen=bufferSize)
+        self.framesGrabbed = 0
+        self.__condition = threading.Condition()
+        self.__running = False
+
+    def start(self):
+        """Start reading frames on the grabber thread"""
+        self.__running = True
+        super(FrameGrabber, self).start()
+
+    def run(self):
+        """Read frames until the grabber is stopped or the capture runs out of frames"""
+        while self.__running:
+            ret, frame = self.videoCap.read()
+            timestamp = time.monotonic()
+            if not ret:
+                # The end of a video file, or the camera is unplugged
+                break
+            with self.__condition:
+                self.frames.append((frame, timestamp))
+                self.framesGrabbed += 1
+                self.__condition.notify_all()
+
+        with self.__condition:
+            self.__running = False
+            # Wake up everyone still waiting for a frame
+            self.__condition.notify_all()
+
+    def isRunning(self):
+        """Method to check whether the grabber is still reading frames"""
+        return self.__running
+
+    def getLatestFrame(self, timeout=None):
+        """
+        Method to get the newest frame and its timestamp. This only waits (up to timeout seconds)
+        when no frame has been read yet. Return (None, None) if there is no frame.
+        """
+        with self.__condition:
+            if not self.frames and self.is_alive():
+                self.__condition.wait_for(lambda: self.frames or not self.__running, timeout)
+            if not self.frames:
+                return None, None
+            return self.frames[-1]
+
+    def waitForNewFrame(self, afterTimestamp, timeout=None):
+        """
+        Method to wait (up to timeout seconds) for a frame newer than afterTimestamp.
+        Return the pair (frame, timestamp), or (None, None) if no new frame comes.
+        """
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: (self.frames and self.frames[-1][1] > afterTimestamp) or not self.__running, timeout)
+            if not self.frames or self.frames[-1][1] <= afterTimestamp:
+                return None, None
+            return self.frames[-1]
+
+    def stop(self):
+        """Method to stop the grabber thread"""
+        self.__running = False
+        if self.is_alive():
+            self.join(timeout=1)
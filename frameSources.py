@@ -0,0 +1,75 @@
+import os
+
+import cv2
+import numpy as np
+
+
+class ImageSequenceCapture:
+    """
+    Capture that reads the images of a directory one by one, in the order of their file names.
+    It has the same read/isOpened/release methods as cv2.VideoCapture, so the processor can use it as a camera.
+    """
+
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.imagePaths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                                 if name.lower().endswith(self.IMAGE_EXTENSIONS))
+        self.__nextIndex = 0
+
+    def isOpened(self):
+        return self.__nextIndex < len(self.imagePaths)
+
+    def read(self):
+        """Method to read the next image, return (False, None) when there is no image left"""
+        while self.__nextIndex < len(self.imagePaths):
+            frame = cv2.imread(self.imagePaths[self.__nextIndex])
+            self.__nextIndex += 1
+            if frame is not None:
+                return True, frame
+            print("Cannot read the image: ", self.imagePaths[self.__nextIndex - 1])
+        return False, None
+
+    def release(self):
+        self.__nextIndex = len(self.imagePaths)
+
+
+class ArrayCapture:
+    """
+    Capture that reads the frames from a NumPy array of frames or any iterable of frames (a list, a generator...).
+    It has the same read/isOpened/release methods as cv2.VideoCapture, so the processor can use it as a camera.
+    """
+
+    def __init__(self, frames):
+        self.__frames = iter(frames)
+        self.__opened = True
+
+    def isOpened(self):
+        return self.__opened
+
+    def read(self):
+        """Method to read the next frame, return (False, None) when there is no frame left"""
+        if self.__opened:
+            frame = next(self.__frames, None)
+            if frame is not None:
+                return True, np.ascontiguousarray(frame)
+            self.__opened = False
+        return False, None
+
+    def release(self):
+        self.__opened = False
+
+
+def openFrameSource(inputSource):
+    """
+    Open a capture for inputSource, which can be a camera index, a video file, a directory of images,
+    a NumPy array of frames, an iterable of frames, or an object that already has a read method.
+    """
+    if hasattr(inputSource, "read"):
+        return inputSource
+    if isinstance(inputSource, str) and os.path.isdir(inputSource):
+        return ImageSequenceCapture(inputSource)
+    if isinstance(inputSource, (int, str)):
+        return cv2.VideoCapture(inputSource)
+    return ArrayCapture(inputSource)
@@ -0,0 +1,96 @@
+"""
+Length-prefixed JSON messages between the host and the robot.
+Every message is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON, so a reader always
+knows where a message ends and a partial read can never be mistaken for a whole command.
+A message is at most MAX_MESSAGE_SIZE bytes, so the first byte of a framed connection is always 0,
+which no text command of the old protocol starts with: the server tells the 2 protocols apart with it.
+Only the standard library is used, this runs on the robot.
+"""
+import asyncio
+import json
+import struct
+
+# The length in front of every message
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 1 << 24
+
+
+class FramingError(Exception):
+    """Raised for a message that is too large, or a connection closed in the middle of a message"""
+    pass
+
+
+def encodeMessage(message):
+    """Encode a message (a dict that can be dumped as JSON) with its length"""
+    payload = json.dumps(message).encode("utf-8")
+    if len(payload) > MAX_MESSAGE_SIZE:
+        raise FramingError("Message of {} bytes is too large".format(len(payload)))
+    return HEADER.pack(len(payload)) + payload
+
+
+def decodePayload(payload):
+    """Decode the JSON payload of a message"""
+    return json.loads(payload.decode("utf-8"))
+
+
+def _checkLength(header):
+    length = HEADER.unpack(header)[0]
+    if length > MAX_MESSAGE_SIZE:
+        raise FramingError("Message of {} bytes is too large".format(length))
+    return length
+
+
+def sendMessage(sock, message):
+    """Send a message on a blocking socket"""
+    sock.sendall(encodeMessage(message))
+
+
+def _receiveExactly(sock, size):
+    """Receive exactly size bytes, or b"" if the connection was closed before the first byte"""
+    chunks = []
+    received = 0
+    while received < size:
+        chunk = sock.recv(size - received)
+        if not chunk:
+            if received == 0:
+                return b""
+            raise FramingError("Connection closed in the middle of a message")
+        chunks.append(chunk)
+        received += len(chunk)
+    return b"".join(chunks)
+
+
+def receiveMessage(sock):
+    """Receive a message from a blocking socket, return None if the connection was closed between 2 messages"""
+    header = _receiveExactly(sock, HEADER.size)
+    if not header:
+        return None
+    length = _checkLength(header)
+    payload = _receiveExactly(sock, length)
+    if len(payload) < length:
+        raise FramingError("Connection closed in the middle of a message")
+    return decodePayload(payload)
+
+
+async def readMessage(reader, prefix=b""):
+    """
+    Read a message from an asyncio StreamReader, return None if the connection was closed between 2 messages.
+    prefix is the start of the message already read from the stream, if any.
+    """
+    try:
+        header = prefix + await reader.readexactly(HEADER.size - len(prefix))
+    except asyncio.IncompleteReadError as error:
+        if not error.partial and not prefix:
+            return None
+        raise FramingError("Connection closed in the middle of a message")
+    length = _checkLength(header)
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FramingError("Connection closed in the middle of a message")
+    return decodePayload(payload)
+
+
+def writeMessage(writer, message):
+    """Write a message to an asyncio StreamWriter, await writer.drain() after it"""
+    writer.write(encodeMessage(message))
@@ -0,0 +1,256 @@
+"""
+The game loop of the chess robot as a pipeline of stages connected by queues, every stage on its own thread:
+- camera capture: the FrameGrabber of the ChessBoardProcessor reads the camera all the time
+- move detection: streamMoves watches the frames and detects every move, of the player and of the robot
+- move decision: chooses the move of the robot once the move of the player is detected,
+  and checks that the move detected after the robot played is the one it was sent
+- robot execution: sends the operations of the move to the arm and follows the progress of its steps
+
+The stages overlap instead of waiting for each other: the camera is read while a move is detected, and the move
+of the robot is confirmed by the camera as soon as the arm has turned off the board after its last piece
+(the retract step), while the arm finishes the motion (homing every few moves) in parallel. Only a half done move
+of the arm is not looked at: the detection is paused from the moment a move is sent to the arm until it is retracted.
+
+The latency of every stage is kept in the metrics of instrumentation and in the report of every turn (turns):
+    gameDetection       the frame showing a still board captured, to the move detected on it
+    gameDecision        the move of the player detected, to the move of the robot decided
+    gameRobotStart      the move of the robot decided, to the first step of the arm (waiting in the queues)
+    gameRobotPlacement  the first step of the arm, to its last piece dropped
+    gameRobotExecution  the first step of the arm, to the end of the motion with the homing
+    gameConfirmation    the arm retracted off the board, to the move of the robot detected by the camera
+    gameTurnaround      the move of the player detected, to the move of the robot confirmed
+"""
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from armController import ArmController
+from boardState import BoardState
+from instrumentation import metrics
+from motionGate import MotionGate
+from moveGenerator import generateLegalMoves, robotOperationsOfMove
+
+# A move seen on the board: the side that played it, its description, a copy of the board state after it,
+# the time the frame it was detected on was captured and the time it was detected (from time.monotonic())
+DetectedMove = namedtuple("DetectedMove", ["side", "description", "board", "frameTimestamp", "detectedAt"])
+# A move for the robot: the move, its operations for the arm, the board state after it and the report of its turn
+RobotJob = namedtuple("RobotJob", ["move", "operations", "expectedBoard", "turn"])
+
+
+class LocalRobotArm:
+    """
+    The arm of the execution stage without the server: the operations run on an ArmController in this process,
+    like with the simulated devices of ev3sim. It has the sendBatch of the clients of the server.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+
+    def sendBatch(self, operations, onProgress=None, timeout=None):
+        """Method to run a list of operations, see ArmController.execute"""
+        return self.controller.execute(operations, onProgress)
+
+
+class GameOrchestrator:
+    """
+    The pipeline of a game between a player and the robot, see the module docstring.
+    The player makes the first move unless robotSide is white, the moves alternate after that.
+    """
+
+    # The longest the stages are waited for once the game ended, a decision can be waiting on a player
+    JOIN_TIMEOUT = 5.0
+
+    def __init__(self, boardProcessor, robotArm, decideMove, robotSide=BoardState.BLACK,
+                 stableFrames=MotionGate.STABLE_FRAMES, motionThreshold=MotionGate.MOTION_THRESHOLD):
+        """
+        boardProcessor is a calibrated ChessBoardProcessor with the reference board set on the current position.
+        robotArm sends the operations of a move to the arm: a BlockingRobotArmClient, or a LocalRobotArm.
+        decideMove(board, legalMoves) returns the move of the robot, one of legalMoves, or None to end the game.
+        It gets a copy of the board state, with the robot to move.
+        """
+        self.boardProcessor = boardProcessor
+        self.robotArm = robotArm
+        self.decideMove = decideMove
+        self.robotSide = robotSide
+        self.stableFrames = stableFrames
+        self.motionThreshold = motionThreshold
+        # The report of every turn of the robot, see the module docstring
+        self.turns = []
+        # Why the game ended, None while it runs
+        self.endReason = None
+        self.decisionQueue = queue.Queue()
+        self.robotQueue = queue.Queue()
+        self.stopEvent = threading.Event()
+        # Set while the arm is changing the board, the detection is paused
+        self.robotMoving = threading.Event()
+        # The robot job waiting for the camera to confirm its move
+        self.__pendingJob = None
+        self.__threads = []
+
+    # ---------------------------------------------------------------------------
+    # Control
+
+    def start(self):
+        """Method to start the stages, each on its own thread"""
+        for name, stage in (("detection", self.runDetection), ("decision", self.runDecision),
+                            ("execution", self.runExecution)):
+            thread = threading.Thread(target=stage, name="game:" + name, daemon=True)
+            self.__threads.append(thread)
+            thread.start()
+        if self.robotSide == BoardState.WHITE:
+            # The robot makes the first move, on the position the processor is set up on
+            self.decisionQueue.put(DetectedMove(1 - self.robotSide, None, self.boardProcessor.boardState.copy(),
+                                                None, time.monotonic()))
+
+    def run(self):
+        """Method to play the game until it ends, return the reports of the turns"""
+        self.start()
+        try:
+            while not self.stopEvent.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            self.stop("interrupted")
+        self.join(self.JOIN_TIMEOUT)
+        return self.turns
+
+    def stop(self, reason="stopped"):
+        """Method to end the game, the stages finish what they are doing and stop"""
+        if self.endReason is None:
+            self.endReason = reason
+            print("=====> GAME OVER: ", reason)
+        self.stopEvent.set()
+        # Wake up the stages waiting on their queue
+        self.decisionQueue.put(None)
+        self.robotQueue.put(None)
+
+    def join(self, timeout=None):
+        """Method to wait until the stages have stopped"""
+        for thread in self.__threads:
+            thread.join(timeout)
+
+    # ---------------------------------------------------------------------------
+    # Stages
+
+    def runDetection(self):
+        """The move detection stage: every move seen on the board goes to the decision stage"""
+        processor = self.boardProcessor
+
+        def keepWatching(frame):
+            return not self.stopEvent.is_set()
+        try:
+            for description in processor.streamMoves(self.stableFrames, self.motionThreshold,
+                                                     frameCallback=keepWatching, isPaused=self.robotMoving.is_set):
+                detectedAt = time.monotonic()
+                metrics.observe("gameDetection", detectedAt - processor.lastCaptureTimestamp)
+                side = processor.currentPlayingSide
+                print("=====> DETECTED: ", description)
+                self.decisionQueue.put(DetectedMove(side, description, processor.boardState.copy(),
+                                                    processor.lastCaptureTimestamp, detectedAt))
+                processor.changeCurrentPlayingSide()
+        except Exception as error:
+            print("=====> The move detection failed: ", repr(error))
+        self.stop("the camera stopped")
+
+    def runDecision(self):
+        """The move decision stage: decide the move of the robot after every move of the player"""
+        while not self.stopEvent.is_set():
+            detectedMove = self.decisionQueue.get()
+            if detectedMove is None:
+                break
+            if detectedMove.side == self.robotSide:
+                self.confirmRobotMove(detectedMove)
+                continue
+
+            board = detectedMove.board
+            board.sideToMove = self.robotSide
+            legalMoves = generateLegalMoves(board)
+            if not legalMoves:
+                self.stop("no legal move left for the robot")
+                break
+            move = self.decideMove(board.copy(), legalMoves)
+            if move is None:
+                self.stop("no move decided")
+                break
+            decidedAt = time.monotonic()
+            operations = robotOperationsOfMove(board, move)
+            board.applyMove(move)
+            turn = {"playerMove": detectedMove.description,
+                    "robotMove": BoardState.squareCode(move.fromSquare) + "-" + BoardState.squareCode(move.toSquare),
+                    "operations": len(operations), "playerDetectedAt": detectedMove.detectedAt,
+                    "decisionSeconds": decidedAt - detectedMove.detectedAt}
+            self.turns.append(turn)
+            metrics.observe("gameDecision", turn["decisionSeconds"])
+
+            # The detection must not see the board before the arm is done with it
+            self.robotMoving.set()
+            self.__pendingJob = RobotJob(move, operations, board, turn)
+            self.robotQueue.put((self.__pendingJob, decidedAt))
+
+    def confirmRobotMove(self, detectedMove):
+        """Method to check the move detected after the robot played against the move it was sent"""
+        job = self.__pendingJob
+        self.__pendingJob = None
+        if job is None:
+            print("=====> A move of the robot side was detected, but the robot did not play: ",
+                  detectedMove.description)
+            return
+        turn = job.turn
+        turn["confirmed"] = bool((detectedMove.board.squares == job.expectedBoard.squares).all())
+        if not turn["confirmed"]:
+            print("=====> The board does not show the move of the robot ", turn["robotMove"], ", detected ",
+                  detectedMove.description)
+        retractedAt = turn.get("retractedAt")
+        if retractedAt is not None:
+            turn["confirmationSeconds"] = detectedMove.detectedAt - retractedAt
+            metrics.observe("gameConfirmation", turn["confirmationSeconds"])
+        turn["turnaroundSeconds"] = detectedMove.detectedAt - turn["playerDetectedAt"]
+        metrics.observe("gameTurnaround", turn["turnaroundSeconds"])
+        print("=====> TURN OF THE ROBOT TOOK {:.2f} s".format(turn["turnaroundSeconds"]))
+
+    def runExecution(self):
+        """The robot execution stage: send the operations of every move to the arm"""
+        while not self.stopEvent.is_set():
+            item = self.robotQueue.get()
+            if item is None:
+                break
+            job, decidedAt = item
+            turn = job.turn
+            lastDropStep = str(len(job.operations)) + ":" + job.operations[-1]["op"] + ".dropDown"
+
+            def onProgress(message, turn=turn, lastDropStep=lastDropStep):
+                now = time.monotonic()
+                if message.get("event") == "started" and "startedAt" not in turn:
+                    turn["startedAt"] = now
+                    turn["robotStartSeconds"] = now - decidedAt
+                    metrics.observe("gameRobotStart", turn["robotStartSeconds"])
+                elif message.get("event") == "done" and message.get("step") == lastDropStep:
+                    turn["placedAt"] = now
+                    turn["placementSeconds"] = now - turn.get("startedAt", decidedAt)
+                    metrics.observe("gameRobotPlacement", turn["placementSeconds"])
+                elif message.get("event") == "done" and message.get("step") == ArmController.RETRACT_STEP:
+                    # The arm is off the board: the camera can confirm the move while the arm finishes
+                    turn["retractedAt"] = now
+                    self.robotMoving.clear()
+
+            try:
+                result = self.robotArm.sendBatch(job.operations, onProgress=onProgress)
+            except (ConnectionError, OSError, asyncio.TimeoutError, concurrent.futures.TimeoutError) as error:
+                # The timeouts of the clients are only a TimeoutError (an OSError) from Python 3.11
+                result = {"status": "error", "error": repr(error)}
+            turn["robotStatus"] = result["status"]
+            if result["status"] != "done":
+                self.robotMoving.clear()
+                print("=====> The robot did not finish the move: ", result["status"])
+                self.stop("the robot failed: " + result["status"])
+                break
+            turn["executionSeconds"] = time.monotonic() - turn.get("startedAt", decidedAt)
+            turn["robotSeconds"] = result.get("seconds", 0.0)
+            turn["homingSeconds"] = result.get("homingSeconds", 0.0)
+            metrics.observe("gameRobotExecution", turn["executionSeconds"])
+            if "retractedAt" not in turn:
+                # The progress of the steps did not come, the board is only looked at again now.
+                # Otherwise the detection may already be paused for the next move, it is left alone
+                self.robotMoving.clear()
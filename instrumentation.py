@@ -0,0 +1,151 @@
+"""
+Timing of the stages of the vision and robot paths.
+Wrap a stage with the timed decorator or the timer context manager, the durations are kept in memory
+as histograms and can be exported on demand as JSON or as Prometheus text.
+The durations come from the clock of robotClock, the time of the simulation on a simulated robot.
+Only the standard library is used, so this also runs on the robot.
+
+    @timed("detectMove")
+    def detectMove(self): ...
+
+    with timer("findChessboardCorners"):
+        ...
+
+    print(metrics.toPrometheus())
+"""
+import bisect
+import functools
+import json
+import math
+import threading
+from contextlib import contextmanager
+
+import robotClock
+
+# The upper bounds in seconds of the buckets of the histograms, from a camera frame to a whole robot move
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Histogram of the durations of one stage, with the count, sum, smallest and largest duration"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The number of durations in every bucket, the last one is for the durations above all the buckets
+        self.bucketCounts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """Method to add one duration to the histogram"""
+        self.bucketCounts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def cumulativeCounts(self):
+        """Method to get the number of durations at or below every bucket bound, then the total count"""
+        counts = []
+        total = 0
+        for bucketCount in self.bucketCounts:
+            total += bucketCount
+            counts.append(total)
+        return counts
+
+    def toDict(self):
+        """Method to get the histogram as a dict of plain values"""
+        return {"count": self.count, "sum": self.sum,
+                "mean": self.sum / self.count if self.count else None,
+                "min": self.min if self.count else None, "max": self.max if self.count else None,
+                "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.cumulativeCounts()))}
+
+
+class MetricsRegistry:
+    """The histograms of all the timed stages, by stage name. Stages can be timed from several threads."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Set this to False to turn the timing off, the timed stages then only cost a check of this flag
+        self.enabled = True
+        self.__histograms = {}
+        self.__lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        """Method to add a duration in seconds to the histogram of the stage name"""
+        with self.__lock:
+            histogram = self.__histograms.get(name)
+            if histogram is None:
+                histogram = self.__histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager to time the code inside it as the stage name, even if it raises"""
+        if not self.enabled:
+            yield
+            return
+        start = robotClock.perfCounter()
+        try:
+            yield
+        finally:
+            self.observe(name, robotClock.perfCounter() - start)
+
+    def timed(self, name=None):
+        """Decorator to time every call of a function or method as the stage name (the function name by default)"""
+        def decorator(function):
+            stageName = name if name is not None else function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = robotClock.perfCounter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(stageName, robotClock.perfCounter() - start)
+            return wrapper
+        return decorator
+
+    def getHistogram(self, name):
+        """Method to get the histogram of a stage, None if it was never timed"""
+        return self.__histograms.get(name)
+
+    def reset(self):
+        """Method to forget all the durations"""
+        with self.__lock:
+            self.__histograms = {}
+
+    def toDict(self):
+        """Method to get all the histograms as a dict from stage name to the dict of its histogram"""
+        with self.__lock:
+            return {name: histogram.toDict() for name, histogram in sorted(self.__histograms.items())}
+
+    def toJson(self, indent=2):
+        """Method to export all the histograms as JSON"""
+        return json.dumps(self.toDict(), indent=indent)
+
+    def toPrometheus(self, metricName="chess_stage_duration_seconds"):
+        """Method to export all the histograms in the Prometheus text format, one series per stage"""
+        lines = ["# HELP " + metricName + " Duration of the stages of the vision and robot paths.",
+                 "# TYPE " + metricName + " histogram"]
+        with self.__lock:
+            for name, histogram in sorted(self.__histograms.items()):
+                stage = 'stage="' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+                bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulativeCounts()):
+                    lines.append(metricName + "_bucket{" + stage + ',le="' + bound + '"} ' + str(count))
+                lines.append(metricName + "_sum{" + stage + "} " + repr(histogram.sum))
+                lines.append(metricName + "_count{" + stage + "} " + str(histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+# The registry used by the whole program
+metrics = MetricsRegistry()
+timer = metrics.timer
+timed = metrics.timed
@@ -0,0 +1,81 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Cheap activity detector for the area over the chessboard.
+    Every frame is shrunk to a small gray thumbnail of the board region and compared to the previous one.
+    The gate opens once there was motion over the board and the board then stayed still for
+    stableFrames frames in a row, which is the moment a full move detection is worth running.
+    """
+
+    # The size of the thumbnail the motion is measured on
+    THUMBNAIL_SIZE = (32, 32)
+    # The mean absolute gray difference (0 to 255) between 2 thumbnails to count as motion
+    MOTION_THRESHOLD = 4.0
+    # The number of still frames in a row after a motion before the board is considered stable
+    STABLE_FRAMES = 5
+
+    def __init__(self, boardCorners, motionThreshold=MOTION_THRESHOLD, stableFrames=STABLE_FRAMES):
+        self.motionThreshold = motionThreshold
+        self.stableFrames = stableFrames
+
+        # The motion value of the last frame
+        self.lastMotion = 0.0
+        self.__previousThumbnail = None
+        self.__stableCount = 0
+        self.__sawMotion = False
+        self.setRegion(boardCorners)
+
+    def setRegion(self, boardCorners):
+        """Method to set the region of the frame watched by the gate to the area covered by boardCorners"""
+        corners = np.asarray(boardCorners, dtype=np.float32).reshape((-1, 2))
+        xMin, yMin = np.floor(corners.min(axis=0)).astype(int)
+        xMax, yMax = np.ceil(corners.max(axis=0)).astype(int)
+        self.region = (max(xMin, 0), max(yMin, 0), xMax + 1, yMax + 1)
+        # A thumbnail of the old region cannot be compared to a thumbnail of the new one
+        self.__previousThumbnail = None
+
+    def isStill(self):
+        """Method to check whether there was no motion on the last frame"""
+        return self.lastMotion <= self.motionThreshold
+
+    def markMotion(self):
+        """Method to count the last frame as motion, the gate then opens after stableFrames still frames again"""
+        self.__sawMotion = True
+        self.__stableCount = 0
+
+    def makeThumbnail(self, frame):
+        """Method to shrink the board region of a frame to a gray thumbnail"""
+        xMin, yMin, xMax, yMax = self.region
+        board = frame[yMin:yMax, xMin:xMax]
+        if board.ndim == 3:
+            board = cv2.cvtColor(board, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(board, self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+
+    def update(self, frame):
+        """
+        Method to feed the next frame to the gate.
+        Return True when the board has just become stable after a motion.
+        """
+        thumbnail = self.makeThumbnail(frame)
+        if self.__previousThumbnail is None:
+            self.__previousThumbnail = thumbnail
+            self.lastMotion = 0.0
+            return False
+
+        self.lastMotion = cv2.absdiff(thumbnail, self.__previousThumbnail).mean()
+        self.__previousThumbnail = thumbnail
+
+        if self.lastMotion > self.motionThreshold:
+            # Something is moving over the board, wait for it to finish
+            self.__sawMotion = True
+            self.__stableCount = 0
+            return False
+
+        self.__stableCount += 1
+        if self.__sawMotion and self.__stableCount >= self.stableFrames:
+            self.__sawMotion = False
+            return True
+        return False
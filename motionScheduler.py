@@ -0,0 +1,117 @@
+import threading
+from collections import namedtuple
+
+import robotClock
+
+# A step of a motion: name, the function doing it, the names of the steps it waits for and the axis it moves
+MotionStep = namedtuple("MotionStep", ["name", "action", "dependsOn", "axis"])
+
+
+class MotionScheduler:
+    """
+    Scheduler running the steps of a motion of the robot as soon as the steps they depend on are done,
+    each step on its own thread, so moves on independent axes (turning and surface) run at the same time.
+    Steps on the same axis always run one after the other, in the order they were added.
+    The wall-clock time of the whole motion and of every step is reported at the end.
+    """
+
+    def __init__(self, name="motion", onFailure=None, listener=None):
+        """
+        onFailure is called once if a step raises, to stop the steps still running (like RobotArm.emergencyStop).
+        listener is called from the thread of each step when it starts and ends, with a dict:
+        "step" (the name), "event" ("started", "done" or "failed"), "elapsed" (the time from the start of the motion)
+        and "seconds" (the time the step took, at its end).
+        """
+        self.name = name
+        self.onFailure = onFailure
+        self.listener = listener
+        self.steps = []
+        self.__stepNames = set()
+        # The last step added on every axis
+        self.__lastStepOfAxis = {}
+
+    def addStep(self, name, action, dependsOn=(), axis=None):
+        """
+        Method to add a step running action(). It starts once all the steps of dependsOn are done,
+        and after the last step added on the same axis. A step can only depend on steps added before it.
+        """
+        if name in self.__stepNames:
+            raise ValueError("There is already a step named " + name)
+        dependsOn = list(dependsOn)
+        for dependency in dependsOn:
+            if dependency not in self.__stepNames:
+                raise ValueError("The step " + name + " depends on the unknown step " + dependency)
+        if axis is not None:
+            previousStep = self.__lastStepOfAxis.get(axis)
+            if previousStep is not None and previousStep not in dependsOn:
+                dependsOn.append(previousStep)
+            self.__lastStepOfAxis[axis] = name
+        self.steps.append(MotionStep(name, action, tuple(dependsOn), axis))
+        self.__stepNames.add(name)
+        return name
+
+    def run(self):
+        """
+        Method to run all the steps. If a step raises, no new step is started, onFailure is called,
+        the steps still running are waited for and the error is raised again.
+        Return a report dict with the total "seconds", the "serialSeconds" the steps would take one after
+        the other, and the "start", "end" and "seconds" of every step (times from the start of the motion).
+        """
+        condition = threading.Condition()
+        pending = list(self.steps)
+        running = set()
+        done = set()
+        stepTimes = {}
+        failures = []
+        start = robotClock.monotonic()
+
+        def runStep(step):
+            stepStart = robotClock.monotonic() - start
+            event = "failed"
+            try:
+                if self.listener is not None:
+                    self.listener({"step": step.name, "event": "started", "elapsed": stepStart})
+                step.action()
+                event = "done"
+            except BaseException as error:
+                with condition:
+                    failures.append(error)
+                    firstFailure = len(failures) == 1
+                if firstFailure and self.onFailure is not None:
+                    self.onFailure()
+            finally:
+                stepEnd = robotClock.monotonic() - start
+                if self.listener is not None:
+                    self.listener({"step": step.name, "event": event, "elapsed": stepEnd,
+                                   "seconds": stepEnd - stepStart})
+                with condition:
+                    stepTimes[step.name] = {"start": stepStart, "end": stepEnd, "seconds": stepEnd - stepStart}
+                    running.discard(step.name)
+                    done.add(step.name)
+                    condition.notify_all()
+
+        threads = []
+        with condition:
+            while pending or running:
+                if not failures:
+                    for step in [step for step in pending if all(name in done for name in step.dependsOn)]:
+                        pending.remove(step)
+                        running.add(step.name)
+                        thread = threading.Thread(target=runStep, args=(step,), name=self.name + ":" + step.name,
+                                                  daemon=True)
+                        threads.append(thread)
+                        thread.start()
+                if not running:
+                    # Either a step failed, or every step is done
+                    break
+                condition.wait()
+
+        for thread in threads:
+            thread.join()
+        if failures:
+            raise failures[0]
+
+        totalSeconds = robotClock.monotonic() - start
+        return {"seconds": totalSeconds,
+                "serialSeconds": sum(times["seconds"] for times in stepTimes.values()),
+                "steps": stepTimes}
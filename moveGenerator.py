@@ -0,0 +1,207 @@
+from boardState import BoardState, Move
+
+# ============ Tables of the squares reachable from every square, computed once
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+KING_STEPS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+ROOK_DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+PROMOTION_TYPES = (BoardState.QUEEN, BoardState.ROOK, BoardState.BISHOP, BoardState.KNIGHT)
+
+
+def _stepTargets(steps):
+    """For every square, the list of squares one of the steps (colDelta, rowDelta) away"""
+    targets = []
+    for index in range(64):
+        col, row = index % 8, index // 8
+        targets.append([(row + rowDelta) * 8 + col + colDelta for colDelta, rowDelta in steps
+                        if 0 <= col + colDelta < 8 and 0 <= row + rowDelta < 8])
+    return targets
+
+
+def _rays(directions):
+    """For every square, the list of rays (lists of squares going away from it) in the directions"""
+    rays = []
+    for index in range(64):
+        col, row = index % 8, index // 8
+        squareRays = []
+        for colDelta, rowDelta in directions:
+            ray = []
+            rayCol, rayRow = col + colDelta, row + rowDelta
+            while 0 <= rayCol < 8 and 0 <= rayRow < 8:
+                ray.append(rayRow * 8 + rayCol)
+                rayCol, rayRow = rayCol + colDelta, rayRow + rowDelta
+            squareRays.append(ray)
+        rays.append(squareRays)
+    return rays
+
+
+KNIGHT_TARGETS = _stepTargets(KNIGHT_STEPS)
+KING_TARGETS = _stepTargets(KING_STEPS)
+ROOK_RAYS = _rays(ROOK_DIRECTIONS)
+BISHOP_RAYS = _rays(BISHOP_DIRECTIONS)
+# The squares a pawn of each side attacks from every square
+PAWN_ATTACKS = [_stepTargets([(-1, 1), (1, 1)]), _stepTargets([(-1, -1), (1, -1)])]
+
+
+def isSquareAttacked(squares, index, bySide):
+    """
+    Check whether the square index is attacked by a piece of bySide.
+    squares is the list of signed piece codes of a BoardState (board.squares.tolist()).
+    """
+    sign = 1 if bySide == BoardState.WHITE else -1
+    # A pawn of bySide attacks index if a pawn of the other side on index would attack that pawn
+    for target in PAWN_ATTACKS[1 - bySide][index]:
+        if squares[target] == sign * BoardState.PAWN:
+            return True
+    for target in KNIGHT_TARGETS[index]:
+        if squares[target] == sign * BoardState.KNIGHT:
+            return True
+    for target in KING_TARGETS[index]:
+        if squares[target] == sign * BoardState.KING:
+            return True
+    for rays, slider in ((ROOK_RAYS, BoardState.ROOK), (BISHOP_RAYS, BoardState.BISHOP)):
+        for ray in rays[index]:
+            for target in ray:
+                code = squares[target]
+                if code != 0:
+                    if code == sign * slider or code == sign * BoardState.QUEEN:
+                        return True
+                    break
+    return False
+
+
+def isInCheck(board, side):
+    """Check whether the king of side is attacked"""
+    kingSquare = board.kingSquare(side)
+    return kingSquare is not None and isSquareAttacked(board.squares.tolist(), kingSquare, 1 - side)
+
+
+def generatePseudoLegalMoves(board):
+    """Generate the moves of the side to move, without checking whether they leave its own king in check"""
+    side = board.sideToMove
+    sign = 1 if side == BoardState.WHITE else -1
+    squares = board.squares.tolist()
+    moves = []
+    for index in range(64):
+        code = squares[index] * sign
+        if code <= 0:
+            continue
+
+        if code == BoardState.PAWN:
+            forward = 8 * sign
+            lastRow = 7 if side == BoardState.WHITE else 0
+            startRow = 1 if side == BoardState.WHITE else 6
+            targets = []
+            oneStep = index + forward
+            # A pawn cannot be on the last row, but a board read from the camera may still have one there
+            if 0 <= oneStep < 64 and squares[oneStep] == 0:
+                targets.append(oneStep)
+                if index // 8 == startRow and squares[oneStep + forward] == 0:
+                    targets.append(oneStep + forward)
+            for target in PAWN_ATTACKS[side][index]:
+                if squares[target] * sign < 0 or target == board.enPassantSquare:
+                    targets.append(target)
+            for target in targets:
+                if target // 8 == lastRow:
+                    moves.extend(Move(index, target, promotion) for promotion in PROMOTION_TYPES)
+                else:
+                    moves.append(Move(index, target))
+
+        elif code == BoardState.KNIGHT or code == BoardState.KING:
+            table = KNIGHT_TARGETS if code == BoardState.KNIGHT else KING_TARGETS
+            moves.extend(Move(index, target) for target in table[index] if squares[target] * sign <= 0)
+
+        else:
+            rayTables = []
+            if code != BoardState.BISHOP:
+                rayTables.append(ROOK_RAYS)
+            if code != BoardState.ROOK:
+                rayTables.append(BISHOP_RAYS)
+            for rays in rayTables:
+                for ray in rays[index]:
+                    for target in ray:
+                        if squares[target] * sign > 0:
+                            break
+                        moves.append(Move(index, target))
+                        if squares[target] != 0:
+                            break
+
+    moves.extend(_castlingMoves(board, squares, side))
+    return moves
+
+
+def _castlingMoves(board, squares, side):
+    """Generate the castling moves of side, the king cannot castle out of, through or into check"""
+    if side == BoardState.WHITE:
+        kingSquare, rights = 4, (BoardState.WHITE_KINGSIDE, BoardState.WHITE_QUEENSIDE)
+    else:
+        kingSquare, rights = 60, (BoardState.BLACK_KINGSIDE, BoardState.BLACK_QUEENSIDE)
+    moves = []
+    if not board.castlingRights & (rights[0] | rights[1]):
+        return moves
+    if isSquareAttacked(squares, kingSquare, 1 - side):
+        return moves
+    # (right, squares that must be empty, squares the king passes), the king lands on the last passed square
+    for right, emptySquares, passedSquares in (
+            (rights[0], (kingSquare + 1, kingSquare + 2), (kingSquare + 1, kingSquare + 2)),
+            (rights[1], (kingSquare - 1, kingSquare - 2, kingSquare - 3), (kingSquare - 1, kingSquare - 2))):
+        if board.castlingRights & right and all(squares[square] == 0 for square in emptySquares) \
+                and not any(isSquareAttacked(squares, square, 1 - side) for square in passedSquares):
+            moves.append(Move(kingSquare, passedSquares[-1]))
+    return moves
+
+
+def generateLegalMoves(board):
+    """Generate all the legal moves of the side to move"""
+    side = board.sideToMove
+    legalMoves = []
+    for move in generatePseudoLegalMoves(board):
+        board.applyMove(move)
+        if not isInCheck(board, side):
+            legalMoves.append(move)
+        board.undoMove()
+    return legalMoves
+
+
+def changedSquaresOfMove(board, move):
+    """
+    Get the indices of all the squares whose content changes with a legal move of board:
+    the 2 squares of the move, plus the captured pawn of an en passant or the 2 squares of the castling rook.
+    """
+    fromSquare, toSquare, _ = move
+    pieceType = abs(int(board.squares[fromSquare]))
+    if pieceType == BoardState.KING and abs(toSquare - fromSquare) == 2:
+        if toSquare > fromSquare:
+            return (fromSquare, toSquare, fromSquare + 3, fromSquare + 1)
+        return (fromSquare, toSquare, fromSquare - 4, fromSquare - 1)
+    if pieceType == BoardState.PAWN and toSquare == board.enPassantSquare and board.squares[toSquare] == 0:
+        capturedSquare = toSquare - 8 if toSquare > fromSquare else toSquare + 8
+        return (fromSquare, toSquare, capturedSquare)
+    return (fromSquare, toSquare)
+
+
+def robotOperationsOfMove(board, move):
+    """
+    Get the operations of the robot arm (see the batch command of socketTrial) that play a legal move of board:
+    the captured piece goes to the graveyard first, a castling also moves the rook,
+    and a promoted pawn goes to the graveyard and is replaced by a piece of the reserve.
+    """
+    fromSquare, toSquare, promotion = move
+    changedSquares = changedSquaresOfMove(board, move)
+    squareCode = BoardState.squareCode
+    operations = []
+    if len(changedSquares) == 3:
+        # En passant, the captured pawn is not on the target square
+        operations.append({"op": "remove", "from": squareCode(changedSquares[2])})
+    elif board.squares[toSquare] != 0:
+        operations.append({"op": "remove", "from": squareCode(toSquare)})
+
+    if promotion:
+        operations.append({"op": "remove", "from": squareCode(fromSquare)})
+        operations.append({"op": "place", "piece": BoardState.PIECE_LETTERS[promotion], "to": squareCode(toSquare)})
+    else:
+        operations.append({"op": "move", "from": squareCode(fromSquare), "to": squareCode(toSquare)})
+    if len(changedSquares) == 4:
+        # Castling, then the rook
+        operations.append({"op": "move", "from": squareCode(changedSquares[2]), "to": squareCode(changedSquares[3])})
+    return operations
@@ -0,0 +1,67 @@
+import numpy as np
+
+from moveGenerator import changedSquaresOfMove, generateLegalMoves
+
+
+def squareEvidence(squareScores, threshold):
+    """
+    Turn the change scores of the 64 squares into evidence between -1 and 1: a square far above the threshold
+    is surely changed (1), a square far below it surely did not change (-1). Clipping keeps one very noisy
+    square from outweighing all the others.
+    """
+    return np.clip((np.asarray(squareScores, dtype=np.float64) - threshold) / abs(threshold), -1, 1)
+
+
+def scoreMoves(board, squareScores, threshold):
+    """
+    Score every legal move of the side to move of board against the change scores of the squares.
+    A move scores the sum of the evidence of all the squares it changes (see changedSquaresOfMove),
+    so a castling needs its 4 squares to change and an en passant its 3 squares.
+    Return a list of (matchScore, move), the best match first. Equal scores keep the order of the
+    generator, so the promotion to a queen comes before the other promotions.
+    """
+    evidence = squareEvidence(squareScores, threshold).tolist()
+    scoredMoves = [(sum(evidence[square] for square in changedSquaresOfMove(board, move)), move)
+                   for move in generateLegalMoves(board)]
+    scoredMoves.sort(key=lambda scoredMove: scoredMove[0], reverse=True)
+    return scoredMoves
+
+
+def inferMove(board, squareScores, threshold):
+    """
+    Find the legal move of the side to move of board that best explains the change scores of the squares.
+    Return None if no move is explained better than by nothing changing at all.
+    """
+    scoredMoves = scoreMoves(board, squareScores, threshold)
+    if not scoredMoves or scoredMoves[0][0] <= 0:
+        return None
+    return scoredMoves[0][1]
+
+
+def findMovesToOccupancy(board, occupancy, maxPlies=2):
+    """
+    Find the shortest list of legal moves from board (at most maxPlies moves, both sides playing in turn)
+    after which the occupancy of the board (the signs of board.squares) is the given one.
+    This recovers the moves missed by the camera from a single reading of the occupancy.
+    Return the list of moves ([] if the occupancy already matches), or None if no list matches.
+    board is left as it was.
+    """
+    occupancy = np.asarray(occupancy)
+    for plies in range(maxPlies + 1):
+        moves = _searchOccupancy(board, occupancy, plies)
+        if moves is not None:
+            return moves
+    return None
+
+
+def _searchOccupancy(board, occupancy, plies):
+    """Depth first search of exactly plies legal moves reaching occupancy"""
+    if plies == 0:
+        return [] if np.array_equal(np.sign(board.squares), occupancy) else None
+    for move in generateLegalMoves(board):
+        board.applyMove(move)
+        moves = _searchOccupancy(board, occupancy, plies - 1)
+        board.undoMove()
+        if moves is not None:
+            return [move] + moves
+    return None
@@ -0,0 +1,205 @@
+"""
+Run the move detection of several boards at once, one process per board.
+Every board has its own ChessBoardProcessor in a worker of a multiprocessing pool, so the OpenCV work of the
+boards runs on all the cores. The moves of all the boards come back as one stream of events tagged by board id,
+and in rectify mode the newest rectified view of every board is kept in shared memory, so no frame is ever pickled.
+
+Usage: python multiBoardRunner.py <input source> [<input source> ...] [--rectify] [--calibration-frames N]
+"""
+import argparse
+import multiprocessing
+import queue
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from chessBoardProcessing import ChessBoardProcessor
+from motionGate import MotionGate
+
+# kind is "started", "move", "finished" or "error". frameIndex is the frame of the board the event happened on,
+# detail is the move for a "move", the number of frames for a "finished" and the error message for an "error"
+BoardEvent = namedtuple("BoardEvent", ["boardId", "kind", "frameIndex", "timestamp", "detail"])
+
+# The shape of the rectified view of a board kept in shared memory
+SHARED_BOARD_SIDE = (ChessBoardProcessor.BOARD_SIDE_INTERNAL - 1) * ChessBoardProcessor.RECTIFIED_SQUARE_SIZE
+SHARED_BOARD_SHAPE = (SHARED_BOARD_SIDE, SHARED_BOARD_SIDE, 3)
+
+# The shared memory of the boards, set in every worker by _initializeWorker
+_sharedBoards = None
+_sharedCounters = None
+
+
+def _initializeWorker(sharedBoards, sharedCounters):
+    """Keep the shared memory in the worker, it can only be given to a pool worker when the worker starts"""
+    global _sharedBoards, _sharedCounters
+    _sharedBoards = sharedBoards
+    _sharedCounters = sharedCounters
+
+
+def _publishBoard(slot, rectifiedBoard):
+    """
+    Write the rectified view of a board into its slot of the shared memory.
+    The counter of the slot is odd while writing, so a reader can tell it read a half written board.
+    """
+    if rectifiedBoard.ndim == 2:
+        rectifiedBoard = cv2.cvtColor(rectifiedBoard, cv2.COLOR_GRAY2BGR)
+    target = np.frombuffer(_sharedBoards[slot], dtype=np.uint8).reshape(SHARED_BOARD_SHAPE)
+    _sharedCounters[slot] += 1
+    target[:] = rectifiedBoard
+    _sharedCounters[slot] += 1
+
+
+def _runBoard(boardId, slot, inputSource, boardCorners, options, eventQueue, stopEvent):
+    """Detect the moves of one board until its input runs out or the runner stops, in a worker of the pool"""
+    processor = None
+    try:
+        processor = ChessBoardProcessor(inputSource, rectify=options["rectify"], boardCorners=boardCorners,
+                                        headless=True)
+        processor.setCurrentSquareImages()
+        if options["calibrationFrames"] > 0:
+            processor.calibrateNoise(options["calibrationFrames"])
+        eventQueue.put(BoardEvent(boardId, "started", processor.framesCaptured - 1, time.time(), None))
+
+        # The rectified view comes with rectify mode, without it the frames are not warped just to publish them
+        publishBoards = options["publishBoards"] and options["rectify"]
+
+        def publishFrame(frame):
+            if stopEvent.is_set():
+                return False
+            if publishBoards:
+                _publishBoard(slot, processor.rectifyBoard(frame))
+            return True
+
+        for move in processor.streamMoves(options["stableFrames"], options["motionThreshold"],
+                                          frameCallback=publishFrame):
+            eventQueue.put(BoardEvent(boardId, "move", processor.framesCaptured - 1, time.time(), move))
+            processor.changeCurrentPlayingSide()
+        eventQueue.put(BoardEvent(boardId, "finished", processor.framesCaptured - 1, time.time(),
+                                  processor.framesCaptured))
+    except Exception as error:
+        eventQueue.put(BoardEvent(boardId, "error", None, time.time(), repr(error)))
+    finally:
+        if processor is not None:
+            processor.release()
+
+
+class MultiBoardRunner:
+    """
+    Runner of the move detection of several boards, each in its own process of a multiprocessing pool.
+    The moves are read with events(), the newest view of a board with getLatestBoard().
+    """
+
+    def __init__(self, inputSources, rectify=False, boardCorners=None, calibrationFrames=0,
+                 stableFrames=MotionGate.STABLE_FRAMES, motionThreshold=MotionGate.MOTION_THRESHOLD,
+                 publishBoards=True):
+        """
+        inputSources is a dict from the id of every board to its input source (a camera index, a video file or
+        a directory of images, see frameSources.openFrameSource), or a list of input sources numbered from 0.
+        boardCorners is a dict from board id to the 81 corners of that board, the corners of the other boards
+        are found on their first frame like in headless mode.
+        If publishBoards is True and rectify too, the newest rectified view of every board is kept in shared memory.
+        """
+        if not isinstance(inputSources, dict):
+            inputSources = dict(enumerate(inputSources))
+        self.inputSources = inputSources
+        self.boardCorners = boardCorners if boardCorners is not None else {}
+        self.options = {"rectify": rectify, "calibrationFrames": calibrationFrames, "stableFrames": stableFrames,
+                        "motionThreshold": motionThreshold, "publishBoards": publishBoards}
+
+        # The slot of every board in the shared memory
+        self.slots = {boardId: slot for slot, boardId in enumerate(self.inputSources)}
+        # The ids of the boards still running
+        self.runningBoards = set()
+        self.__pool = None
+        self.__manager = None
+        self.__eventQueue = None
+        self.__stopEvent = None
+        self.__sharedBoards = None
+        self.__sharedCounters = None
+
+    def start(self):
+        """Method to start one worker process per board"""
+        numBoards = len(self.inputSources)
+        # The shared memory is created before the pool, so every worker gets it when it starts
+        self.__sharedBoards = [multiprocessing.RawArray("B", int(np.prod(SHARED_BOARD_SHAPE)))
+                               for _ in range(numBoards)]
+        self.__sharedCounters = multiprocessing.RawArray("q", numBoards)
+        self.__manager = multiprocessing.Manager()
+        self.__eventQueue = self.__manager.Queue()
+        self.__stopEvent = self.__manager.Event()
+        # One worker per board, a board never waits for another one to finish
+        self.__pool = multiprocessing.Pool(numBoards, initializer=_initializeWorker,
+                                           initargs=(self.__sharedBoards, self.__sharedCounters))
+
+        for boardId, inputSource in self.inputSources.items():
+            self.__pool.apply_async(_runBoard, (boardId, self.slots[boardId], inputSource,
+                                                self.boardCorners.get(boardId), self.options, self.__eventQueue,
+                                                self.__stopEvent))
+            self.runningBoards.add(boardId)
+
+    def events(self, timeout=None):
+        """
+        Generator of the events of all the boards, in the order they happened.
+        It ends when every board has finished, or after timeout seconds without any event.
+        """
+        while self.runningBoards:
+            try:
+                event = self.__eventQueue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            if event.kind in ("finished", "error"):
+                self.runningBoards.discard(event.boardId)
+            yield event
+
+    def getLatestBoard(self, boardId):
+        """
+        Method to get a copy of the newest rectified view of a board from the shared memory.
+        Return None if the board has not published any frame yet (never without rectify mode).
+        """
+        slot = self.slots[boardId]
+        board = np.frombuffer(self.__sharedBoards[slot], dtype=np.uint8).reshape(SHARED_BOARD_SHAPE)
+        while True:
+            counter = self.__sharedCounters[slot]
+            if counter == 0:
+                return None
+            if counter % 2 == 1:
+                # The worker is writing the board, let it run
+                time.sleep(0)
+                continue
+            copy = board.copy()
+            if self.__sharedCounters[slot] == counter:
+                return copy
+
+    def stop(self):
+        """Method to stop all the boards and the worker processes"""
+        if self.__pool is None:
+            return
+        self.__stopEvent.set()
+        self.__pool.close()
+        self.__pool.join()
+        self.__manager.shutdown()
+        self.__pool = None
+        self.runningBoards.clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Detect the moves of several boards at once.")
+    parser.add_argument("inputs", nargs="+", help="camera indices, video files or directories of images")
+    parser.add_argument("--rectify", action="store_true", help="compare rectified top-down boards")
+    parser.add_argument("--calibration-frames", type=int, default=0,
+                        help="number of still frames after the first one used to calibrate the noise")
+    args = parser.parse_args()
+
+    # A number is a camera index
+    sources = [int(source) if source.isdigit() else source for source in args.inputs]
+    runner = MultiBoardRunner(sources, rectify=args.rectify, calibrationFrames=args.calibration_frames)
+    runner.start()
+    try:
+        for event in runner.events():
+            print("Board", event.boardId, event.kind, "at frame", event.frameIndex, ":", event.detail)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
@@ -0,0 +1,104 @@
+import numpy as np
+
+
+class OccupancyClassifier:
+    """
+    Classifier telling for all 64 squares of one frame whether the square is empty or has a white or a black piece,
+    so the position can be read from the camera without chaining the moves from the starting position.
+    The features of a square compare its center (where the piece stands) to its rim (the bare square around
+    the piece), which cancels most of the lighting. A square gets the occupancy of the nearest centroid learnt
+    for its square color, the centroids are calibrated on a board with a known position like the starting one.
+    The occupancy uses the signs of BoardState.squares: 1 for white, -1 for black and 0 for empty.
+    """
+
+    EMPTY = 0
+    WHITE = 1
+    BLACK = -1
+    OCCUPANCIES = (BLACK, EMPTY, WHITE)
+    # The color of every square in SQUARE_CODES order, 0 for dark (A1 is dark) and 1 for light
+    SQUARE_COLORS = np.array([(index // 8 + index % 8) % 2 for index in range(64)])
+    # The part of the square side taken by the center of the square
+    CENTER_RATIO = 0.5
+    # The part of the square side taken by the rim of the square
+    RIM_RATIO = 0.1
+    # The smallest spread of a feature, so a calibration on a single clean frame does not make the classes too tight
+    MIN_FEATURE_DEVIATION = 0.05
+
+    def __init__(self):
+        # The centroids of the features, indexed by [square color, occupancy + 1]
+        self.centroids = None
+        # The spread of every feature inside the classes, the features are divided by it before measuring distances
+        self.featureScale = None
+        # The distance of every square to every centroid found by the last call of classify, shape (64, 3)
+        self.lastDistances = None
+
+    def isCalibrated(self):
+        """Method to check whether the classifier has been calibrated"""
+        return self.centroids is not None
+
+    def computeFeatures(self, squares):
+        """
+        Method to compute the features of all 64 squares in one pass.
+        squares is an array of same-sized square tiles of shape (8, 8, s, s) (plus the color channel if any),
+        indexed by [row - 1, col] like ChessBoardProcessor.getRectifiedSquares.
+        Return an array of shape (64, number of features) in SQUARE_CODES order.
+        """
+        tiles = np.asarray(squares, dtype=np.float32).reshape((64,) + squares.shape[2:])
+        if tiles.ndim == 3:
+            tiles = tiles[..., np.newaxis]
+        size = tiles.shape[1]
+        margin = int(round(size * (1 - self.CENTER_RATIO) / 2))
+        rim = max(1, int(round(size * self.RIM_RATIO)))
+
+        center = tiles[:, margin:size - margin, margin:size - margin]
+        centerMean = center.mean(axis=(1, 2))
+        # The rim is the whole square minus its inside
+        rimSum = tiles.sum(axis=(1, 2)) - tiles[:, rim:size - rim, rim:size - rim].sum(axis=(1, 2))
+        rimMean = rimSum / (size * size - (size - 2 * rim) ** 2)
+        # The texture of the center, a piece has an edge where a bare square is flat
+        centerDeviation = center.mean(axis=3).std(axis=(1, 2))
+
+        return np.concatenate([np.log((centerMean + 1) / (rimMean + 1)),
+                               (centerDeviation / (rimMean.mean(axis=1) + 1))[:, np.newaxis]], axis=1)
+
+    def calibrate(self, squares, occupancy):
+        """
+        Method to learn the centroids from the squares of a board whose occupancy is known,
+        like the starting position. Every occupancy must be on both square colors.
+        """
+        features = self.computeFeatures(squares)
+        occupancy = np.asarray(occupancy)
+        centroids = np.empty((2, len(self.OCCUPANCIES), features.shape[1]))
+        residuals = []
+        for color in (0, 1):
+            for label in self.OCCUPANCIES:
+                inClass = (self.SQUARE_COLORS == color) & (occupancy == label)
+                if not inClass.any():
+                    raise ValueError("The calibration board needs an occupancy " + str(label) +
+                                     " on a square of color " + str(color))
+                centroids[color, label + 1] = features[inClass].mean(axis=0)
+                residuals.append(features[inClass] - centroids[color, label + 1])
+
+        self.centroids = centroids
+        self.featureScale = np.maximum(np.concatenate(residuals).std(axis=0), self.MIN_FEATURE_DEVIATION)
+
+    def classify(self, squares):
+        """
+        Method to find the occupancy of all 64 squares.
+        Return an int8 array of 64 occupancies in SQUARE_CODES order.
+        """
+        if self.centroids is None:
+            raise RuntimeError("The occupancy classifier is not calibrated")
+        features = self.computeFeatures(squares) / self.featureScale
+        # The centroids of the color of every square, shape (64, 3, number of features)
+        centroids = self.centroids[self.SQUARE_COLORS] / self.featureScale
+        self.lastDistances = np.linalg.norm(features[:, np.newaxis, :] - centroids, axis=2)
+        return (self.lastDistances.argmin(axis=1) - 1).astype(np.int8)
+
+    def getMargins(self):
+        """
+        Method to get how sure the last classification is for every square: the distance to the
+        second nearest centroid minus the distance to the nearest one. A small margin is a doubtful square.
+        """
+        distances = np.sort(self.lastDistances, axis=1)
+        return distances[:, 1] - distances[:, 0]
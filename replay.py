@@ -0,0 +1,69 @@
+"""
+Headless replay of a recorded game.
+Run the move detection of ChessBoardProcessor over every frame of a video file, a directory of images
+or a stream of frames, without any prompt or window, and report the moves found and the frames per second.
+
+Usage: python replay.py <video file or image directory> [--corners corners.npy] [--rectify] [--calibration-frames N]
+                         [--metrics metrics.json]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from chessBoardProcessing import ChessBoardProcessor
+from instrumentation import metrics
+from motionGate import MotionGate
+
+
+def replayGame(inputSource, boardCorners=None, rectify=False, calibrationFrames=0,
+               stableFrames=MotionGate.STABLE_FRAMES, motionThreshold=MotionGate.MOTION_THRESHOLD):
+    """
+    Detect all the moves of a recorded game. The first frame must show the board at the starting position,
+    the corners are found on it unless boardCorners is given. If calibrationFrames is not 0, that many frames
+    after the first one are used to calibrate the noise of the squares, so they must show a still board.
+    Return a dict with the moves as (frameIndex, move) pairs, the number of frames, the time and the frames per second.
+    """
+    startTime = time.perf_counter()
+    processor = ChessBoardProcessor(inputSource, rectify=rectify, boardCorners=boardCorners, headless=True)
+    setupSeconds = time.perf_counter() - startTime
+
+    processor.setCurrentSquareImages()
+    if calibrationFrames > 0:
+        processor.calibrateNoise(calibrationFrames)
+
+    moves = []
+    for move in processor.streamMoves(stableFrames, motionThreshold):
+        # The move is detected on the last captured frame, frames are numbered from 0
+        moves.append((processor.framesCaptured - 1, move))
+        processor.changeCurrentPlayingSide()
+    processor.release()
+
+    totalSeconds = time.perf_counter() - startTime
+    return {"moves": moves,
+            "frames": processor.framesCaptured,
+            "setupSeconds": setupSeconds,
+            "seconds": totalSeconds,
+            "framesPerSecond": processor.framesCaptured / totalSeconds if totalSeconds > 0 else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Detect the moves of a recorded game without camera or window.")
+    parser.add_argument("input", help="a video file or a directory of images")
+    parser.add_argument("--corners", help="a .npy file with the 81 board corners, found on the first frame if not given")
+    parser.add_argument("--rectify", action="store_true", help="compare rectified top-down boards")
+    parser.add_argument("--calibration-frames", type=int, default=0,
+                        help="number of still frames after the first one used to calibrate the noise")
+    parser.add_argument("--metrics", help="a file to write the timing of the stages to, as JSON")
+    args = parser.parse_args()
+
+    corners = np.load(args.corners) if args.corners else None
+    report = replayGame(args.input, boardCorners=corners, rectify=args.rectify,
+                        calibrationFrames=args.calibration_frames)
+    for frameIndex, move in report["moves"]:
+        print("Frame", frameIndex, ":", move)
+    print("=====> {} moves, {} frames in {:.2f} s ({:.1f} frames per second)".format(
+        len(report["moves"]), report["frames"], report["seconds"], report["framesPerSecond"]))
+    if args.metrics:
+        with open(args.metrics, "w") as metricsFile:
+            metricsFile.write(metrics.toJson())
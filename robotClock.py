@@ -0,0 +1,98 @@
+"""
+The clock of the robot code: every wait, sleep and timestamp of the motions and the sensors goes through it.
+On the robot it is the real clock. With the simulated devices of ev3sim it can be a ScaledClock running
+faster than real time, so the robot code sleeps for a fraction of the time and reads the time of the simulation,
+and a whole game of moves runs in seconds.
+The CPU time (see waiting) is not scaled, it stays the real CPU time used.
+Only the standard library is used, this runs on the robot.
+"""
+import time
+
+
+class RealClock:
+    """The real time, speedup is 1"""
+
+    speedup = 1.0
+
+    def monotonic(self):
+        """Method to get the time in seconds, like time.monotonic"""
+        return time.monotonic()
+
+    def perfCounter(self):
+        """Method to get the time in seconds for timing short stages, like time.perf_counter"""
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        """Method to sleep for some seconds"""
+        time.sleep(seconds)
+
+    def realSeconds(self, seconds):
+        """Method to convert a duration of this clock to real seconds, for a timeout of the threading module"""
+        return seconds
+
+    def waitEvent(self, event, timeout=None):
+        """Method to wait until a threading.Event is set or timeout seconds passed, return whether it is set"""
+        return event.wait(timeout)
+
+
+class ScaledClock(RealClock):
+    """
+    A clock running speedup times faster than the real time, from the moment it is created:
+    sleeping 1 second of this clock takes 1 / speedup real second.
+    """
+
+    def __init__(self, speedup):
+        if speedup <= 0:
+            raise ValueError("The speedup of a clock must be positive, not " + str(speedup))
+        self.speedup = float(speedup)
+        self.__realStart = time.perf_counter()
+        self.__start = time.monotonic()
+
+    def monotonic(self):
+        return self.__start + (time.perf_counter() - self.__realStart) * self.speedup
+
+    def perfCounter(self):
+        return self.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(self.realSeconds(seconds))
+
+    def realSeconds(self, seconds):
+        return None if seconds is None else max(seconds, 0.0) / self.speedup
+
+    def waitEvent(self, event, timeout=None):
+        return event.wait(self.realSeconds(timeout))
+
+
+# The clock of the program, replaced with setClock before the robot starts
+clock = RealClock()
+
+
+def setClock(newClock):
+    """Set the clock of the program, return the one it replaces"""
+    global clock
+    oldClock = clock
+    clock = newClock
+    return oldClock
+
+
+# The functions below always use the current clock, they can be imported with "from robotClock import ..."
+
+def monotonic():
+    return clock.monotonic()
+
+
+def perfCounter():
+    return clock.perfCounter()
+
+
+def sleep(seconds):
+    clock.sleep(seconds)
+
+
+def realSeconds(seconds):
+    return clock.realSeconds(seconds)
+
+
+def waitEvent(event, timeout=None):
+    return clock.waitEvent(event, timeout)
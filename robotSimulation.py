@@ -0,0 +1,135 @@
+"""
+Run a random game of robot moves on the simulated devices of ev3sim, faster than real time.
+Every move is timed on the clock of the simulation, and the pose the ArmPoseTracker keeps is compared
+with the true pose of the simulated arm after every move, so a change that makes the moves slower
+or the arm drift shows up without the robot. The results are written as JSON, and can be compared
+to the results of an earlier run.
+
+Usage: python robotSimulation.py [--output results.json] [--baseline baseline.json] [--moves N] [--speedup N]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import ev3sim
+import robotClock
+from RobotArm import RobotArm
+from armController import startArmController
+from boardState import BoardState
+from instrumentation import metrics
+from moveGenerator import generateLegalMoves, robotOperationsOfMove
+from waiting import waitStats
+
+CHESSBOARD_SQUARE_LENGTH = 5
+
+
+def poseError(controller, world, homeAngle, homeDistance):
+    """Return the errors (angle in degrees, distance in cm) of the pose tracked by controller against the true pose"""
+    pose = controller.poseTracker.pose
+    return world.armAngle() - homeAngle - pose.angle, world.armDistance() - homeDistance - pose.distance
+
+
+def runSimulation(numMoves=20, speedup=50.0, seed=0):
+    """
+    Play numMoves random legal moves with the arm on a new simulated world, speedup times faster than real time.
+    Return the results: the time of every move on the clock of the simulation, the errors of the tracked pose,
+    the real time the run took and the timed stages of the robot.
+    """
+    rng = random.Random(seed)
+    ev3sim.useSpeedup(speedup)
+    world = ev3sim.resetWorld(seed=seed)
+    metrics.reset()
+    waitStats.reset()
+    realStart = time.perf_counter()
+    simulationStart = robotClock.monotonic()
+
+    robot = RobotArm("Simulated", backend=ev3sim)
+    controller = startArmController(robot, CHESSBOARD_SQUARE_LENGTH)
+    homeAngle, homeDistance = world.armAngle(), world.armDistance()
+    startUpSeconds = robotClock.monotonic() - simulationStart
+
+    board = BoardState.startingPosition()
+    moves = []
+    for _ in range(numMoves):
+        legalMoves = generateLegalMoves(board)
+        if not legalMoves:
+            break
+        move = legalMoves[rng.randrange(len(legalMoves))]
+        operations = robotOperationsOfMove(board, move)
+        result = controller.execute(operations)
+        board.applyMove(move)
+        angleError, distanceError = poseError(controller, world, homeAngle, homeDistance)
+        moves.append({"move": BoardState.squareCode(move[0]) + "-" + BoardState.squareCode(move[1]),
+                      "operations": len(operations), "status": result["status"],
+                      "seconds": result.get("seconds", 0.0) + result.get("homingSeconds", 0.0),
+                      "serialSeconds": result.get("serialSeconds", 0.0),
+                      "angleError": angleError, "distanceError": distanceError})
+        if result["status"] != "done":
+            break
+    robot.stopSensorService()
+
+    realSeconds = time.perf_counter() - realStart
+    simulationSeconds = robotClock.monotonic() - simulationStart
+    movesSeconds = sum(move["seconds"] for move in moves)
+    return {"moves": moves,
+            "summary": {"moves": len(moves),
+                        "failedMoves": sum(1 for move in moves if move["status"] != "done"),
+                        "startUpSeconds": startUpSeconds,
+                        "secondsPerMove": movesSeconds / len(moves) if moves else None,
+                        "maxAngleError": max([abs(move["angleError"]) for move in moves] or [0.0]),
+                        "maxDistanceError": max([abs(move["distanceError"]) for move in moves] or [0.0]),
+                        "cmPerCount": robot.cmPerCount, "degreesPerCount": robot.degreesPerCount,
+                        "simulationSeconds": simulationSeconds, "realSeconds": realSeconds,
+                        "speedup": simulationSeconds / realSeconds},
+            "stages": metrics.toDict(),
+            "waits": waitStats.toDict()}
+
+
+def compareWithBaseline(results, baseline, tolerance=0.1, angleMargin=1.0, distanceMargin=0.5):
+    """
+    Return the list of regressions of results against the results of an earlier run with the same seed:
+    a move time slower by more than tolerance (0.1 is 10%), a pose error larger by more than
+    angleMargin degrees or distanceMargin cm, or moves that failed.
+    """
+    regressions = []
+    summary, baselineSummary = results["summary"], baseline["summary"]
+    if summary["failedMoves"] > baselineSummary["failedMoves"]:
+        regressions.append("{} failed moves, {} before".format(summary["failedMoves"], baselineSummary["failedMoves"]))
+    if summary["secondsPerMove"] is not None and baselineSummary["secondsPerMove"] is not None and \
+            summary["secondsPerMove"] > baselineSummary["secondsPerMove"] * (1 + tolerance):
+        regressions.append("secondsPerMove: {:.2f} s, {:.2f} s before".format(summary["secondsPerMove"],
+                                                                              baselineSummary["secondsPerMove"]))
+    if summary["maxAngleError"] > baselineSummary["maxAngleError"] + angleMargin:
+        regressions.append("maxAngleError: {:.2f} degrees, {:.2f} before".format(summary["maxAngleError"],
+                                                                                 baselineSummary["maxAngleError"]))
+    if summary["maxDistanceError"] > baselineSummary["maxDistanceError"] + distanceMargin:
+        regressions.append("maxDistanceError: {:.2f} cm, {:.2f} before".format(summary["maxDistanceError"],
+                                                                               baselineSummary["maxDistanceError"]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play a random game with the simulated robot arm.")
+    parser.add_argument("--output", help="file to write the JSON results to, printed if not given")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed slowdown of a move, 0.1 is 10%%")
+    parser.add_argument("--moves", type=int, default=20)
+    parser.add_argument("--speedup", type=float, default=50.0, help="how much faster than real time to run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = runSimulation(args.moves, args.speedup, args.seed)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compareWithBaseline(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
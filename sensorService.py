@@ -0,0 +1,126 @@
+import threading
+from collections import deque
+
+import robotClock
+
+
+class SensorService(threading.Thread):
+    """
+    Thread to sample the sensors of the robot at a fixed rate into small ring buffers.
+    Reading a sensor then never waits on the device: it returns a filtered value of the last samples
+    (their median or an exponential moving average) with the time it was sampled.
+    A control loop can wait for the next round of samples with waitForNewSample instead of spinning.
+    """
+
+    # The number of sampling rounds per second
+    SAMPLE_RATE = 100.0
+    # The number of samples kept for every sensor
+    BUFFER_SIZE = 32
+    # The number of last samples the median is taken over
+    MEDIAN_WINDOW = 5
+    # The weight of a new sample in the exponential moving average
+    EMA_ALPHA = 0.3
+
+    def __init__(self, sensors, sampleRate=SAMPLE_RATE, bufferSize=BUFFER_SIZE, emaAlpha=EMA_ALPHA):
+        """sensors is a dict from the name of every sensor to a function reading its raw value"""
+        super(SensorService, self).__init__(daemon=True)
+        self.sensors = dict(sensors)
+        self.samplePeriod = 1.0 / sampleRate
+        self.emaAlpha = emaAlpha
+        # For every sensor, the pairs (value, timestamp), the newest sample is at the right end.
+        # The timestamp comes from robotClock.monotonic() at the start of the sampling round
+        self.samples = {name: deque(maxlen=bufferSize) for name in self.sensors}
+        self.emas = {name: None for name in self.sensors}
+        # The number of sampling rounds done, and of reads that failed
+        self.roundsSampled = 0
+        self.readErrors = 0
+        # Held while the devices are read, take it to change the mode of a sensor without a sample in between
+        self.deviceLock = threading.Lock()
+        self.__condition = threading.Condition()
+        self.__running = False
+        self.__stopEvent = threading.Event()
+
+    def start(self):
+        """Start sampling on the service thread"""
+        self.__running = True
+        super(SensorService, self).start()
+
+    def run(self):
+        """Sample all the sensors every samplePeriod seconds until the service is stopped"""
+        nextRound = robotClock.monotonic()
+        while self.__running:
+            timestamp = robotClock.monotonic()
+            values = {}
+            with self.deviceLock:
+                for name, readSensor in self.sensors.items():
+                    try:
+                        values[name] = readSensor()
+                    except (OSError, ValueError):
+                        # A sysfs read of the EV3 can fail now and then, skip that sample
+                        self.readErrors += 1
+
+            with self.__condition:
+                for name, value in values.items():
+                    self.samples[name].append((value, timestamp))
+                    ema = self.emas[name]
+                    self.emas[name] = value if ema is None else ema + self.emaAlpha * (value - ema)
+                self.roundsSampled += 1
+                self.__condition.notify_all()
+
+            # Keep a fixed rate, but do not try to catch up on rounds missed by a slow read
+            nextRound = max(nextRound + self.samplePeriod, robotClock.monotonic())
+            robotClock.waitEvent(self.__stopEvent, nextRound - robotClock.monotonic())
+
+        with self.__condition:
+            self.__running = False
+            # Wake up everyone still waiting for a sample
+            self.__condition.notify_all()
+
+    def isRunning(self):
+        """Method to check whether the service is still sampling"""
+        return self.__running
+
+    def read(self, name, method="median"):
+        """
+        Method to read a sensor without waiting. method is "median" (of the last MEDIAN_WINDOW samples),
+        "ema" (exponential moving average) or "latest" (the last raw sample).
+        Return the pair (value, timestamp of the newest sample), or (None, None) if there is no sample yet.
+        """
+        with self.__condition:
+            samples = self.samples[name]
+            if not samples:
+                return None, None
+            timestamp = samples[-1][1]
+            if method == "latest":
+                return samples[-1][0], timestamp
+            if method == "ema":
+                return self.emas[name], timestamp
+            window = sorted(value for value, _ in list(samples)[-self.MEDIAN_WINDOW:])
+            return window[len(window) // 2], timestamp
+
+    def waitForNewSample(self, afterRound=None, timeout=None):
+        """
+        Method to wait (up to timeout seconds) for a sampling round after the round number afterRound,
+        the last finished round by default. Return the number of the last round, or None if no new round comes.
+        """
+        with self.__condition:
+            if afterRound is None:
+                afterRound = self.roundsSampled
+            self.__condition.wait_for(lambda: self.roundsSampled > afterRound or not self.__running,
+                                      robotClock.realSeconds(timeout))
+            if self.roundsSampled <= afterRound:
+                return None
+            return self.roundsSampled
+
+    def clear(self, name):
+        """Method to forget the samples of a sensor, after its value was reset"""
+        with self.__condition:
+            self.samples[name].clear()
+            self.emas[name] = None
+
+    def stop(self):
+        """Method to stop the service thread"""
+        self.__running = False
+        self.__stopEvent.set()
+        if self.is_alive():
+            self.join(timeout=1)
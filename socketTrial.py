@@ -1,125 +1,246 @@
-import socketserver as socketserver
+import asyncio
+import json
 import socket
-import time
+from concurrent.futures import ThreadPoolExecutor
+import robotClock
 from RobotArm import *
+from armController import startArmController
+from framing import FramingError, readMessage, writeMessage
+from instrumentation import metrics
+from waiting import waitStats
 
 
-class RobotArmHandler(socketserver.BaseRequestHandler):
-    """
-    Request handler for the server of the robot arm
-
-    Override the method handle() to implement communication to the client (robot)
-    """
-
-    def handle(self):
-        # The form of data recieve will be a string "Pos1-Pos2", example: "E9-D7"
-        data = self.request.recv(4096)
-        # Decode the data to actual string
-        string_data = data.decode().strip()
-        move = string_data.split("-")
-
-        first_position = move[0]
-        second_position = move[1]
-
-        print(first_position)
-        print(second_position)
-
-        self.movePiece(first_position, second_position)
-
-        self.request.sendall(bytes("done", "utf-8"))
-
-    def movePiece(self, pos1, pos2):
-        """Method to move a piece from pos1 to pos2"""
-
-        initialRow = {"A": (7, 0), "B": (6, 0), "C": (6, 0), "D": (
-            6, 0), "E": (6, 0), "F": (6, 2), "G": (7, -1), "H": (8, 0)}
-        turningAngle = {"A": -43, "B": -60, "C": -70, "D": -85, "E": -97, "F": -110, "G": -125, "H": -140}
-
-        # Find the column of the positions
-        col1 = pos1[0]
-        col2 = pos2[0]
-        # Find the row of the fist position
-        row1 = int(pos1[1])
-        row2 = int(pos2[1])
-
-        # Turn to the column of the first position
-        robot.turnExact(turningAngle[col1])
+class MotionJob:
+    """A list of operations of the arm waiting in the queue of the server, send(message) gets its progress"""
 
-        # Take out the initial row after turning to col1 with the uncertainty
-        initialRowAndIncorrect1 = initialRow[col1]
-        initialRowAndIncorrect2 = initialRow[col2]
-        currentRow = initialRowAndIncorrect1[0]
+    def __init__(self, operations, send):
+        self.operations = operations
+        self.send = send
+        self.queuedAt = robotClock.monotonic()
+        # Set to the final message of the operations when they are done
+        self.future = asyncio.get_event_loop().create_future()
 
-        # Move the arm to row1
-        incorrect = initialRowAndIncorrect1[1]
-        traveledDistance = 0
-        traveledDistance += self.moveArmToRow(currentRow, row1, 0, incorrect)
-        # Pick up the object
-        self.pickOrDropPiece()
 
-        # Now the object is currently at col1, we need to turn it to col2
-        robot.turnExact(turningAngle[col2] - turningAngle[col1])
-
-        # NOTE: Here, because we measture the angles continuously, after the arm moving to the first
-        # row, row1 and col1, when it turn back that much degree, it has already gone a distance called traveledDistance,
-        # This distance should made it not start from row1, but from the initialRow of col2 + traveledDistance
-        traveledDistance += self.moveArmToRow(initialRowAndIncorrect2[0], row2, -(traveledDistance), incorrect=initialRowAndIncorrect2[1])
-
-        # Move the robot from row1 to row2, adjustment will be the difference between them
-        # traveledDistance += self.moveArmToRow(row1, row2, initialRowAndIncorrect1[1] - initialRowAndIncorrect2[1])
-
-
-        # Drop the object
-        self.pickOrDropPiece(pickUp=False)
-
-        # Reset the arm
-        robot.turnToStartPosition()
+class RobotServer:
+    """
+    Server of the robot arm, on asyncio. Every connection is served by its own coroutine, so the status of the arm,
+    the metrics and an emergency stop are answered right away while the arm moves.
+    The motions go into a queue served by a single motion worker, which runs them one after the other on a thread
+    with the ArmController, and the progress of their steps is sent back while they run.
+
+    2 protocols are served on the same port, told apart by the first byte (see framing):
+    - Framed messages on a persistent connection (see PersistentRobotArmClient): a request is
+      {"id": ..., "command": ...} and every answer carries its id, the last one a "status".
+      The commands are "ping", "status", "stop", "metrics", "waits", "lastmove", "move" ("from", "to")
+      and "batch" ("operations", see ArmController.planOperations).
+    - The text commands of ClientSideRobotArm, one per connection: "E2-E4" answered with "done", "aborted",
+      "timeout" or "error", "batch [...]" answered with JSON lines, "status", "stop", "metrics",
+      "metrics json", "waits" and "lastmove".
+    """
 
-        # Move back to the original position
-        if traveledDistance > 0:
-            robot.backwardExact(traveledDistance)
+    def __init__(self, controller, host, port):
+        self.controller = controller
+        self.host, self.port = host, port
+        self.queue = None
+        # The job the motion worker runs right now, None when the arm is idle
+        self.currentJob = None
+        self.jobsDone = 0
+        # The motions block, they run on this thread so the event loop keeps answering
+        self.__motionExecutor = ThreadPoolExecutor(max_workers=1)
+        self.__server = None
+        self.__worker = None
+        # The writer of every open connection, by the task serving it
+        self.__connections = {}
+
+    async def start(self):
+        """Method to start listening and the motion worker, return the address listened on"""
+        self.queue = asyncio.Queue()
+        self.__worker = asyncio.ensure_future(self.runMotionWorker())
+        self.__server = await asyncio.start_server(self.handleConnection, self.host, self.port)
+        return self.__server.sockets[0].getsockname()
+
+    async def stop(self):
+        """Method to stop listening and the motion worker, the motion in progress is stopped"""
+        self.emergencyStop()
+        self.__server.close()
+        for writer in self.__connections.values():
+            writer.close()
+        await asyncio.gather(*self.__connections, return_exceptions=True)
+        await self.__server.wait_closed()
+        self.__worker.cancel()
+        self.__motionExecutor.shutdown(wait=True)
+
+    # ---------------------------------------------------------------------------
+    # Motions
+
+    async def runMotionWorker(self):
+        """Run the jobs of the queue one after the other"""
+        loop = asyncio.get_event_loop()
+        while True:
+            job = await self.queue.get()
+            self.currentJob = job
+
+            def listener(event, job=job):
+                # Called from the threads of the steps
+                loop.call_soon_threadsafe(job.send, event)
+            try:
+                result = await loop.run_in_executor(self.__motionExecutor, self.controller.execute,
+                                                    job.operations, listener)
+            except Exception as error:
+                result = {"status": "error", "error": repr(error)}
+            finally:
+                self.currentJob = None
+            # The time the job waited in the queue
+            result["queuedSeconds"] = robotClock.monotonic() - job.queuedAt - result.get("seconds", 0.0) - \
+                result.get("homingSeconds", 0.0)
+            self.jobsDone += 1
+            job.send(result)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def enqueue(self, operations, send):
+        """Method to queue a list of operations, return its MotionJob"""
+        job = MotionJob(operations, send)
+        self.queue.put_nowait(job)
+        send({"event": "queued", "position": self.queue.qsize() + (self.currentJob is not None)})
+        return job
+
+    def emergencyStop(self):
+        """Method to stop the arm right away and drop the queued motions, return the time taken in milliseconds"""
+        latency = self.controller.emergencyStop()
+        # The queued motions were planned for a board that may have changed
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            job.send({"status": "aborted"})
+            job.future.set_result({"status": "aborted"})
+        return latency
+
+    def status(self):
+        """Method to get the state of the server and of the arm, see ArmController.status"""
+        status = self.controller.status()
+        status["queueDepth"] = self.queue.qsize()
+        status["currentOperations"] = None if self.currentJob is None else self.currentJob.operations
+        status["jobsDone"] = self.jobsDone
+        return status
+
+    # ---------------------------------------------------------------------------
+    # Connections
+
+    async def handleConnection(self, reader, writer):
+        task = asyncio.current_task() if hasattr(asyncio, "current_task") else asyncio.Task.current_task()
+        self.__connections[task] = writer
+        try:
+            firstByte = await reader.read(1)
+            if not firstByte:
+                return
+            # A persistent connection of framed messages starts with the 0 byte of a message length
+            if firstByte == b"\x00":
+                await self.serveFramed(reader, writer, firstByte)
+            else:
+                await self.serveText(reader, writer, firstByte)
+        except (FramingError, ValueError, OSError) as error:
+            print("=====> Connection closed: ", error)
+        finally:
+            del self.__connections[task]
+            writer.close()
+
+    async def serveFramed(self, reader, writer, firstByte):
+        """Serve the framed requests of a persistent connection until the client closes it"""
+        request = await readMessage(reader, prefix=firstByte)
+        while request is not None:
+            self.answerRequest(request, writer)
+            await writer.drain()
+            request = await readMessage(reader)
+
+    def answerRequest(self, request, writer):
+        """Answer a framed request, a motion is queued and answered by the motion worker"""
+        if not isinstance(request, dict):
+            if not writer.transport.is_closing():
+                writeMessage(writer, {"status": "error", "error": "A request must be a JSON object"})
+            return
+        requestId = request.get("id")
+
+        def send(message):
+            if not writer.transport.is_closing():
+                writeMessage(writer, dict(message, id=requestId))
+
+        command = request.get("command")
+        if command == "ping":
+            send({"status": "pong"})
+        elif command == "status":
+            send({"status": "done", "arm": self.status()})
+        elif command == "stop":
+            send({"status": "stopped", "milliseconds": self.emergencyStop()})
+        elif command == "metrics":
+            send({"status": "done", "metrics": metrics.toDict()})
+        elif command == "waits":
+            send({"status": "done", "waits": waitStats.toDict()})
+        elif command == "lastmove":
+            send({"status": "done", "report": self.controller.lastMoveReport})
+        elif command in ("move", "batch"):
+            try:
+                if command == "move":
+                    operations = [{"op": "move", "from": request["from"], "to": request["to"]}]
+                else:
+                    operations = request["operations"]
+            except KeyError as error:
+                send({"status": "error", "error": repr(error)})
+                return
+            self.enqueue(operations, send)
         else:
-            robot.forwardExact(abs(traveledDistance))
+            send({"status": "error", "error": "Unknown command " + str(command)})
 
-        robot.armRelease()
-        time.sleep(2)
-        robot.armToStraightPosition()
-
-        # Turn back a bit to adjust the position
-        robot.turnExact(-5)
-
-    def moveArmToRow(self, currentRow, row, adjustment, incorrect=0):
-        """Method to move the robot arm to a row from current row"""
-        distanceToRow = abs(row - currentRow) * \
-            CHESSBOARD_SQUARE_LENGTH + adjustment + incorrect
-        print("===> DISTANCE TO NEW ROAD: ", distanceToRow)
-
-        forwarded = True
+    async def serveText(self, reader, writer, firstByte):
+        """Serve one text command"""
+        data = firstByte + await reader.read(4096)
+        string_data = data.decode().strip()
 
-        if distanceToRow < 0:
-            # TODO: WRONG LOGIC, SHOULD GO backward
-            # If the currentRow has the value smaller than row, go backward to reach to row
-            robot.backwardExact(abs(distanceToRow))
-            forwarded = False
-        else:
-            # If the current row has the value larger than row, go forward to reach to row
-            robot.forwardExact(distanceToRow)
-        # else:
-        #     # If the current row is the same with new row, adjust the incorrect by go forward to correct
-        #     robot.forwardExact(distanceToRow)
-
-        return distanceToRow
-
-    def pickOrDropPiece(self, pickUp=True):
-        """Method to pick up or drop down a piece"""
-        # Wait until the robot reach to position
-        while robot.isMoving():
-            pass
-        # Pick up the object
-        if pickUp:
-            robot.pickUp()
+        def sendText(text):
+            writer.write(bytes(text, "utf-8"))
+
+        def sendLine(message):
+            if not writer.transport.is_closing():
+                writer.write(bytes(json.dumps(message) + "\n", "utf-8"))
+
+        # "metrics" asks for the timing of the robot stages instead of a move, "metrics json" for the JSON version
+        if string_data == "metrics":
+            sendText(metrics.toPrometheus())
+        elif string_data == "metrics json":
+            sendText(metrics.toJson())
+        elif string_data == "waits":
+            # How long the robot waited on its motors and sensors, and the CPU it used for that
+            sendText(json.dumps(waitStats.toDict(), indent=2))
+        elif string_data == "lastmove":
+            # The wall-clock time of the last move and of each of its steps
+            sendText(json.dumps(self.controller.lastMoveReport, indent=2))
+        elif string_data == "status":
+            sendText(json.dumps(self.status(), indent=2))
+        elif string_data == "stop":
+            sendText("stopped {:.2f}".format(self.emergencyStop()))
+        elif string_data.startswith("batch"):
+            # A batch can be longer than one read, it ends with a new line
+            while not data.endswith(b"\n"):
+                chunk = await reader.read(4096)
+                if not chunk:
+                    break
+                data += chunk
+            try:
+                operations = json.loads(data.decode()[len("batch"):])
+            except ValueError as error:
+                sendLine({"status": "error", "error": repr(error)})
+            else:
+                await self.enqueue(operations, sendLine).future
         else:
-            robot.dropDown()
+            # The form of data recieve will be a string "Pos1-Pos2", example: "E9-D7"
+            move = string_data.split("-")
+            if len(move) != 2:
+                sendText("error")
+            else:
+                print(move[0])
+                print(move[1])
+                job = self.enqueue([{"op": "move", "from": move[0], "to": move[1]}], lambda message: None)
+                sendText((await job.future)["status"])
+        await writer.drain()
 
 
 if __name__ == '__main__':
@@ -128,11 +249,10 @@ if __name__ == '__main__':
     CHESSBOARD_SQUARE_LENGTH = 5
 
     robot = RobotArm()
+    controller = startArmController(robot, CHESSBOARD_SQUARE_LENGTH)
 
-    robot.armToStraightPosition()
-    robot.turnExact(-5)
-
-    server = socketserver.TCPServer(
-        (socket.gethostname(), PORT), RobotArmHandler)
-    print(server.server_address)
-    server.serve_forever()
+    # One motion at a time from a queue, while every connection is answered right away
+    server = RobotServer(controller, socket.gethostname(), PORT)
+    loop = asyncio.get_event_loop()
+    print(loop.run_until_complete(server.start()))
+    loop.run_forever()
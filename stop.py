@@ -1,8 +1,26 @@
 # Small script to stop the robot
-from RobotArm import *
+# The running server stops the arm in a few milliseconds. Only if it cannot be reached, the motors are
+# stopped directly, which is slower (importing ev3dev and setting up the devices) and competes with the server.
+# Usage: python stop.py [host]
+import socket
+import sys
 
-robot = RobotArm("Duc")
+from client import ClientSideRobotArm
 
-robot.armRelease()
-robot.stopMoving()
-robot.stopTurning()
+host = sys.argv[1] if len(sys.argv) > 1 else socket.gethostname()
+
+try:
+    client = ClientSideRobotArm(host=host)
+    latency = client.emergencyStop()
+    print("Robot stopped by the server in {:.2f} ms".format(latency))
+except (OSError, IndexError, ValueError) as error:
+    print("Cannot stop the robot through the server (", error, "), stopping the motors directly")
+    from RobotArm import RobotArm
+
+    # Skip the gyro, setting it up takes time and is not needed to stop
+    config = {device: port for device, port in RobotArm.DEFAULT_CONFIG.items() if device != RobotArm.GYRO_SENSOR}
+    robot = RobotArm("Duc", configDict=config)
+
+    robot.armRelease()
+    robot.stopMoving()
+    robot.stopTurning()
@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+from chessBoardProcessing import ChessBoardProcessor
+
+
+class SyntheticBoardRenderer:
+    """
+    Renderer of synthetic camera frames of the printed chessboard, used to benchmark and test the vision
+    path without a camera. The board is seen through a random perspective, with a lighting gradient
+    and sensor noise, and the pieces are drawn as round blobs on their squares.
+    The exact position of the internal corners is known, so detections can be checked against it.
+    """
+
+    FRAME_SIZE = (640, 480)
+    # The side length in pixels of a square before the perspective warp
+    SQUARE_SIZE = 40
+    LIGHT_SQUARE = 200
+    DARK_SQUARE = 60
+    PIECE_COLORS = {0: (235, 235, 225), 1: (35, 30, 30)}
+    HAND_COLOR = (120, 160, 210)
+
+    def __init__(self, frameSize=FRAME_SIZE, perspective=0.08, noise=2.0, lightingGradient=0.3, seed=0):
+        """
+        perspective is how far (as a part of the frame size) each corner of the board can move away from
+        a straight top-down view, noise is the standard deviation of the sensor noise in gray levels,
+        and lightingGradient is the difference of brightness between the 2 sides of the frame.
+        """
+        self.frameSize = frameSize
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        # The board with a white border of 1 square on each side, seen from the top
+        side = ChessBoardProcessor.BOARD_SIDE_LENGTH + 2
+        self.boardImageSize = side * self.SQUARE_SIZE
+        width, height = frameSize
+        boardSize = 0.8 * min(width, height)
+        center = np.array([width / 2, height / 2])
+        square = np.float32([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * boardSize / 2 + center
+        jitter = self.rng.uniform(-perspective, perspective, (4, 2)) * np.array([width, height])
+        source = np.float32([[0, 0], [self.boardImageSize, 0], [self.boardImageSize, self.boardImageSize],
+                             [0, self.boardImageSize]])
+        self.homography = cv2.getPerspectiveTransform(source, np.float32(square + jitter))
+
+        # The internal corners start after the border and the first square of the board
+        internal = ChessBoardProcessor.BOARD_SIDE_INTERNAL
+        rows, cols = np.indices((internal, internal), dtype=np.float32)
+        corners = (np.stack([cols.ravel(), rows.ravel()], axis=1) + 2) * self.SQUARE_SIZE
+        self.boardCorners = cv2.perspectiveTransform(corners.reshape((-1, 1, 2)), self.homography)
+
+        # The brightness goes linearly from one side of the frame to the other
+        gain = np.linspace(1 - lightingGradient / 2, 1 + lightingGradient / 2, width, dtype=np.float32)
+        self.lighting = np.tile(gain, (height, 1))[:, :, np.newaxis]
+
+        self.__emptyBoard = self.__drawEmptyBoard()
+
+    def __drawEmptyBoard(self):
+        """Method to draw the top-down image of the board without any piece"""
+        board = np.full((self.boardImageSize, self.boardImageSize, 3), 255, np.uint8)
+        for row in range(ChessBoardProcessor.BOARD_SIDE_LENGTH):
+            for col in range(ChessBoardProcessor.BOARD_SIDE_LENGTH):
+                color = self.LIGHT_SQUARE if (row + col) % 2 == 0 else self.DARK_SQUARE
+                top, left = (row + 1) * self.SQUARE_SIZE, (col + 1) * self.SQUARE_SIZE
+                board[top:top + self.SQUARE_SIZE, left:left + self.SQUARE_SIZE] = color
+        return board
+
+    def squareCenter(self, squareCode):
+        """Method to get the center of a square (like "E2") in the top-down image of the board"""
+        col = "ABCDEFGH".index(squareCode[0])
+        # The row 8 is the first row after the border and the first row of the printed board
+        row = 8 - int(squareCode[1])
+        return int((col + 2.5) * self.SQUARE_SIZE), int((row + 2.5) * self.SQUARE_SIZE)
+
+    def render(self, pieceAtPosition, hand=False):
+        """
+        Method to render a camera frame of the board with the pieces of pieceAtPosition, a dict like
+        ChessBoardProcessor.pieceAtPosition ("E2": "P0", empty squares are None or missing).
+        If hand is True, a hand is drawn over the middle of the board.
+        """
+        board = self.__emptyBoard.copy()
+        radius = int(0.35 * self.SQUARE_SIZE)
+        for squareCode, piece in pieceAtPosition.items():
+            if piece is not None:
+                side = int(piece[1])
+                cv2.circle(board, self.squareCenter(squareCode), radius, self.PIECE_COLORS[side], -1)
+                cv2.circle(board, self.squareCenter(squareCode), radius, (128, 128, 128), 2)
+        if hand:
+            center = self.boardImageSize // 2
+            cv2.ellipse(board, (center, center), (3 * self.SQUARE_SIZE, self.SQUARE_SIZE), 30, 0, 360,
+                        self.HAND_COLOR, -1)
+
+        frame = cv2.warpPerspective(board, self.homography, self.frameSize, borderValue=(255, 255, 255))
+        frame = frame * self.lighting + self.rng.normal(0, self.noise, frame.shape)
+        return np.clip(frame, 0, 255).astype(np.uint8)
@@ -0,0 +1,90 @@
+"""
+Tests of the length-prefixed JSON messages, on blocking sockets and on asyncio streams.
+Run from the root of the repository: python -m pytest -q tests
+"""
+import asyncio
+import socket
+
+import pytest
+
+import framing
+from framing import FramingError, encodeMessage, readMessage, receiveMessage, sendMessage
+
+MESSAGE = {"op": "batch", "operations": [{"op": "move", "from": "E2", "to": "E4"}], "id": 7}
+
+
+def readFromStream(data, prefix=b""):
+    """Read one message with readMessage from a StreamReader fed with data and closed"""
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await readMessage(reader, prefix)
+    return asyncio.run(read())
+
+
+@pytest.fixture
+def socketPair():
+    sender, receiver = socket.socketpair()
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def test_roundTripOnSockets(socketPair):
+    sender, receiver = socketPair
+    sendMessage(sender, MESSAGE)
+    sendMessage(sender, {"status": "done"})
+    assert receiveMessage(receiver) == MESSAGE
+    assert receiveMessage(receiver) == {"status": "done"}
+
+
+def test_roundTripOnStream():
+    assert readFromStream(encodeMessage(MESSAGE)) == MESSAGE
+
+
+def test_closedBetweenMessages(socketPair):
+    sender, receiver = socketPair
+    sender.close()
+    assert receiveMessage(receiver) is None
+    assert readFromStream(b"") is None
+
+
+def test_splitRead(socketPair):
+    sender, receiver = socketPair
+    data = encodeMessage(MESSAGE)
+    # Every byte arrives on its own, the header too
+    for index in range(len(data)):
+        sender.sendall(data[index:index + 1])
+    assert receiveMessage(receiver) == MESSAGE
+
+
+def test_prefixAlreadyRead():
+    data = encodeMessage(MESSAGE)
+    assert readFromStream(data[1:], prefix=data[:1]) == MESSAGE
+
+
+@pytest.mark.parametrize("cut", [2, framing.HEADER.size + 3])
+def test_closedInTheMiddle(socketPair, cut):
+    sender, receiver = socketPair
+    data = encodeMessage(MESSAGE)
+    sender.sendall(data[:cut])
+    sender.close()
+    with pytest.raises(FramingError):
+        receiveMessage(receiver)
+    with pytest.raises(FramingError):
+        readFromStream(data[:cut])
+
+
+def test_oversizeMessage(socketPair, monkeypatch):
+    monkeypatch.setattr(framing, "MAX_MESSAGE_SIZE", 64)
+    with pytest.raises(FramingError):
+        encodeMessage({"data": "x" * 64})
+
+    # A header announcing too much is refused before the payload is read
+    sender, receiver = socketPair
+    sender.sendall(framing.HEADER.pack(65))
+    with pytest.raises(FramingError):
+        receiveMessage(receiver)
+    with pytest.raises(FramingError):
+        readFromStream(framing.HEADER.pack(65))
@@ -0,0 +1,39 @@
+"""
+Tests of the robot execution stage of the game pipeline, with an arm that fails.
+Run from the root of the repository: python -m pytest -q tests
+"""
+import asyncio
+import concurrent.futures
+
+import pytest
+
+from boardState import BoardState
+from gameOrchestrator import GameOrchestrator, RobotJob
+from moveGenerator import generateLegalMoves, robotOperationsOfMove
+
+
+class FailingRobotArm:
+    """An arm whose every batch raises error"""
+
+    def __init__(self, error):
+        self.error = error
+
+    def sendBatch(self, operations, onProgress=None, timeout=None):
+        raise self.error
+
+
+@pytest.mark.parametrize("error", [ConnectionResetError("closed"), asyncio.TimeoutError(),
+                                   concurrent.futures.TimeoutError()])
+def test_failedRobotEndsTheGame(error):
+    game = GameOrchestrator(None, FailingRobotArm(error), None)
+    board = BoardState.startingPosition()
+    move = generateLegalMoves(board)[0]
+    operations = robotOperationsOfMove(board, move)
+    board.applyMove(move)
+    game.robotMoving.set()
+    game.robotQueue.put((RobotJob(move, operations, board, {}), 0.0))
+
+    game.runExecution()
+    assert game.endReason is not None
+    assert game.stopEvent.is_set()
+    assert not game.robotMoving.is_set()
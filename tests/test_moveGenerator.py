@@ -0,0 +1,42 @@
+"""
+Tests of the move generator, counting the positions reached from known positions (perft).
+Run from the root of the repository: python -m pytest -q tests
+"""
+import pytest
+
+from boardState import BoardState
+from moveGenerator import generateLegalMoves
+
+# The position of the chess programming wiki with castling, en passant, promotions and pins on both sides
+KIWIPETE_FEN = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+
+
+def perft(board, depth):
+    """Count the positions reached after depth moves, every move is undone after it"""
+    if depth == 0:
+        return 1
+    moves = generateLegalMoves(board)
+    if depth == 1:
+        return len(moves)
+    count = 0
+    for move in moves:
+        board.applyMove(move)
+        count += perft(board, depth - 1)
+        board.undoMove()
+    return count
+
+
+@pytest.mark.parametrize("depth, positions", [(1, 20), (2, 400), (3, 8902)])
+def test_perftStartingPosition(depth, positions):
+    assert perft(BoardState.startingPosition(), depth) == positions
+
+
+@pytest.mark.parametrize("depth, positions", [(1, 48), (2, 2039), (3, 97862)])
+def test_perftKiwipete(depth, positions):
+    assert perft(BoardState.fromFen(KIWIPETE_FEN), depth) == positions
+
+
+def test_undoRestoresTheBoard():
+    board = BoardState.fromFen(KIWIPETE_FEN)
+    perft(board, 2)
+    assert board.toFen() == BoardState.fromFen(KIWIPETE_FEN).toFen()
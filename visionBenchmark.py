@@ -0,0 +1,228 @@
+"""
+Benchmark of the vision path of ChessBoardProcessor on synthetic rendered boards.
+Every stage is timed separately and the move detection accuracy is measured on a random game.
+The results are written as JSON, and can be compared to the results of an earlier run.
+
+Usage: python visionBenchmark.py [--output results.json] [--baseline baseline.json] [--repeats N] [--moves N]
+"""
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from boardState import BoardState
+from chessBoardProcessing import ChessBoardProcessor
+from moveGenerator import generateLegalMoves
+from syntheticBoard import SyntheticBoardRenderer
+
+
+class RenderedFeed:
+    """Capture that renders a new frame of the current pieces every time it is read"""
+
+    def __init__(self, renderer, pieceAtPosition):
+        self.renderer = renderer
+        self.pieceAtPosition = pieceAtPosition
+
+    def read(self):
+        return True, self.renderer.render(self.pieceAtPosition)
+
+    def release(self):
+        pass
+
+
+def timeStage(function, repeats, setup=None):
+    """Call function repeats times and return the time of each call in milliseconds. setup is not timed."""
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summarize(times):
+    """Return the latency percentiles of a list of times in milliseconds"""
+    times = np.asarray(times)
+    return {"samples": len(times), "mean": float(times.mean()), "p50": float(np.percentile(times, 50)),
+            "p90": float(np.percentile(times, 90)), "p99": float(np.percentile(times, 99)), "max": float(times.max())}
+
+
+def randomMove(board, rng):
+    """
+    Return a random legal move of the side to move of board, or None if the game is over.
+    The pawns only promote to queens, the camera cannot tell the promoted pieces apart.
+    """
+    moves = [move for move in generateLegalMoves(board) if move.promotion in (0, BoardState.QUEEN)]
+    if not moves:
+        return None
+    return moves[rng.integers(len(moves))]
+
+
+def benchmarkMode(renderer, rectify, repeats, numMoves, calibrationFrames, rng):
+    """Time every stage of the processor in one mode (rectified or not) and measure its accuracy"""
+    blankFrame = renderer.render({})
+    feed = RenderedFeed(renderer, {})
+    processor = ChessBoardProcessor(feed, rectify=rectify, boardCorners=renderer.boardCorners)
+    startPosition = dict(processor.pieceAtPosition)
+    stages = {}
+
+    # ============ Board detection stages, on the blank board like the real set up
+    gray = cv2.cvtColor(blankFrame, cv2.COLOR_BGR2GRAY)
+    stages["findChessboardCorners"] = timeStage(lambda: cv2.findChessboardCorners(
+        gray, processor.SIZE_OF_INTERNAL_CORNERS, processor.CORNER_DETECTION_FLAGS), repeats)
+    found, corners = cv2.findChessboardCorners(gray, processor.SIZE_OF_INTERNAL_CORNERS,
+                                               processor.CORNER_DETECTION_FLAGS)
+    cornerError = None
+    if found:
+        corners = corners.reshape((-1, 1, 2))
+        stages["cornerSubPix"] = timeStage(lambda: cv2.cornerSubPix(
+            gray, corners.copy(), processor.SUBPIX_WINDOW_SIZE, (-1, -1), processor.SUBPIX_CRITERIA), repeats)
+        refined = cv2.cornerSubPix(gray, corners.copy(), processor.SUBPIX_WINDOW_SIZE, (-1, -1),
+                                   processor.SUBPIX_CRITERIA)
+        # The private stages are reached through their mangled names, only the benchmark does this
+        construct = processor._ChessBoardProcessor__constructTopDownBoardCorners
+        stages["constructTopDownBoardCorners"] = timeStage(lambda: construct(refined), repeats)
+        ordered = construct(refined)
+        cornerError = float(np.linalg.norm(ordered.reshape((-1, 2)) - renderer.boardCorners.reshape((-1, 2)),
+                                           axis=1).mean())
+
+    # ============ Move detection stages
+    oldFrame = renderer.render(startPosition)
+    movedPosition = dict(startPosition, E2=None, E4="P0")
+    newFrame = renderer.render(movedPosition)
+    if rectify:
+        stages["squareExtraction"] = timeStage(
+            lambda: processor.getRectifiedSquares(processor.rectifyBoard(newFrame)), repeats)
+    else:
+        extract = processor._ChessBoardProcessor__detectIndividualSquareImages
+        stages["squareExtraction"] = timeStage(lambda: extract(newFrame), repeats)
+    oldBoard, newBoard = processor.prepareBoard(oldFrame), processor.prepareBoard(newFrame)
+    stages["squareDifferences"] = timeStage(lambda: processor.computeSquareDifferences(oldBoard, newBoard), repeats)
+
+    classify = processor._ChessBoardProcessor__classifyAndIdentifyMove
+
+    squareScores, threshold = processor.scoreSquareDifferences(processor.computeSquareDifferences(oldBoard, newBoard))
+
+    def resetPosition():
+        processor.boardState = BoardState.startingPosition()
+        processor.currentPlayingSide = 0
+    stages["classifyAndIdentifyMove"] = timeStage(lambda: classify(squareScores, threshold), repeats,
+                                                  setup=resetPosition)
+    resetPosition()
+
+    # ============ Accuracy of the whole detection over a random game
+    feed.pieceAtPosition = startPosition
+    processor.captureNewBoard()
+    processor.setCurrentSquareImages()
+    if calibrationFrames > 0:
+        processor.calibrateNoise(calibrationFrames)
+
+    game = BoardState.startingPosition()
+    playedMoves = 0
+    correctMoves = 0
+    detectTimes = []
+    for _ in range(numMoves):
+        move = randomMove(game, rng)
+        if move is None:
+            break
+        game.applyMove(move)
+        playedMoves += 1
+        expected = game.toPieceDict()
+        feed.pieceAtPosition = expected
+        processor.captureNewBoard()
+
+        start = time.perf_counter()
+        processor.detectMove(capture=False)
+        detectTimes.append((time.perf_counter() - start) * 1000)
+
+        if processor.pieceAtPosition == expected:
+            correctMoves += 1
+        else:
+            # Put the processor back on track so one mistake is counted only once
+            processor.boardState = game.copy()
+            processor.setCurrentSquareImages()
+        processor.changeCurrentPlayingSide()
+    stages["detectMove"] = detectTimes
+
+    return {"stages": {name: summarize(times) for name, times in stages.items()},
+            "accuracy": {"moves": playedMoves, "correctMoves": correctMoves,
+                         "rate": correctMoves / playedMoves if playedMoves else None,
+                         "boardFound": bool(found), "cornerErrorPixels": cornerError}}
+
+
+def runBenchmark(repeats=100, numMoves=40, calibrationFrames=10, perspective=0.08, noise=2.0,
+                 lightingGradient=0.3, seed=0):
+    """Run the benchmark in both the plain and the rectified mode, return the results as a dict"""
+    config = {"repeats": repeats, "moves": numMoves, "calibrationFrames": calibrationFrames,
+              "perspective": perspective, "noise": noise, "lightingGradient": lightingGradient, "seed": seed}
+    results = {"config": config, "modes": {}}
+    for mode, rectify in (("plain", False), ("rectified", True)):
+        renderer = SyntheticBoardRenderer(perspective=perspective, noise=noise, lightingGradient=lightingGradient,
+                                          seed=seed)
+        rng = np.random.default_rng(seed)
+        # The processor prints a lot of debug lines, keep them out of the results
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["modes"][mode] = benchmarkMode(renderer, rectify, repeats, numMoves, calibrationFrames, rng)
+    return results
+
+
+def compareWithBaseline(results, baseline, tolerance=0.2, minimumSlowdown=0.05):
+    """
+    Compare results to the results of an earlier run. Return the list of regressions as strings:
+    the stages whose median latency got slower by more than tolerance (and by more than minimumSlowdown
+    milliseconds, so the timer noise of the tiny stages is ignored), and any drop of accuracy.
+    """
+    regressions = []
+    for mode, modeResults in results["modes"].items():
+        baselineMode = baseline.get("modes", {}).get(mode)
+        if baselineMode is None:
+            continue
+        for stage, summary in modeResults["stages"].items():
+            baselineSummary = baselineMode["stages"].get(stage)
+            if baselineSummary is None:
+                continue
+            slowdown = summary["p50"] - baselineSummary["p50"]
+            if slowdown > baselineSummary["p50"] * tolerance and slowdown > minimumSlowdown:
+                regressions.append("{} {}: p50 {:.3f} ms, baseline {:.3f} ms".format(
+                    mode, stage, summary["p50"], baselineSummary["p50"]))
+        rate, baselineRate = modeResults["accuracy"]["rate"], baselineMode["accuracy"]["rate"]
+        if rate is not None and baselineRate is not None and rate < baselineRate:
+            regressions.append("{} accuracy: {:.3f}, baseline {:.3f}".format(mode, rate, baselineRate))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the vision path on synthetic boards.")
+    parser.add_argument("--output", help="file to write the JSON results to, printed if not given")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown of a stage, 0.2 is 20%%")
+    parser.add_argument("--repeats", type=int, default=100)
+    parser.add_argument("--moves", type=int, default=40)
+    parser.add_argument("--calibration-frames", type=int, default=10)
+    parser.add_argument("--perspective", type=float, default=0.08)
+    parser.add_argument("--noise", type=float, default=2.0)
+    parser.add_argument("--lighting-gradient", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = runBenchmark(args.repeats, args.moves, args.calibration_frames, args.perspective, args.noise,
+                           args.lighting_gradient, args.seed)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            regressions = compareWithBaseline(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION:", regression, file=sys.stderr)
+        sys.exit(1 if regressions else 0)
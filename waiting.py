@@ -0,0 +1,110 @@
+"""
+Waiting primitives for the robot, instead of spinning in "while ...: pass" loops.
+waitUntil polls a condition with a sleep between the polls that grows from interval to maxInterval,
+so a long wait costs almost no CPU while a short one still ends quickly, and gives up after a timeout.
+Every wait is counted in waitStats by name, with the polls, the time waited and the CPU time used.
+The waits use the clock of robotClock, so they are faster than real time on a simulated robot.
+Only the standard library is used, this runs on the robot.
+"""
+import threading
+import time
+
+import robotClock
+
+
+class WaitTimeout(Exception):
+    """Raised when the condition of a wait is still not met after its timeout"""
+    pass
+
+
+class WaitStats:
+    """The number of waits, polls, timeouts, the time waited and the CPU time used while waiting, by wait name"""
+
+    def __init__(self):
+        self.__stats = {}
+        self.__lock = threading.Lock()
+
+    def record(self, name, polls, seconds, cpuSeconds, timedOut):
+        """Method to add one finished wait to the stats of name"""
+        with self.__lock:
+            stats = self.__stats.get(name)
+            if stats is None:
+                stats = self.__stats[name] = {"waits": 0, "polls": 0, "timeouts": 0, "seconds": 0.0,
+                                              "cpuSeconds": 0.0}
+            stats["waits"] += 1
+            stats["polls"] += polls
+            stats["seconds"] += seconds
+            stats["cpuSeconds"] += cpuSeconds
+            if timedOut:
+                stats["timeouts"] += 1
+
+    def toDict(self):
+        """Method to get the stats of every wait name, with the part of the waiting time spent on the CPU"""
+        with self.__lock:
+            result = {}
+            for name, stats in sorted(self.__stats.items()):
+                result[name] = dict(stats)
+                result[name]["cpuRatio"] = stats["cpuSeconds"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+            return result
+
+    def reset(self):
+        """Method to forget all the stats"""
+        with self.__lock:
+            self.__stats = {}
+
+
+# The stats of all the waits of the program
+waitStats = WaitStats()
+
+# The first sleep between 2 polls, the largest one and how much it grows after each poll
+POLL_INTERVAL = 0.005
+MAX_POLL_INTERVAL = 0.05
+BACKOFF = 1.5
+
+# The CPU time of the waiting thread. time.thread_time only exists from Python 3.7 on, the Python 3.5 of the robot
+# counts the CPU time of the whole process instead
+_cpuTime = time.thread_time if hasattr(time, "thread_time") else time.process_time
+
+
+def waitUntil(condition, timeout=None, name="wait", interval=POLL_INTERVAL, maxInterval=MAX_POLL_INTERVAL,
+              backoff=BACKOFF, wakeEvent=None):
+    """
+    Wait until condition() returns a true value, and return that value.
+    The sleep between 2 polls starts at interval and is multiplied by backoff after each poll, up to maxInterval.
+    If wakeEvent (a threading.Event) is set, the sleeps end right away so the condition is polled again,
+    use it with a condition that checks the event, like an emergency stop.
+    Raise WaitTimeout if the condition is still false after timeout seconds (None waits forever).
+    """
+    start = robotClock.monotonic()
+    startCpu = _cpuTime()
+    deadline = None if timeout is None else start + timeout
+    polls = 0
+    try:
+        while True:
+            polls += 1
+            value = condition()
+            if value:
+                waitStats.record(name, polls, robotClock.monotonic() - start, _cpuTime() - startCpu, False)
+                return value
+
+            now = robotClock.monotonic()
+            if deadline is not None and now >= deadline:
+                waitStats.record(name, polls, now - start, _cpuTime() - startCpu, True)
+                raise WaitTimeout("{} still not done after {:.1f} s".format(name, timeout))
+            sleepTime = interval if deadline is None else min(interval, deadline - now)
+            if wakeEvent is not None:
+                robotClock.waitEvent(wakeEvent, sleepTime)
+            else:
+                robotClock.sleep(sleepTime)
+            interval = min(interval * backoff, maxInterval)
+    except WaitTimeout:
+        raise
+    except BaseException:
+        # The condition raised (an emergency stop for example), still count the wait
+        waitStats.record(name, polls, robotClock.monotonic() - start, _cpuTime() - startCpu, False)
+        raise
+
+
+def waitWhile(condition, timeout=None, name="wait", **kwargs):
+    """Wait while condition() returns a true value, see waitUntil for the other arguments"""
+    return waitUntil(lambda: not condition(), timeout, name, **kwargs)